@@ -0,0 +1,823 @@
+import os
+import time
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from file_utils import (copy_tree, copy_paths, load_config, ParallelCopier, verify_destination, scan_tree,
+                        scan_tree_fanout, new_hasher, hash_algo_name, ScanItem, ITEM_DIR, ITEM_FILE, ITEM_LINK,
+                        make_dir, copy_link)
+from manifest import Manifest, INDEX_NAME
+from compression import ChunkCompressor
+from watcher import ChangeQueue, create_watcher
+from snapshots import begin_snapshot, latest_snapshot, prune_snapshots, publish_snapshot
+from chunkstore import ChunkStore, KIND_DIR, KIND_FILE, KIND_LINK
+from packs import PackStore
+from checkpoint import Checkpoint
+from fanout import FanOutCopier
+from scheduler import IOScheduler
+from filters import FilterSet
+from mirror import MirrorCleaner
+from metrics import RunMetrics, timer, write_report, write_prometheus
+
+BackupResult = namedtuple("BackupResult", "found copied failed errors aborted elapsed linked")
+VerifyResult = namedtuple("VerifyResult", "checked mismatched missing aborted elapsed")
+
+# Intervalle minimal entre deux notifications de progression
+PROGRESS_INTERVAL = 0.1
+
+def ignore(*args):
+    """Fonction de rappel par défaut : ne fait rien."""
+
+def _write_metrics(report, options, journal_func):
+    """Écrit le rapport JSON d'une sauvegarde (option metrics_dir) ; les échecs sont seulement journalisés."""
+    directory = options.get("metrics_dir")
+    if not directory:
+        return
+    try:
+        path = write_report(report, directory, int(options.get("metrics_keep", 100) or 0))
+        journal_func(f"Mesures de la sauvegarde enregistrées : {path}")
+    except Exception as e:
+        journal_func(f"Impossible d'enregistrer les mesures de la sauvegarde : {e}")
+
+def _write_prometheus(reports, options, journal_func):
+    path = options.get("metrics_prometheus_file")
+    if not path or not reports:
+        return
+    try:
+        write_prometheus(reports, path)
+    except Exception as e:
+        journal_func(f"Impossible d'écrire le fichier de mesures Prometheus {path} : {e}")
+
+def throttled_progress(func, interval=PROGRESS_INTERVAL):
+    """
+    Enveloppe une fonction de progression : elle n'est appelée que si le pourcentage a changé,
+    et au plus une fois par interval secondes. 100 % est toujours transmis.
+    """
+    if func is None:
+        return ignore
+    lock = threading.Lock()
+    state = [-1, 0.0]
+
+    def progress(percent):
+        now = time.monotonic()
+        with lock:
+            if percent == state[0] or (percent < 100 and now - state[1] < interval):
+                return
+            state[0], state[1] = percent, now
+        func(percent)
+    return progress
+
+class BackupEngine:
+    """
+    Moteur de sauvegarde, indépendant de l'interface graphique.
+    Les notifications passent par trois fonctions de rappel, appelées depuis n'importe quel thread :
+    progress_func(pourcentage), log_func(message d'état court) et journal_func(ligne de journal).
+    """
+    def __init__(self, sources, destination, options=None, paths=None,
+                 progress_func=None, log_func=None, journal_func=None):
+        self.sources = sources
+        self.destination = destination
+        self.options = options if options is not None else load_config()["options"]
+        # paths : {source: [(chemin, récursif), ...]} pour ne sauvegarder que des chemins modifiés
+        self.paths = paths
+        # Un fichier copié ne déclenche pas une notification : la progression est limitée en fréquence
+        self.progress_func = throttled_progress(progress_func)
+        self.log_func = log_func or ignore
+        self.journal_func = journal_func or ignore
+        self._abort = False
+        self._lock = threading.Lock()
+        self.found_files = 0
+        self.copied_files = 0
+        self.linked_files = 0
+        self.errors = 0
+        self._scanning = True
+        self.index = None
+        self.previous_index = None
+        # Mesures de la sauvegarde (temps par phase, débits, erreurs) et rapport une fois terminée
+        self.metrics = None
+        self.report = None
+
+    def abort(self):
+        self._abort = True
+
+    @property
+    def aborted(self):
+        return self._abort
+
+    def _error(self, msg):
+        # Erreurs du parcours et de la copie : comptées pour le code de retour
+        with self._lock:
+            self.errors += 1
+        self.journal_func(msg)
+
+    def _emit_progress(self):
+        with self._lock:
+            # Total découvert au fil du parcours : la progression n'attend pas un comptage préalable
+            percent = int((self.copied_files / (self.found_files or 1)) * 100)
+            if self._scanning:
+                percent = min(percent, 99)
+        self.progress_func(percent)
+
+    def _on_found(self, item):
+        with self._lock:
+            self.found_files += 1
+
+    def _on_copied(self, item, digest):
+        if self.index is not None:
+            with timer(self.metrics, "metadata"):
+                self.index.record(item.rel, item.stat, digest)
+        with self._lock:
+            self.copied_files += 1
+        self._emit_progress()
+
+    def _on_linked(self, item):
+        # Fichier inchangé lié depuis l'instantané précédent : son empreinte est reprise de l'index précédent
+        if self.index is not None:
+            digest = None
+            if self.previous_index is not None:
+                row = self.previous_index.get(item.rel)
+                if row is not None and self.previous_index.matches(row, item.stat):
+                    digest = row[4]
+            with timer(self.metrics, "metadata"):
+                self.index.record(item.rel, item.stat, digest)
+        with self._lock:
+            self.found_files += 1
+            self.copied_files += 1
+            self.linked_files += 1
+        self._emit_progress()
+
+    def _open_index(self, hash_algo, target):
+        if not (self.options.get("incremental_index") or hash_algo):
+            return None
+        try:
+            os.makedirs(target, exist_ok=True)
+            return Manifest(target, log_func=self.journal_func)
+        except Exception as e:
+            self.journal_func(f"Index de sauvegarde indisponible, comparaison directe avec la destination : {e}")
+            return None
+
+    def _finish_metrics(self, result, **extra):
+        # Rapport de mesures de la sauvegarde : journalisé, écrit en JSON et gardé dans self.report
+        self.report = self.metrics.report(result, **extra)
+        self.journal_func(self.metrics.summary())
+        _write_metrics(self.report, self.options, self.journal_func)
+        return result
+
+    def run(self):
+        start_time = time.time()
+        journal = self.journal_func
+        journal("Début de la sauvegarde.")
+        hash_algo = self.options.get("hash_algo") if self.options.get("integrity_check") else None
+        if self.options.get("chunk_store"):
+            self.metrics = RunMetrics(self.destination, "depot")
+            return self._run_chunk_store(start_time, hash_algo)
+        self.metrics = RunMetrics(self.destination, "instantane" if self.options.get("snapshots") else "miroir")
+        target = self.destination
+        snapshot = None
+        if self.options.get("snapshots"):
+            # Un nouvel instantané complet à chaque sauvegarde : les fichiers inchangés sont liés
+            # depuis l'instantané précédent, les autres copiés
+            try:
+                snapshot = begin_snapshot(self.destination, log_func=journal)
+            except Exception as e:
+                self._error(f"Impossible de créer un instantané dans {self.destination} : {e}")
+                self.metrics.error(e)
+                return self._finish_metrics(BackupResult(0, 0, 0, self.errors, self._abort,
+                                                         time.time() - start_time, 0))
+            target = snapshot.partial
+            if self.paths is not None:
+                journal("Mode instantanés : sauvegarde complète plutôt que des seuls chemins modifiés.")
+                self.paths = None
+            if snapshot.previous is not None:
+                journal(f"Instantané de référence : {os.path.basename(snapshot.previous)}")
+                if os.path.exists(os.path.join(snapshot.previous, INDEX_NAME)):
+                    try:
+                        self.previous_index = Manifest(snapshot.previous, log_func=journal)
+                    except Exception:
+                        self.previous_index = None
+        self.index = index = self._open_index(hash_algo, target)
+        workers = self.options.get("parallel_copies", 1)
+        compressor = None
+        if self.options.get("compression"):
+            compressor = ChunkCompressor(self.options.get("compression_algo", "gzip"),
+                                         self.options.get("compression_level", 6), workers,
+                                         log_func=journal)
+        packer = None
+        if self.options.get("pack_small_files") and snapshot is None:
+            # Les instantanés lient des fichiers : les petits fichiers n'y sont pas regroupés
+            try:
+                packer = PackStore(target, int(self.options.get("pack_threshold_kb", 64) * 1024),
+                                   int(self.options.get("pack_size_mb", 256) * 1024 * 1024), log_func=journal)
+            except Exception as e:
+                journal(f"Paquets indisponibles, petits fichiers copiés séparément : {e}")
+        scheduler = IOScheduler.from_options(self.options, log_func=journal)
+        copier = ParallelCopier(workers, log_func=journal, on_copied=self._on_copied,
+                                abort_func=lambda: self._abort, hash_algo=hash_algo,
+                                compressor=compressor,
+                                delta_threshold=int(self.options.get("delta_threshold_mb", 0) * 1024 * 1024),
+                                packer=packer, sync=self.options.get("sync_files", False), scheduler=scheduler,
+                                metrics=self.metrics)
+        # L'index sert toujours à conserver les empreintes, mais ne pilote la comparaison que si demandé
+        # (un instantané neuf est comparé à l'instantané précédent, pas à son propre index)
+        scan_index = index if self.options.get("incremental_index") and snapshot is None else None
+        link_dest = snapshot.previous if snapshot is not None else None
+        filters = FilterSet.from_options(self.options)
+        cleaner = None
+        if self.options.get("mirror_delete") and snapshot is None and self.paths is None:
+            # Les instantanés sont complets par construction : rien à y supprimer
+            cleaner = MirrorCleaner(target, self.options.get("mirror_trash", True),
+                                    self.options.get("trash_retention_days", 30), index=index, packs=packer,
+                                    filters=filters, log_func=journal)
+        checkpoint = None
+        if self.options.get("resume", True) and snapshot is None and self.paths is None:
+            checkpoint = self._open_checkpoint(target, index, packer, cleaner)
+        for src in self.sources:
+            if self._abort:
+                break
+            if self.paths is not None and not self.paths.get(src):
+                continue
+            try:
+                journal(f"Préparation à copier : {src}")
+                self.log_func(f"Copie de {src} vers {target}...")
+                if self.paths is not None:
+                    journal(f"Copie de {len(self.paths[src])} chemins modifiés de {src} vers {self.destination} démarrée.")
+                    copy_paths(src, self.destination, self.paths[src], copier, log_func=self._error,
+                               abort_func=lambda: self._abort, on_found=self._on_found, index=scan_index,
+                               filters=filters)
+                else:
+                    journal(f"Copie de {src} vers {target} démarrée.")
+                    copy_tree(src, target, copier, log_func=self._error,
+                              incremental=True, abort_func=lambda: self._abort, on_found=self._on_found,
+                              index=scan_index, link_dest=link_dest, on_linked=self._on_linked,
+                              checkpoint=checkpoint, filters=filters, cleaner=cleaner)
+                if not self._abort:
+                    journal(f"Parcours de {src} terminé ; les dernières copies se terminent dans le pool.")
+            except Exception as e:
+                self._error(f"Erreur lors de la copie de {src} : {str(e)}")
+        if self._abort:
+            journal("Copie annulée par l'utilisateur.")
+        with self._lock:
+            self._scanning = False
+        # Attend la fin des copies encore en cours dans le pool
+        copier.close()
+        finalize_start = time.perf_counter()
+        if cleaner is not None:
+            self._finish_mirror(cleaner)
+        if checkpoint is not None:
+            try:
+                checkpoint.close(completed=not self._abort)
+            except Exception as e:
+                self._error(f"Erreur lors de l'écriture du journal de reprise : {e}")
+        if filters is not None and filters.summary():
+            journal(filters.summary())
+        if copier.methods:
+            journal(copier.methods_summary())
+        if compressor is not None:
+            journal(compressor.summary())
+        if scheduler is not None and scheduler.summary():
+            journal(scheduler.summary())
+        if packer is not None:
+            try:
+                packer.close()
+                if packer.files:
+                    journal(packer.summary())
+            except Exception as e:
+                self._error(f"Erreur lors de l'écriture des paquets : {e}")
+        if index is not None:
+            if scan_index is not None and self.paths is None and not self._abort and not index.trusted:
+                index.mark_verified()
+            index.close()
+        if self.previous_index is not None:
+            self.previous_index.close()
+        if snapshot is not None:
+            self._finish_snapshot(snapshot)
+        self.metrics.add_phase("finalize", time.perf_counter() - finalize_start)
+        self.progress_func(100)
+        elapsed = time.time() - start_time
+        if self._abort:
+            journal("Fin de la sauvegarde (annulée par l'utilisateur).")
+        else:
+            journal(f"Fin de la sauvegarde. Durée totale : {elapsed:.2f} secondes.")
+            self.log_func("Sauvegarde terminée.")
+        result = BackupResult(self.found_files, self.copied_files, copier.failed,
+                              self.errors + copier.failed, self._abort, elapsed, self.linked_files)
+        return self._finish_metrics(result, methods=dict(copier.methods))
+
+    def _finish_mirror(self, cleaner):
+        journal = self.journal_func
+        try:
+            cleaner.flush()
+            if cleaner.files or cleaner.dirs:
+                journal(cleaner.summary())
+            purged = cleaner.purge_trash()
+            if purged:
+                journal(f"Corbeille : {purged} sauvegardes de plus de {cleaner.retention_days} jours effacées.")
+        except Exception as e:
+            self._error(f"Erreur lors de la suppression des éléments absents de la source : {e}")
+        with self._lock:
+            self.errors += cleaner.errors
+
+    def _open_checkpoint(self, target, index, packer, cleaner=None):
+        # Les dossiers notés terminés dépendent des entrées d'index et des paquets, et des
+        # suppressions du mode miroir : ils sont écrits sur disque avant chaque lot du journal de reprise
+        def flush():
+            if cleaner is not None:
+                cleaner.flush()
+            if index is not None:
+                index.flush()
+            if packer is not None:
+                packer.flush()
+        # Des filtres modifiés invalident les dossiers notés terminés
+        key = "\n".join([os.path.abspath(src) for src in self.sources]
+                        + list(self.options.get("exclude") or []) + list(self.options.get("include") or []))
+        try:
+            checkpoint = Checkpoint(target, key, max_age_hours=self.options.get("resume_max_age_hours", 72),
+                                    on_flush=flush, log_func=self.journal_func)
+        except Exception as e:
+            self.journal_func(f"Journal de reprise indisponible dans {target} : {e}")
+            return None
+        if checkpoint.done:
+            self.journal_func(f"Reprise de la sauvegarde interrompue : {len(checkpoint.done)} dossiers "
+                              "déjà terminés ne sont pas reparcourus.")
+        return checkpoint
+
+    def _run_chunk_store(self, start_time, hash_algo):
+        """
+        Sauvegarde vers le dépôt à blocs (chunkstore) : chaque fichier modifié est découpé et seuls
+        ses blocs inconnus du dépôt sont écrits ; les fichiers inchangés depuis la sauvegarde
+        précédente reprennent sa liste de blocs sans être relus.
+        """
+        journal = self.journal_func
+        try:
+            store = ChunkStore(self.destination, log_func=journal)
+            previous_name = store.latest_backup()
+            previous = store.file_entries(previous_name)
+            name, catalog = store.new_backup()
+        except Exception as e:
+            self._error(f"Dépôt de sauvegarde inutilisable dans {self.destination} : {e}")
+            self.metrics.error(e)
+            return self._finish_metrics(BackupResult(0, 0, 0, self.errors, self._abort,
+                                                     time.time() - start_time, 0))
+        if self.paths is not None:
+            journal("Mode dépôt : sauvegarde complète plutôt que des seuls chemins modifiés.")
+        if previous_name is not None:
+            journal(f"Sauvegarde de référence du dépôt : {previous_name}")
+        workers = max(1, int(self.options.get("parallel_copies", 1) or 1))
+        slots = threading.BoundedSemaphore(workers * 4)
+        failed = [0]
+        scheduler = IOScheduler.from_options(self.options, log_func=journal)
+        filters = FilterSet.from_options(self.options)
+        store_dev = os.stat(store.root).st_dev
+        metrics = self.metrics
+
+        def store_chunks(item, hasher):
+            if scheduler is None:
+                return store.store_file(item.src, hasher)
+            with scheduler.slot(item.stat.st_dev, store_dev) as slot:
+                chunks, size = store.store_file(item.src, hasher,
+                                                lambda n: scheduler.throttle(n, lambda: self._abort))
+                slot.bytes = size
+            return chunks, size
+
+        def store_file(item):
+            try:
+                hasher = new_hasher(hash_algo) if hash_algo else None
+                with metrics.phase("copy") as step:
+                    chunks, size = store_chunks(item, hasher)
+                metrics.file_copied(item.rel, size, step.elapsed)
+                entry = {"p": item.rel, "k": KIND_FILE, "m": item.stat.st_mode, "t": item.stat.st_mtime_ns,
+                         "s": size, "c": chunks}
+                if hasher is not None:
+                    entry["h"] = f"{hash_algo_name(hash_algo)}:{hasher.hexdigest()}"
+                catalog.add(entry)
+                with self._lock:
+                    self.copied_files += 1
+                self._emit_progress()
+            except Exception as e:
+                with self._lock:
+                    failed[0] += 1
+                metrics.file_failed(item.stat.st_size, e)
+                journal(f"Erreur lors de la copie de {item.src} : {e}")
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="depot") as executor:
+            for src in self.sources:
+                if self._abort:
+                    break
+                journal(f"Copie de {src} vers le dépôt {store.root} démarrée.")
+                self.log_func(f"Copie de {src} vers {store.root}...")
+                for item in scan_tree(src, store.root, log_func=self._error, abort_func=lambda: self._abort,
+                                      filters=filters, metrics=metrics):
+                    if self._abort:
+                        break
+                    st = item.stat
+                    try:
+                        if item.kind == ITEM_DIR:
+                            catalog.add({"p": item.rel, "k": KIND_DIR, "m": st.st_mode, "t": st.st_mtime_ns})
+                        elif item.kind == ITEM_LINK:
+                            with metrics.phase("metadata"):
+                                catalog.add({"p": item.rel, "k": KIND_LINK, "l": os.readlink(item.src)})
+                        elif item.kind == ITEM_FILE:
+                            old = previous.get(item.rel)
+                            if old is not None and old["s"] == st.st_size and old["t"] == st.st_mtime_ns:
+                                # Inchangé : mêmes blocs que dans la sauvegarde précédente
+                                catalog.add(dict(old, m=st.st_mode))
+                                metrics.file_skipped(st.st_size, linked=True)
+                                self._on_linked(item)
+                                continue
+                            self._on_found(item)
+                            slots.acquire()
+                            executor.submit(store_file, item)
+                        else:
+                            journal(f"Type de fichier non géré : {item.src}")
+                    except Exception as e:
+                        metrics.error(e)
+                        self._error(f"Erreur lors du traitement de {item.src} : {e}")
+                if not self._abort:
+                    journal(f"Parcours de {src} terminé ; les dernières copies se terminent dans le pool.")
+            with self._lock:
+                self._scanning = False
+        finalize_start = time.perf_counter()
+        if self._abort:
+            catalog.discard()
+            journal("Copie annulée par l'utilisateur.")
+            journal("Fin de la sauvegarde (annulée par l'utilisateur).")
+        else:
+            catalog.commit()
+            if filters is not None and filters.summary():
+                journal(filters.summary())
+            journal(store.summary())
+            if scheduler is not None and scheduler.summary():
+                journal(scheduler.summary())
+            journal(f"Sauvegarde {name} enregistrée dans le dépôt : {catalog.entries} éléments, "
+                    f"{self.linked_files} fichiers inchangés repris.")
+            keep_daily, keep_weekly, keep_last = self._retention()
+            # Mêmes règles que les instantanés ; toutes les limites à zéro : rien n'est supprimé
+            if keep_last or keep_daily or keep_weekly:
+                try:
+                    store.prune(keep_daily, keep_weekly, keep_last)
+                except Exception as e:
+                    self._error(f"Rétention du dépôt impossible : {e}")
+        metrics.add_phase("finalize", time.perf_counter() - finalize_start)
+        elapsed = time.time() - start_time
+        if not self._abort:
+            journal(f"Fin de la sauvegarde. Durée totale : {elapsed:.2f} secondes.")
+            self.log_func("Sauvegarde terminée.")
+        self.progress_func(100)
+        result = BackupResult(self.found_files, self.copied_files, failed[0],
+                              self.errors + failed[0], self._abort, elapsed, self.linked_files)
+        return self._finish_metrics(result, backup=name, new_chunks=store.new_chunks,
+                                    reused_chunks=store.reused_chunks, bytes_stored=store.bytes_stored)
+
+    def _finish_snapshot(self, snapshot):
+        journal = self.journal_func
+        if self._abort:
+            # L'instantané incomplet garde son suffixe : il sera supprimé à la prochaine sauvegarde
+            journal(f"Instantané incomplet conservé provisoirement : {snapshot.partial}")
+            return
+        try:
+            publish_snapshot(snapshot)
+        except Exception as e:
+            self._error(f"Impossible de finaliser l'instantané {snapshot.partial} : {e}")
+            return
+        journal(f"Instantané {os.path.basename(snapshot.final)} créé : {self.linked_files} fichiers inchangés liés, "
+                f"{self.copied_files - self.linked_files} copiés.")
+        keep_daily, keep_weekly, keep_last = self._retention()
+        # Toutes les limites à zéro : aucun instantané n'est supprimé
+        if keep_last or keep_daily or keep_weekly:
+            prune_snapshots(self.destination, keep_daily, keep_weekly, keep_last, log_func=journal)
+
+    def _retention(self):
+        """Politique de rétention des instantanés et des sauvegardes du dépôt : (jours, semaines, dernières)."""
+        return (self.options.get("snapshot_keep_daily", 7), self.options.get("snapshot_keep_weekly", 4),
+                self.options.get("snapshot_keep_last", 3))
+
+class MultiBackupEngine:
+    """
+    Sauvegarde des mêmes sources vers plusieurs destinations. En mode miroir, les sources ne sont
+    parcourues qu'une fois (scan_tree_fanout) et chaque fichier modifié n'est lu qu'une fois,
+    puis écrit en parallèle dans toutes les destinations qui en ont besoin (fanout.FanOutCopier).
+    Une destination lente ou en échec ne bloque pas les autres ; le journal fait le bilan par destination.
+    Les autres modes (instantanés, dépôt, compression, paquets, chemins modifiés) et le cas d'une
+    seule destination passent par un BackupEngine par destination, l'une après l'autre.
+    run() retourne la liste des BackupResult, dans l'ordre des destinations.
+    """
+    def __init__(self, sources, destinations, options=None, paths=None,
+                 progress_func=None, log_func=None, journal_func=None):
+        self.sources = sources
+        self.destinations = list(destinations)
+        self.options = options if options is not None else load_config()["options"]
+        self.paths = paths
+        self.raw_progress_func = progress_func
+        self.progress_func = throttled_progress(progress_func)
+        self.log_func = log_func or ignore
+        self.journal_func = journal_func or ignore
+        self._abort = False
+        self._lock = threading.Lock()
+        self._engine = None
+        self.reports = []
+        self.found_files = 0
+        self.done_files = 0
+        self._scanning = True
+
+    def abort(self):
+        self._abort = True
+        engine = self._engine
+        if engine is not None:
+            engine.abort()
+
+    @property
+    def aborted(self):
+        return self._abort
+
+    def _fan_out_possible(self):
+        options = self.options
+        return (len(self.destinations) > 1 and self.paths is None and not options.get("snapshots")
+                and not options.get("chunk_store") and not options.get("compression")
+                and not options.get("pack_small_files") and not options.get("mirror_delete"))
+
+    def run(self):
+        """Lance la sauvegarde ; les rapports de mesures de chaque destination sont ensuite dans self.reports."""
+        self.reports = []
+        if self._fan_out_possible():
+            results = self._run_fan_out()
+        else:
+            if len(self.destinations) > 1:
+                self.journal_func("Sauvegarde vers plusieurs destinations, l'une après l'autre "
+                                  "(lecture unique réservée au mode miroir sans compression, paquets ni suppressions).")
+            results = []
+            for destination in self.destinations:
+                if self._abort:
+                    break
+                self._engine = BackupEngine(self.sources, destination, self.options, self.paths,
+                                            progress_func=self.raw_progress_func, log_func=self.log_func,
+                                            journal_func=self.journal_func)
+                results.append(self._engine.run())
+                self.reports.append(self._engine.report)
+        # Un seul fichier Prometheus pour toutes les destinations de la sauvegarde
+        _write_prometheus(self.reports, self.options, self.journal_func)
+        return results
+
+    def _emit_progress(self):
+        with self._lock:
+            percent = int((self.done_files / (self.found_files or 1)) * 100)
+            if self._scanning:
+                percent = min(percent, 99)
+        self.progress_func(percent)
+
+    def _run_fan_out(self):
+        start_time = time.time()
+        journal = self.journal_func
+        journal(f"Début de la sauvegarde vers {len(self.destinations)} destinations (lecture unique des sources).")
+        hash_algo = self.options.get("hash_algo") if self.options.get("integrity_check") else None
+        count = len(self.destinations)
+        # Parcours et lectures communs, puis mesures propres à chaque destination
+        shared = RunMetrics("", "lecture unique")
+        dest_metrics = [RunMetrics(destination, "miroir") for destination in self.destinations]
+        copied = [0] * count
+        failed = [0] * count
+        errors = [0] * count
+        indexes = []
+        for destination in self.destinations:
+            index = None
+            if self.options.get("incremental_index") or hash_algo:
+                try:
+                    os.makedirs(destination, exist_ok=True)
+                    index = Manifest(destination, log_func=journal)
+                except Exception as e:
+                    journal(f"[{destination}] Index de sauvegarde indisponible, comparaison directe : {e}")
+            indexes.append(index)
+        scan_indexes = indexes if self.options.get("incremental_index") else [None] * count
+
+        def on_copied(position, item, digest):
+            if indexes[position] is not None:
+                with dest_metrics[position].phase("metadata"):
+                    indexes[position].record(item.rel, item.stat, digest)
+            with self._lock:
+                copied[position] += 1
+                self.done_files += 1
+            self._emit_progress()
+
+        def on_failed(position, item):
+            with self._lock:
+                failed[position] += 1
+                self.done_files += 1
+            self._emit_progress()
+
+        def scan_error(msg):
+            # Erreur de lecture d'une source : elle concerne toutes les destinations
+            with self._lock:
+                for position in range(count):
+                    errors[position] += 1
+            journal(msg)
+
+        scheduler = IOScheduler.from_options(self.options, log_func=journal)
+        filters = FilterSet.from_options(self.options)
+        copier = FanOutCopier(self.destinations, self.options.get("parallel_copies", 1), log_func=journal,
+                              on_copied=on_copied, on_failed=on_failed, abort_func=lambda: self._abort,
+                              hash_algo=hash_algo,
+                              delta_threshold=int(self.options.get("delta_threshold_mb", 0) * 1024 * 1024),
+                              sync=self.options.get("sync_files", False), scheduler=scheduler,
+                              metrics=shared, dest_metrics=dest_metrics)
+        for src in self.sources:
+            if self._abort:
+                break
+            journal(f"Copie de {src} vers {count} destinations démarrée.")
+            self.log_func(f"Copie de {src} vers {count} destinations...")
+            for item in scan_tree_fanout(src, self.destinations, log_func=scan_error,
+                                         abort_func=lambda: self._abort, indexes=scan_indexes, filters=filters,
+                                         metrics=shared, dest_metrics=dest_metrics):
+                if self._abort:
+                    break
+                if item.kind == ITEM_FILE:
+                    with self._lock:
+                        self.found_files += len(item.targets)
+                    copier.submit(item)
+                    continue
+                for position, dst, exists in item.targets:
+                    writer = copier.writers[position]
+                    if writer.broken is not None:
+                        continue
+                    single = ScanItem(item.kind, item.src, dst, item.rel, item.stat, exists)
+                    try:
+                        with dest_metrics[position].phase("metadata"):
+                            if item.kind == ITEM_DIR:
+                                make_dir(single, journal)
+                                index = indexes[position]
+                                if index is not None and not exists:
+                                    if "/" not in item.rel:
+                                        index.set_root(item.rel, dst)
+                                    index.record_dir(item.rel)
+                            elif item.kind == ITEM_LINK:
+                                copy_link(single)
+                            else:
+                                shutil.copy(item.src, dst, follow_symlinks=False)
+                    except Exception as e:
+                        dest_metrics[position].error(e)
+                        with self._lock:
+                            errors[position] += 1
+                        journal(f"[{self.destinations[position]}] Erreur lors du traitement de {item.src} : {e}")
+            if not self._abort:
+                journal(f"Copie de {src} terminée.")
+        if self._abort:
+            journal("Copie annulée par l'utilisateur.")
+        with self._lock:
+            self._scanning = False
+        copier.close()
+        if filters is not None and filters.summary():
+            journal(filters.summary())
+        if scheduler is not None and scheduler.summary():
+            journal(scheduler.summary())
+        elapsed = time.time() - start_time
+        results = []
+        for position, destination in enumerate(self.destinations):
+            writer = copier.writers[position]
+            index = indexes[position]
+            if index is not None:
+                with dest_metrics[position].phase("finalize"):
+                    if (self.options.get("incremental_index") and not self._abort and writer.broken is None
+                            and not index.trusted):
+                        index.mark_verified()
+                    index.close()
+            status = f"abandonnée ({writer.broken})" if writer.broken is not None else "terminée"
+            journal(
+                f"[{destination}] Sauvegarde {status} : {copied[position]} fichiers copiés "
+                f"({writer.streamed} en lecture partagée, {writer.separate} copiés séparément, "
+                f"{writer.stalls} retards), "
+                f"{failed[position]} échecs, {writer.bytes / (1024 * 1024):.2f} Mo écrits."
+            )
+            found = copied[position] + failed[position]
+            abandoned = 1 if writer.broken is not None else 0
+            results.append(BackupResult(found, copied[position], failed[position],
+                                        errors[position] + failed[position] + abandoned, self._abort, elapsed, 0))
+        self.progress_func(100)
+        if self._abort:
+            journal("Fin de la sauvegarde (annulée par l'utilisateur).")
+        else:
+            journal(f"Fin de la sauvegarde. Durée totale : {elapsed:.2f} secondes.")
+            self.log_func("Sauvegarde terminée.")
+        for position, (metrics, result) in enumerate(zip(dest_metrics, results)):
+            writer = copier.writers[position]
+            metrics.merge_shared(shared)
+            journal(f"[{self.destinations[position]}] {metrics.summary()}")
+            report = metrics.report(result, streamed=writer.streamed, separate=writer.separate, stalls=writer.stalls,
+                                    abandoned=writer.broken)
+            _write_metrics(report, self.options, journal)
+            self.reports.append(report)
+        return results
+
+def verify(destination, options=None, progress_func=None, journal_func=None, abort_func=None):
+    """
+    Vérifie l'intégrité d'une destination à partir des empreintes de son index.
+    Retourne un VerifyResult, ou None si la destination n'a pas d'empreintes enregistrées.
+    """
+    options = options if options is not None else load_config()["options"]
+    journal = journal_func or ignore
+    progress_func = throttled_progress(progress_func)
+    start_time = time.time()
+    if ChunkStore.exists(destination) and not os.path.exists(os.path.join(destination, INDEX_NAME)):
+        return _verify_chunk_store(destination, journal, progress_func, abort_func, start_time)
+    if not os.path.exists(os.path.join(destination, INDEX_NAME)) and latest_snapshot(destination):
+        # Destination en mode instantanés : c'est le dernier instantané qui est vérifié
+        destination = latest_snapshot(destination)
+    journal(f"Vérification de l'intégrité de {destination} démarrée.")
+    if not os.path.exists(os.path.join(destination, INDEX_NAME)):
+        journal("Aucune empreinte enregistrée pour cette destination : vérification impossible.")
+        return None
+    try:
+        packs = PackStore(destination) if PackStore.exists(destination) else None
+        try:
+            with Manifest(destination, log_func=journal) as index:
+                checked, mismatched, missing = verify_destination(
+                    index, options.get("parallel_copies", 1), log_func=journal,
+                    progress_func=progress_func, abort_func=abort_func, packs=packs)
+        finally:
+            if packs is not None:
+                packs.close()
+    except Exception as e:
+        journal(f"Erreur lors de la vérification de {destination} : {e}")
+        return None
+    progress_func(100)
+    elapsed = time.time() - start_time
+    journal(
+        f"Fin de la vérification : {checked} fichiers relus, {mismatched} différents, "
+        f"{missing} absents. Durée totale : {elapsed:.2f} secondes."
+    )
+    return VerifyResult(checked, mismatched, missing, bool(abort_func and abort_func()), elapsed)
+
+def _verify_chunk_store(destination, journal, progress_func, abort_func, start_time):
+    # Dépôt à blocs : chaque bloc de la dernière sauvegarde est relu et son empreinte contrôlée
+    try:
+        store = ChunkStore(destination, log_func=journal)
+        name = store.latest_backup()
+        if name is None:
+            journal("Aucune sauvegarde dans le dépôt : vérification impossible.")
+            return None
+        journal(f"Vérification de la sauvegarde {name} du dépôt {store.root} démarrée.")
+        checked, corrupt, missing = store.verify(name, log_func=journal, progress_func=progress_func,
+                                                 abort_func=abort_func)
+    except Exception as e:
+        journal(f"Erreur lors de la vérification de {destination} : {e}")
+        return None
+    progress_func(100)
+    elapsed = time.time() - start_time
+    journal(
+        f"Fin de la vérification : {checked} blocs relus, {corrupt} corrompus, "
+        f"{missing} absents. Durée totale : {elapsed:.2f} secondes."
+    )
+    return VerifyResult(checked, corrupt, missing, bool(abort_func and abort_func()), elapsed)
+
+class WatchSession:
+    """
+    Sauvegarde continue : surveille les sources et décide, à chaque appel de next_batch(),
+    s'il faut lancer une sauvegarde complète, une sauvegarde des chemins modifiés, ou rien.
+    Une sauvegarde complète est demandée au démarrage, périodiquement, et après un débordement.
+    """
+    FULL = "full"
+    PATHS = "paths"
+
+    def __init__(self, sources, options=None, journal_func=None):
+        options = options if options is not None else load_config()["options"]
+        self.sources = sources
+        self.journal_func = journal_func or ignore
+        self.queue = ChangeQueue(debounce=options.get("watch_debounce_seconds", 5))
+        self.watcher = create_watcher(sources, self.queue, options.get("watch_poll_seconds", 60),
+                                      log_func=self.journal_func)
+        self.full_scan_interval = options.get("watch_full_scan_minutes", 360) * 60
+        # Une première sauvegarde complète sert de point de départ à la surveillance
+        self.next_full_scan = time.monotonic()
+
+    def start(self):
+        self.watcher.start()
+
+    def stop(self):
+        self.watcher.stop()
+
+    def pending(self):
+        return self.queue.pending()
+
+    def next_batch(self):
+        """Retourne (FULL, None), (PATHS, {source: [(chemin, récursif), ...]}) ou None."""
+        if time.monotonic() >= self.next_full_scan:
+            # Vérification complète périodique : rattrape ce que la surveillance n'a pas vu
+            self.queue.drain(force=True)
+            self.next_full_scan = time.monotonic() + self.full_scan_interval
+            return self.FULL, None
+        batch = self.queue.drain()
+        if batch is None:
+            return None
+        changed, overflow = batch
+        if overflow:
+            self.journal_func("Trop de modifications simultanées : sauvegarde complète.")
+            self.next_full_scan = time.monotonic() + self.full_scan_interval
+            return self.FULL, None
+        paths = {}
+        for path, recursive in changed:
+            for src in self.sources:
+                root = os.path.abspath(src)
+                if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                    paths.setdefault(src, []).append((path, recursive))
+                    break
+        return (self.PATHS, paths) if paths else None
@@ -0,0 +1,381 @@
+"""
+Banc d'essai des chemins de parcours et de copie.
+
+Génère des arborescences synthétiques reproductibles dans un dossier temporaire
+(beaucoup de petits fichiers, arborescence profonde, gros fichiers, fichiers creux,
+liens symboliques), puis mesure pour chacune :
+  - scan : parcours seul, vers une destination vide (équivalent de l'ancien comptage des fichiers)
+  - full : sauvegarde complète vers une destination vide
+  - incremental : nouvelle sauvegarde sans aucune modification
+  - incremental_modified : nouvelle sauvegarde après modification d'environ 1 % des fichiers
+
+Chaque mesure tourne dans un processus neuf, pour que le pic de mémoire (RSS) lui soit propre.
+Les résultats sont écrits en JSON pour comparer les exécutions dans le temps :
+
+    python benchmark.py --output resultats.json
+    python benchmark.py --scale 0.2 --scenario tiny --scenario deep
+    python benchmark.py --output nouveau.json --compare resultats.json
+"""
+import argparse
+import builtins
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SEED = 20240601
+
+PHASES = ("scan", "full", "incremental", "incremental_modified")
+
+# Appels os comptés pendant les mesures (en plus des compteurs du noyau de /proc/self/io)
+COUNTED_OS_CALLS = (
+    "stat", "lstat", "scandir", "listdir", "open", "mkdir", "makedirs", "utime", "chmod",
+    "readlink", "symlink", "copy_file_range", "sendfile", "lseek", "replace",
+)
+
+# ---------------------------------------------------------------------------
+# Génération des arborescences
+# ---------------------------------------------------------------------------
+
+def _write(path, rng, size):
+    with open(path, "wb") as f:
+        f.write(rng.randbytes(size))
+
+def make_tiny(root, rng, scale):
+    """Beaucoup de petits fichiers (0 à 4 Kio) répartis dans une centaine de dossiers."""
+    count = max(1, int(5000 * scale))
+    dirs = max(1, count // 50)
+    for i in range(count):
+        folder = os.path.join(root, f"d{i % dirs:03d}")
+        os.makedirs(folder, exist_ok=True)
+        _write(os.path.join(folder, f"f{i:05d}.txt"), rng, rng.randint(0, 4096))
+
+def make_deep(root, rng, scale):
+    """Arborescence profonde : une chaîne de dossiers imbriqués, quelques fichiers à chaque niveau."""
+    depth = max(1, int(100 * scale))
+    folder = root
+    for level in range(depth):
+        folder = os.path.join(folder, f"n{level:03d}")
+        os.makedirs(folder, exist_ok=True)
+        for i in range(3):
+            _write(os.path.join(folder, f"f{i}.dat"), rng, rng.randint(256, 8192))
+
+def make_huge(root, rng, scale):
+    """Quelques gros fichiers."""
+    os.makedirs(root, exist_ok=True)
+    size = max(1024 * 1024, int(64 * 1024 * 1024 * scale))
+    block = 4 * 1024 * 1024
+    for i in range(4):
+        with open(os.path.join(root, f"gros{i}.bin"), "wb") as f:
+            remaining = size
+            while remaining:
+                n = min(block, remaining)
+                f.write(rng.randbytes(n))
+                remaining -= n
+
+def make_sparse(root, rng, scale):
+    """Fichiers creux : grande taille apparente, quelques zones de données seulement."""
+    os.makedirs(root, exist_ok=True)
+    size = max(8 * 1024 * 1024, int(256 * 1024 * 1024 * scale))
+    for i in range(4):
+        with open(os.path.join(root, f"creux{i}.img"), "wb") as f:
+            f.truncate(size)
+            for _ in range(3):
+                f.seek(rng.randrange(0, size - 1024 * 1024) // 4096 * 4096)
+                f.write(rng.randbytes(1024 * 1024))
+
+def make_links(root, rng, scale):
+    """Liens symboliques vers des fichiers, des dossiers et des cibles absentes."""
+    targets = os.path.join(root, "cibles")
+    links = os.path.join(root, "liens")
+    os.makedirs(targets, exist_ok=True)
+    os.makedirs(links, exist_ok=True)
+    count = max(1, int(500 * scale))
+    for i in range(max(1, count // 10)):
+        os.makedirs(os.path.join(targets, f"dossier{i}"), exist_ok=True)
+    for i in range(count):
+        _write(os.path.join(targets, f"f{i:04d}.txt"), rng, rng.randint(0, 2048))
+    for i in range(count):
+        kind = i % 10
+        if kind == 0:
+            target = os.path.join("..", "cibles", f"dossier{i // 10}")
+        elif kind == 1:
+            target = os.path.join("..", "cibles", f"absent{i}")
+        else:
+            target = os.path.join("..", "cibles", f"f{i:04d}.txt")
+        os.symlink(target, os.path.join(links, f"lien{i:04d}"))
+
+SCENARIOS = {
+    "tiny": make_tiny,
+    "deep": make_deep,
+    "huge": make_huge,
+    "sparse": make_sparse,
+    "links": make_links,
+}
+
+def _tree_stats(root):
+    files = dirs = links = 0
+    apparent = 0
+    for path, dirnames, filenames in os.walk(root):
+        dirs += 1
+        for name in dirnames + filenames:
+            full = os.path.join(path, name)
+            if os.path.islink(full):
+                links += 1
+            elif name in filenames:
+                files += 1
+                apparent += os.lstat(full).st_size
+    return {"files": files, "dirs": dirs, "links": links, "bytes": apparent}
+
+def modify_some(root, rng, fraction=0.01):
+    """Modifie environ fraction des fichiers (ajout en fin de fichier) ; retourne leur nombre."""
+    candidates = []
+    for path, _, filenames in os.walk(root):
+        for name in filenames:
+            full = os.path.join(path, name)
+            if not os.path.islink(full):
+                candidates.append(full)
+    candidates.sort()
+    chosen = rng.sample(candidates, max(1, int(len(candidates) * fraction))) if candidates else []
+    later = time.time() + 2
+    for path in chosen:
+        with open(path, "ab") as f:
+            f.write(rng.randbytes(128))
+        # Date nettement postérieure à la copie, même sur un système de fichiers à 2 s de précision
+        os.utime(path, (later, later))
+    return len(chosen)
+
+# ---------------------------------------------------------------------------
+# Mesure (dans un processus dédié)
+# ---------------------------------------------------------------------------
+
+def _read_proc_io():
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(":") for line in f)}
+    except (OSError, ValueError):
+        return None
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Octets sous macOS, Kio ailleurs
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+class _CallCounter:
+    """Remplace temporairement des fonctions de os (et open) par des versions qui comptent leurs appels."""
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._saved = []
+
+    def _wrap(self, module, name, label):
+        original = getattr(module, name, None)
+        if original is None:
+            return
+        counts, lock = self.counts, self._lock
+
+        def counted(*args, **kwargs):
+            with lock:
+                counts[label] += 1
+            return original(*args, **kwargs)
+        self._saved.append((module, name, original))
+        setattr(module, name, counted)
+
+    def __enter__(self):
+        for name in COUNTED_OS_CALLS:
+            self._wrap(os, name, name)
+        self._wrap(builtins, "open", "open_file")
+        return self
+
+    def __exit__(self, *exc):
+        for module, name, original in reversed(self._saved):
+            setattr(module, name, original)
+
+def _measure(phase, src, dst, options, queue):
+    from file_utils import scan_tree
+    from backup_engine import BackupEngine
+
+    copied = {"files": 0, "bytes": 0}
+    lock = threading.Lock()
+    io_before = _read_proc_io()
+    with _CallCounter() as counter:
+        start = time.perf_counter()
+        if phase == "scan":
+            items = 0
+            for item in scan_tree(src, dst, incremental=True):
+                items += 1
+            result = {"found": items, "errors": 0}
+            scanned = items
+        else:
+            # Aucun fichier hors des dossiers temporaires : pas de rapport de mesures
+            engine = BackupEngine([src], dst, dict(options, metrics_dir="", metrics_prometheus_file=""))
+            on_copied = engine._on_copied
+
+            def count_copied(item, digest):
+                with lock:
+                    copied["files"] += 1
+                    copied["bytes"] += item.stat.st_size
+                on_copied(item, digest)
+            engine._on_copied = count_copied
+            result = engine.run()._asdict()
+            # Fichiers examinés : copiés, inchangés, liés ou en échec
+            scanned = sum(engine.report["files"].values())
+            result.pop("elapsed")
+            result.pop("aborted")
+        elapsed = time.perf_counter() - start
+    io_after = _read_proc_io()
+    seconds = elapsed or 1e-9
+    # Une sauvegarde incrémentale copie peu de fichiers : son débit se mesure en fichiers examinés
+    count = copied["files"] if phase == "full" else scanned
+    measure = {
+        "elapsed": round(elapsed, 4),
+        "files_per_s": round(count / seconds, 1),
+        "mb_per_s": round(copied["bytes"] / (1024 * 1024) / seconds, 2),
+        "copied_bytes": copied["bytes"],
+        "scanned_files": scanned,
+        "result": result,
+        "os_calls": dict(sorted(counter.counts.items())),
+        "proc_io": ({key: io_after[key] - io_before[key] for key in io_after}
+                    if io_before and io_after else None),
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+    queue.put(measure)
+
+def run_phase(phase, src, dst, options):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(phase, src, dst, options, queue))
+    process.start()
+    try:
+        measure = queue.get()
+    finally:
+        process.join()
+    return measure
+
+# ---------------------------------------------------------------------------
+# Orchestration
+# ---------------------------------------------------------------------------
+
+def run_scenario(name, workdir, scale, options, log):
+    rng = random.Random(f"{SEED}-{name}")
+    src = os.path.join(workdir, name, "src")
+    dst = os.path.join(workdir, name, "dst")
+    os.makedirs(src)
+    try:
+        start = time.perf_counter()
+        SCENARIOS[name](src, rng, scale)
+    except (OSError, NotImplementedError) as e:
+        # Par exemple des liens symboliques sans les droits nécessaires sous Windows
+        log(f"{name} : génération impossible ({e}), scénario ignoré.")
+        return None
+    generated = time.perf_counter() - start
+    tree = _tree_stats(src)
+    log(f"{name} : {tree['files']} fichiers, {tree['dirs']} dossiers, {tree['links']} liens, "
+        f"{tree['bytes'] / (1024 * 1024):.1f} Mo (générés en {generated:.1f} s)")
+    phases = {}
+    for phase in PHASES:
+        if phase == "incremental_modified":
+            modified = modify_some(src, rng)
+            log(f"  {modified} fichiers modifiés")
+        measure = run_phase(phase, src, dst, options)
+        phases[phase] = measure
+        log(f"  {phase:<22} {measure['elapsed']:>8.3f} s  {measure['files_per_s']:>10.1f} fichiers/s  "
+            f"{measure['mb_per_s']:>8.2f} Mo/s  RSS max {measure['peak_rss_kb'] or 0} Kio")
+    shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+    return {"tree": tree, "phases": phases}
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(current, previous, log):
+    """Affiche l'évolution du débit (fichiers/s) par rapport à une exécution précédente."""
+    log("Comparaison avec l'exécution précédente (fichiers/s) :")
+    for name, scenario in current["scenarios"].items():
+        old = (previous.get("scenarios") or {}).get(name)
+        if not scenario or not old:
+            continue
+        for phase, measure in scenario["phases"].items():
+            before = old["phases"].get(phase, {}).get("files_per_s")
+            if not before:
+                continue
+            change = (measure["files_per_s"] - before) / before * 100
+            log(f"  {name:<8} {phase:<22} {before:>10.1f} -> {measure['files_per_s']:>10.1f}  ({change:+.1f} %)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai du parcours et de la copie.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scénario à exécuter (tous par défaut, option répétable)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="facteur appliqué au nombre et à la taille des fichiers générés")
+    parser.add_argument("--workers", type=int, default=None, help="nombre de copies parallèles")
+    parser.add_argument("--config", default=None,
+                        help="config.json dont les options sont utilisées (options par défaut sinon)")
+    parser.add_argument("--workdir", default=None,
+                        help="dossier temporaire de travail (un dossier du système par défaut)")
+    parser.add_argument("--output", default=None, help="fichier JSON de résultats (sortie standard sinon)")
+    parser.add_argument("--compare", default=None, help="fichier JSON d'une exécution précédente")
+    args = parser.parse_args(argv)
+
+    from file_utils import DEFAULT_OPTIONS, load_config
+    options = load_config(args.config)["options"] if args.config else dict(DEFAULT_OPTIONS)
+    if args.workers:
+        options["parallel_copies"] = args.workers
+
+    def log(msg):
+        print(msg, file=sys.stderr, flush=True)
+
+    report = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": SEED,
+        "scale": args.scale,
+        "options": options,
+        "scenarios": {},
+    }
+    workdir = tempfile.mkdtemp(prefix="banc-sauvegarde-", dir=args.workdir)
+    try:
+        for name in args.scenario or SCENARIOS:
+            report["scenarios"][name] = run_scenario(name, workdir, args.scale, options, log)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log(f"Résultats écrits dans {args.output}")
+    else:
+        print(text)
+    if args.compare:
+        try:
+            with open(args.compare, encoding="utf-8") as f:
+                compare(report, json.load(f), log)
+        except (OSError, ValueError) as e:
+            log(f"Comparaison impossible : {e}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
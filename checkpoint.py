@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+# Journal de reprise, à la racine de la destination ; supprimé à la fin d'une sauvegarde complète
+CHECKPOINT_NAME = ".sauvegarde_reprise.jsonl"
+
+class Checkpoint:
+    """
+    Journal de reprise d'une sauvegarde miroir : la liste des dossiers entièrement traités
+    (parcourus, et dont toutes les copies sont terminées), écrite sur disque par lots.
+    Si la sauvegarde est interrompue (annulation, veille, plantage), l'exécution suivante
+    retrouve ce journal et ne reparcourt pas ces dossiers.
+    Un dossier n'est noté terminé qu'une fois toutes les copies soumises avant la fin de son
+    parcours achevées ; un échec de copie ou de parcours empêche de le noter, ainsi que ses parents.
+    on_flush est appelé avant chaque écriture du journal, pour rendre durables les données
+    dont il dépend (index, paquets). Utilisable depuis plusieurs threads.
+    """
+    def __init__(self, destination, key, batch_size=200, max_age_hours=72, on_flush=None, log_func=None):
+        self.path = os.path.join(destination, CHECKPOINT_NAME)
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.log_func = log_func
+        self._lock = threading.Lock()
+        # Dossiers terminés lors de l'exécution interrompue précédente
+        self.done = set()
+        self._issued = 0
+        self._running = set()
+        self._waiting = deque()
+        # Dossiers contenant un élément en échec (et tous leurs parents)
+        self._dirty = set()
+        self._pending = []
+        header = self._load(key, max_age_hours)
+        if header is None:
+            header = {"cle": key, "debut": time.time()}
+            self._file = open(self.path, "w", encoding="utf-8")
+            self._file.write(json.dumps(header, ensure_ascii=False) + "\n")
+            self._sync()
+        else:
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    def _load(self, key, max_age_hours):
+        # Retourne l'en-tête du journal précédent s'il peut être repris, sinon None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if header.get("cle") != key or time.time() - header.get("debut", 0) > max_age_hours * 3600:
+                    self._log("Journal de reprise d'une autre sauvegarde ou trop ancien : sauvegarde complète.")
+                    return None
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)["d"])
+                    except (ValueError, KeyError, TypeError):
+                        # Dernière ligne tronquée par une interruption
+                        continue
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self._log(f"Journal de reprise illisible, sauvegarde complète : {e}")
+            return None
+        return header
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def skip(self, rel):
+        """True si le dossier rel a été entièrement traité par l'exécution interrompue."""
+        return rel in self.done
+
+    def submitted(self):
+        """À appeler avant de soumettre une copie ; retourne son numéro pour finished()."""
+        with self._lock:
+            self._issued += 1
+            self._running.add(self._issued)
+            return self._issued
+
+    def finished(self, number, ok, rel):
+        with self._lock:
+            self._running.discard(number)
+            if not ok:
+                self._mark_dirty(rel)
+            self._advance_locked()
+
+    def failed(self, rel):
+        """Élément qui n'a pas pu être traité : ses dossiers parents ne seront pas notés terminés."""
+        with self._lock:
+            self._mark_dirty(rel)
+
+    def _mark_dirty(self, rel):
+        while rel and rel not in self._dirty:
+            self._dirty.add(rel)
+            rel = rel.rpartition("/")[0]
+
+    def dir_done(self, rel):
+        """Parcours du dossier rel terminé ; il sera noté quand ses copies seront achevées."""
+        with self._lock:
+            self._waiting.append((self._issued, rel))
+            self._advance_locked()
+
+    def _advance_locked(self):
+        # Toutes les copies de numéro inférieur au plus petit numéro en cours sont terminées
+        low = min(self._running) if self._running else self._issued + 1
+        while self._waiting and self._waiting[0][0] < low:
+            _, rel = self._waiting.popleft()
+            if rel not in self._dirty:
+                self._pending.append(rel)
+        if len(self._pending) >= self.batch_size:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        if self.on_flush:
+            self.on_flush()
+        self._file.write("".join(json.dumps({"d": rel}, ensure_ascii=False) + "\n" for rel in self._pending))
+        self._sync()
+        self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self, completed=False):
+        """Sauvegarde complète : le journal est supprimé ; sinon il est conservé pour la reprise."""
+        with self._lock:
+            try:
+                if not completed:
+                    self._flush_locked()
+            finally:
+                self._file.close()
+            if completed:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
@@ -0,0 +1,437 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import datetime
+import tempfile
+import threading
+from snapshots import select_kept
+
+# Le dépôt est rangé dans ce sous-dossier de la destination
+REPO_DIR = "depot"
+CHUNKS_DIR = "blocs"
+BACKUPS_DIR = "sauvegardes"
+CATALOG_SUFFIX = ".jsonl.gz"
+STAMP_FORMAT = "%Y-%m-%d_%H%M%S"
+# Catalogue provisoire plus récent que ce délai : une sauvegarde est peut-être en cours, les blocs ne sont pas triés
+STALE_CATALOG_SECONDS = 24 * 3600
+
+# Découpage selon le contenu, par hachage roulant « gear » sur 32 bits : h = (2 * h + GEAR[octet]) mod 2 ** 32.
+# Un bloc se termine après un octet où les bits de CUT_MASK sont nuls dans h. h ne dépend que des
+# GEAR_WINDOW derniers octets, quelles que soient leurs valeurs : une insertion ne décale que les blocs voisins.
+MIN_CHUNK = 128 * 1024
+MAX_CHUNK = 2 * 1024 * 1024
+GEAR_WINDOW = 32
+# 19 bits de poids fort : une coupure tous les 512 Kio en moyenne au-delà de MIN_CHUNK
+CUT_MASK = 0xFFFFE000
+# Les empreintes sont calculées par tranches : le calcul s'arrête peu après la première coupure
+SCAN_SIZE = 64 * 1024
+READ_SIZE = 4 * 1024 * 1024
+
+# Table fixe, tirée de blake2b : le découpage (et donc la déduplication) ne change pas d'une version à l'autre
+GEAR = [int.from_bytes(hashlib.blake2b(bytes([b]), digest_size=4).digest(), "little") for b in range(256)]
+# Octet k de GEAR[b], pour bytes.translate
+_GEAR_BYTES = [bytes((g >> (8 * k)) & 0xFF for g in GEAR) for k in range(4)]
+
+KIND_FILE = "f"
+KIND_DIR = "d"
+KIND_LINK = "l"
+
+def _gear_cut(seg):
+    """
+    Plus petit indice i >= GEAR_WINDOW - 1 de seg où h (calculé sur seg[i - GEAR_WINDOW + 1:i + 1])
+    a les bits de CUT_MASK nuls, ou -1.
+    Calculer h octet par octet en Python ne dépasse pas quelques Mo/s : ici chaque octet occupe
+    un champ de 64 bits d'un grand entier, où sont sommés les GEAR[...] << j des GEAR_WINDOW derniers
+    octets (moins de 2 ** 64 : pas de retenue d'un champ à l'autre) en cinq décalages-additions.
+    """
+    n = len(seg)
+    lanes = bytearray(8 * n)
+    for k in range(4):
+        lanes[k::8] = seg.translate(_GEAR_BYTES[k])
+    x = int.from_bytes(lanes, "little")
+    # Un champ plus loin (64 bits) et un rang de plus (x 2) : 65 bits par octet de recul
+    shift = 65
+    while shift < 65 * GEAR_WINDOW:
+        x += x << shift
+        shift *= 2
+    sums = x.to_bytes(8 * n + 8 * GEAR_WINDOW, "little")
+    # Octet de poids fort de h nul d'abord (trouvé en C), puis le reste du masque
+    top = sums[3:8 * n:8]
+    i = top.find(0, GEAR_WINDOW - 1)
+    while i >= 0:
+        if not int.from_bytes(sums[8 * i:8 * i + 4], "little") & CUT_MASK:
+            return i
+        i = top.find(0, i + 1)
+    return -1
+
+def find_cut(buf, min_size=MIN_CHUNK, max_size=MAX_CHUNK):
+    """Position de fin du premier bloc de buf (plus de min_size octets, au plus max_size)."""
+    end = min(len(buf), max_size)
+    if end <= min_size:
+        return end
+    # pos : premier octet après lequel une coupure est permise
+    pos = min_size
+    while pos < end:
+        stop = min(pos + SCAN_SIZE, end)
+        found = _gear_cut(buf[pos - GEAR_WINDOW + 1:stop])
+        if found >= 0:
+            return pos - GEAR_WINDOW + 1 + found + 1
+        pos = stop
+    return end
+
+def iter_chunks(f, min_size=MIN_CHUNK, max_size=MAX_CHUNK):
+    """Découpe le contenu du fichier ouvert f en blocs définis par leur contenu."""
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < max_size:
+            data = f.read(READ_SIZE)
+            if not data:
+                eof = True
+            else:
+                buf += data
+        if not buf:
+            return
+        # Tant que le fichier n'est pas fini, buf contient au moins max_size octets ;
+        # sans coupure trouvée à la fin du fichier, le reste forme le dernier bloc
+        cut = find_cut(buf, min_size, max_size)
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+def chunk_id(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+class CatalogWriter:
+    """Catalogue d'une sauvegarde : une ligne JSON par élément, compressée, publiée à la fin."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        fd, self._tmp = tempfile.mkstemp(prefix=".catalogue-", dir=os.path.dirname(path))
+        self._file = gzip.GzipFile(fileobj=os.fdopen(fd, "wb"), mode="wb", compresslevel=6)
+        self._raw = self._file.fileobj
+        self.entries = 0
+
+    def add(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            self._file.write(line)
+            self.entries += 1
+
+    def _close(self):
+        self._file.close()
+        self._raw.close()
+
+    def commit(self):
+        self._close()
+        os.replace(self._tmp, self.path)
+
+    def discard(self):
+        self._close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+class ChunkStore:
+    """
+    Dépôt à blocs adressés par leur contenu : chaque fichier est découpé en blocs (iter_chunks),
+    chaque bloc distinct n'est stocké qu'une fois sous son empreinte (blake2b), quel que soit le
+    fichier ou la source dont il vient. Une sauvegarde est un catalogue des éléments sauvegardés
+    et de la liste des blocs de chaque fichier.
+    Les blocs sont écrits dans un fichier temporaire puis renommés : un bloc présent est toujours complet.
+    """
+    def __init__(self, destination, log_func=None):
+        self.root = os.path.join(destination, REPO_DIR)
+        self.chunks_dir = os.path.join(self.root, CHUNKS_DIR)
+        self.backups_dir = os.path.join(self.root, BACKUPS_DIR)
+        self.log_func = log_func
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.backups_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._known = set()
+        self.new_chunks = 0
+        self.reused_chunks = 0
+        self.bytes_in = 0
+        self.bytes_stored = 0
+
+    @staticmethod
+    def exists(destination):
+        return os.path.isdir(os.path.join(destination, REPO_DIR, BACKUPS_DIR))
+
+    def chunk_path(self, cid):
+        return os.path.join(self.chunks_dir, cid[:2], cid[2:4], cid)
+
+    def put(self, data):
+        """Stocke un bloc s'il est nouveau et retourne son identifiant."""
+        cid = chunk_id(data)
+        with self._lock:
+            self.bytes_in += len(data)
+            if cid in self._known:
+                self.reused_chunks += 1
+                return cid
+        path = self.chunk_path(cid)
+        if os.path.exists(path):
+            new = False
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".bloc-", dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            new = True
+        with self._lock:
+            self._known.add(cid)
+            if new:
+                self.new_chunks += 1
+                self.bytes_stored += len(data)
+            else:
+                self.reused_chunks += 1
+        return cid
+
+    def store_file(self, path, hasher=None, throttle=None):
+        """
+        Découpe et stocke un fichier ; retourne (liste des blocs, taille).
+        throttle(n), s'il est fourni, est appelé pour chaque bloc de n octets (limite de débit).
+        """
+        chunks = []
+        size = 0
+        with open(path, "rb") as f:
+            for data in iter_chunks(f):
+                if hasher is not None:
+                    hasher.update(data)
+                chunks.append(self.put(data))
+                size += len(data)
+                if throttle is not None:
+                    throttle(len(data))
+        return chunks, size
+
+    def read_chunk(self, cid):
+        with open(self.chunk_path(cid), "rb") as f:
+            data = f.read()
+        if chunk_id(data) != cid:
+            raise ValueError(f"bloc {cid} corrompu")
+        return data
+
+    # --- Catalogues ---
+
+    def list_backups(self):
+        try:
+            names = [name[:-len(CATALOG_SUFFIX)] for name in os.listdir(self.backups_dir)
+                     if name.endswith(CATALOG_SUFFIX) and not name.startswith(".")]
+        except FileNotFoundError:
+            return []
+        return sorted(names)
+
+    def latest_backup(self):
+        backups = self.list_backups()
+        return backups[-1] if backups else None
+
+    def new_backup(self):
+        """Retourne (nom, CatalogWriter) pour une nouvelle sauvegarde."""
+        stamp = time.strftime(STAMP_FORMAT)
+        name = stamp
+        counter = 2
+        while os.path.exists(os.path.join(self.backups_dir, name + CATALOG_SUFFIX)):
+            name = f"{stamp}-{counter}"
+            counter += 1
+        return name, CatalogWriter(os.path.join(self.backups_dir, name + CATALOG_SUFFIX))
+
+    def iter_entries(self, name):
+        with gzip.open(os.path.join(self.backups_dir, name + CATALOG_SUFFIX), "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def file_entries(self, name):
+        """Fichiers d'une sauvegarde : chemin relatif -> entrée (pour réutiliser les blocs des fichiers inchangés)."""
+        if name is None:
+            return {}
+        return {entry["p"]: entry for entry in self.iter_entries(name) if entry["k"] == KIND_FILE}
+
+    # --- Restauration et vérification ---
+
+    def restore(self, name, path, target, log_func=None, abort_func=None):
+        """
+        Restaure l'élément path (chemin relatif, "source/dossier/fichier", ou "" pour tout)
+        de la sauvegarde name dans le dossier target, en reconstituant les fichiers bloc par bloc.
+        Retourne (éléments restaurés, octets écrits, erreurs).
+        """
+        path = path.strip("/")
+        prefix = path + "/" if path else ""
+        restored = written = errors = 0
+        dirs = []
+        for entry in self.iter_entries(name):
+            if abort_func and abort_func():
+                break
+            rel = entry["p"]
+            if path and rel != path and not rel.startswith(prefix):
+                continue
+            dest = os.path.join(target, *rel.split("/"))
+            try:
+                if entry["k"] == KIND_DIR:
+                    os.makedirs(dest, exist_ok=True)
+                    dirs.append((dest, entry))
+                    restored += 1
+                    continue
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                if entry["k"] == KIND_LINK:
+                    if os.path.lexists(dest):
+                        os.remove(dest)
+                    os.symlink(entry["l"], dest)
+                else:
+                    with open(dest, "wb") as f:
+                        for cid in entry["c"]:
+                            data = self.read_chunk(cid)
+                            f.write(data)
+                            written += len(data)
+                    os.chmod(dest, entry["m"] & 0o7777)
+                    os.utime(dest, ns=(entry["t"], entry["t"]))
+                restored += 1
+            except Exception as e:
+                errors += 1
+                if log_func:
+                    log_func(f"Impossible de restaurer {rel} : {e}")
+        # Attributs des dossiers en dernier : leur date serait modifiée par la création de leur contenu
+        for dest, entry in reversed(dirs):
+            try:
+                os.chmod(dest, entry["m"] & 0o7777)
+                os.utime(dest, ns=(entry["t"], entry["t"]))
+            except OSError:
+                pass
+        return restored, written, errors
+
+    def verify(self, name, log_func=None, progress_func=None, abort_func=None):
+        """
+        Relit chaque bloc référencé par la sauvegarde name (une seule fois par bloc) et contrôle
+        son empreinte. Retourne (blocs vérifiés, blocs corrompus, blocs absents).
+        """
+        referenced = {}
+        for entry in self.iter_entries(name):
+            for cid in entry.get("c", ()):
+                referenced.setdefault(cid, entry["p"])
+        total = len(referenced) or 1
+        checked = corrupt = missing = 0
+        for cid, rel in referenced.items():
+            if abort_func and abort_func():
+                break
+            try:
+                self.read_chunk(cid)
+            except FileNotFoundError:
+                missing += 1
+                if log_func:
+                    log_func(f"Intégrité : bloc absent du dépôt ({rel})")
+            except ValueError:
+                corrupt += 1
+                if log_func:
+                    log_func(f"Intégrité : bloc corrompu ({rel})")
+            checked += 1
+            if progress_func:
+                progress_func(int(checked / total * 100))
+        return checked, corrupt, missing
+
+    # --- Rétention ---
+
+    def prune(self, keep_daily=7, keep_weekly=4, keep_last=1):
+        """
+        Applique aux sauvegardes du dépôt la politique de rétention des instantanés (select_kept),
+        puis, si des sauvegardes ont été supprimées, efface les blocs qu'aucune sauvegarde restante
+        ne référence. Retourne (sauvegardes supprimées, blocs effacés).
+        """
+        dated = []
+        for name in self.list_backups():
+            try:
+                dated.append((datetime.datetime.strptime(name[:17], STAMP_FORMAT), name))
+            except ValueError:
+                # Nom inattendu : jamais supprimé
+                pass
+        kept = select_kept([when for when, _ in dated], keep_daily, keep_weekly, keep_last)
+        removed = 0
+        for i, (when, name) in enumerate(dated):
+            if i in kept:
+                continue
+            try:
+                os.remove(os.path.join(self.backups_dir, name + CATALOG_SUFFIX))
+                removed += 1
+            except OSError as e:
+                self._log(f"Impossible de supprimer la sauvegarde {name} du dépôt : {e}")
+        if not removed:
+            return 0, 0
+        self._log(f"Rétention du dépôt : {removed} sauvegarde(s) supprimée(s), {len(dated) - removed} conservée(s).")
+        return removed, self.collect_garbage()
+
+    def collect_garbage(self):
+        """
+        Efface les blocs qu'aucun catalogue ne référence (sauvegardes supprimées ou interrompues)
+        et retourne leur nombre. Rien n'est effacé si un catalogue est illisible ou si une autre
+        sauvegarde semble en cours : ses blocs ne sont encore référencés par aucun catalogue.
+        """
+        now = time.time()
+        with os.scandir(self.backups_dir) as it:
+            for entry in it:
+                if not entry.name.startswith(".catalogue-"):
+                    continue
+                if now - entry.stat().st_mtime < STALE_CATALOG_SECONDS:
+                    self._log("Blocs inutilisés conservés : une autre sauvegarde du dépôt semble en cours.")
+                    return 0
+                # Reste d'une sauvegarde interrompue brutalement
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        referenced = set()
+        try:
+            for name in self.list_backups():
+                for entry in self.iter_entries(name):
+                    referenced.update(entry.get("c", ()))
+        except Exception as e:
+            self._log(f"Blocs inutilisés conservés : catalogue illisible ({e}).")
+            return 0
+        removed = freed = 0
+        for sub in self._chunk_dirs():
+            with os.scandir(sub) as it:
+                for entry in it:
+                    # Les fichiers en cours d'écriture (.bloc-...) ne sont jamais touchés
+                    if entry.name.startswith(".") or entry.name in referenced:
+                        continue
+                    try:
+                        size = entry.stat().st_size
+                        os.remove(entry.path)
+                    except OSError as e:
+                        self._log(f"Impossible d'effacer le bloc {entry.name} : {e}")
+                        continue
+                    removed += 1
+                    freed += size
+                    with self._lock:
+                        self._known.discard(entry.name)
+        if removed:
+            self._log(f"Dépôt : {removed} blocs inutilisés effacés ({freed / (1024 * 1024):.2f} Mo libérés).")
+        return removed
+
+    def _chunk_dirs(self):
+        # Dossiers blocs/xx/yy (voir chunk_path)
+        with os.scandir(self.chunks_dir) as it:
+            tops = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+        for top in tops:
+            with os.scandir(top) as it:
+                subs = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+            yield from subs
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    def summary(self):
+        with self._lock:
+            return (
+                f"Dépôt : {self.bytes_in / (1024 * 1024):.2f} Mo découpés, "
+                f"{self.new_chunks} nouveaux blocs ({self.bytes_stored / (1024 * 1024):.2f} Mo écrits), "
+                f"{self.reused_chunks} blocs déjà présents."
+            )
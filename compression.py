@@ -0,0 +1,185 @@
+import os
+import gzip
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Formats déjà compressés : les recompresser coûte du CPU sans rien gagner
+COMPRESSED_EXTENSIONS = {
+    ".gz", ".tgz", ".bz2", ".xz", ".txz", ".zst", ".lz4", ".lzma", ".zip", ".7z", ".rar", ".cab",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".aac", ".ogg", ".flac", ".m4a",
+    ".mp4", ".m4v", ".mkv", ".avi", ".mov", ".webm", ".docx", ".xlsx", ".pptx", ".odt", ".ods",
+    ".odp", ".jar", ".apk", ".msi", ".iso", ".pst", ".ost",
+}
+
+MAGIC_PREFIXES = (
+    b"\x1f\x8b",            # gzip
+    b"\x28\xb5\x2f\xfd",    # zstd
+    b"BZh",                 # bzip2
+    b"\xfd7zXZ\x00",        # xz
+    b"PK\x03\x04",          # zip, documents Office récents
+    b"7z\xbc\xaf\x27\x1c",  # 7-Zip
+    b"Rar!\x1a\x07",        # rar
+    b"\x89PNG",             # png
+    b"\xff\xd8\xff",        # jpeg
+)
+
+MIN_SIZE = 512
+
+def _compress_gzip(chunk, level):
+    # Chaque bloc devient un membre gzip indépendant : leur concaténation reste un fichier .gz valide
+    return gzip.compress(chunk, compresslevel=level, mtime=0)
+
+_zstd_local = threading.local()
+
+def _compress_zstd(chunk, level):
+    # Les compresseurs zstandard ne sont pas partageables entre threads : un par thread
+    compressor = getattr(_zstd_local, "compressor", None)
+    if compressor is None:
+        compressor = _zstd_local.compressor = zstandard.ZstdCompressor(level=level)
+    return compressor.compress(chunk)
+
+def stored_suffix(path):
+    """Retourne le suffixe de compression d'un fichier stocké, ou une chaîne vide."""
+    for suffix in SUFFIXES.values():
+        if path.endswith(suffix):
+            return suffix
+    return ""
+
+def iter_plain_blocks(path, block_size=CHUNK_SIZE, suffix=None):
+    """
+    Lit un fichier stocké, décompressé à la volée s'il porte un suffixe de compression.
+    suffix : suffixe ajouté par le compresseur ("" pour un fichier stocké tel quel) ;
+    par défaut, il est déduit du nom du fichier.
+    """
+    if suffix is None:
+        suffix = stored_suffix(path)
+    with open(path, "rb") as raw:
+        if suffix == ".gz":
+            f = gzip.GzipFile(fileobj=raw)
+        elif suffix == ".zst":
+            if zstandard is None:
+                raise RuntimeError("module zstandard requis pour relire " + path)
+            f = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            f = raw
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+class ChunkCompressor:
+    """
+    Compression des fichiers copiés par blocs de taille fixe, répartis sur un pool de threads.
+    Les blocs compressés sont écrits dans l'ordre, chacun formant une trame gzip/zstd autonome.
+    Tient les compteurs de la sauvegarde (octets lus, écrits, durée) pour le journal.
+    """
+    def __init__(self, algo="gzip", level=6, workers=4, chunk_size=CHUNK_SIZE, log_func=None):
+        if algo == "zstd" and zstandard is None:
+            if log_func:
+                log_func("Module zstandard absent : compression gzip utilisée à la place.")
+            algo = "gzip"
+        if algo not in SUFFIXES:
+            algo = "gzip"
+        self.algo = algo
+        self.suffix = SUFFIXES[algo]
+        self.level = level
+        self.chunk_size = chunk_size
+        self.workers = max(1, int(workers or 1))
+        self._compress = _compress_zstd if algo == "zstd" else _compress_gzip
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="compression")
+        self._lock = threading.Lock()
+        self.files = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Début du premier fichier et fin du dernier : le débit est mesuré sur la durée réelle
+        self._first_start = None
+        self._last_end = None
+
+    def should_compress(self, path, size=None):
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return False
+        if size < MIN_SIZE or os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+            return False
+        try:
+            with open(path, "rb") as f:
+                head = f.read(8)
+        except OSError:
+            return False
+        return not head.startswith(MAGIC_PREFIXES)
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def compress_file(self, s, d, hasher=None, sync=False, throttle=None):
+        """
+        Compresse s vers d (qui doit déjà porter le suffixe). Le hasher éventuel reçoit les
+        données non compressées. Avec sync, d est écrit sur disque avant le retour ;
+        throttle(n) est appelé pour chaque bloc de n octets lus (limite de débit).
+        Retourne le nombre d'octets écrits.
+        """
+        start = time.perf_counter()
+        window = deque()
+        size_in = size_out = 0
+        with open(s, "rb") as fsrc, open(d, "wb") as fdst:
+            while True:
+                chunk = fsrc.read(self.chunk_size)
+                if chunk:
+                    size_in += len(chunk)
+                    if throttle is not None:
+                        throttle(len(chunk))
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    window.append(self._executor.submit(self._compress, chunk, self.level))
+                # On garde au plus deux blocs par thread en vol pour borner la mémoire
+                while window and (not chunk or len(window) >= self.workers * 2):
+                    data = window.popleft().result()
+                    fdst.write(data)
+                    size_out += len(data)
+                if not chunk:
+                    break
+            if sync:
+                fdst.flush()
+                os.fsync(fdst.fileno())
+        shutil.copystat(s, d, follow_symlinks=False)
+        with self._lock:
+            self.files += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+            if self._first_start is None or start < self._first_start:
+                self._first_start = start
+            self._last_end = time.perf_counter()
+        return size_out
+
+    def summary(self):
+        with self._lock:
+            if not self.files:
+                return f"Compression {self.algo} : aucun fichier compressé ({self.skipped} copiés tels quels)."
+            ratio = self.bytes_in / (self.bytes_out or 1)
+            seconds = (self._last_end - self._first_start) or 1e-9
+            speed = self.bytes_in / (1024 * 1024) / seconds
+            return (
+                f"Compression {self.algo} : {self.files} fichiers, "
+                f"{self.bytes_in / (1024 * 1024):.2f} Mo -> {self.bytes_out / (1024 * 1024):.2f} Mo "
+                f"(ratio {ratio:.2f}), {speed:.2f} Mo/s, {self.skipped} fichiers trop petits ou déjà compressés copiés tels quels."
+            )
+
+    def close(self):
+        self._executor.shutdown(wait=True)
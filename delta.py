@@ -0,0 +1,206 @@
+import os
+import mmap
+import hashlib
+import shutil
+import tempfile
+import zlib
+from collections import namedtuple
+
+MOD_ADLER = 65521
+
+MIN_BLOCK_SIZE = 64 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+# La recherche glissante octet par octet est coûteuse en Python : elle est abandonnée après
+# quelques échecs consécutifs (jusqu'au prochain bloc retrouvé) et plafonnée par fichier,
+# pour qu'un fichier entièrement réécrit ne coûte pas plus cher qu'une copie complète.
+MAX_ROLL_BYTES = 16 * 1024 * 1024
+MAX_ROLL_MISSES = 4
+
+DeltaResult = namedtuple("DeltaResult", "size transferred in_place")
+
+def choose_block_size(size):
+    # Comme rsync : environ la racine carrée de la taille, bornée et alignée sur 4 Kio
+    block = int(size ** 0.5) // 4096 * 4096
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block))
+
+def _strong(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def signatures(path, block_size):
+    """
+    Signatures des blocs d'un fichier existant : somme faible adler32 (glissante) et empreinte forte.
+    Retourne (weak -> ensemble d'indices, strong -> indice, empreinte forte de chaque bloc).
+    """
+    weak_map = {}
+    strong_map = {}
+    strongs = []
+    count = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) < block_size:
+                # Le dernier bloc incomplet n'est pas réutilisable : il sera retransmis s'il a changé
+                break
+            strong = _strong(block)
+            weak_map.setdefault(zlib.adler32(block), set()).add(count)
+            strong_map.setdefault(strong, count)
+            strongs.append(strong)
+            count += 1
+    return weak_map, strong_map, strongs
+
+class _Matcher:
+    """Parcours de la source et production des opérations (copie d'un bloc existant ou littéral)."""
+    def __init__(self, mm, size, block_size, weak_map, strong_map, strongs, hasher=None):
+        self.mm = mm
+        self.size = size
+        self.block_size = block_size
+        self.weak_map = weak_map
+        self.strong_map = strong_map
+        self.strongs = strongs
+        self.hasher = hasher
+        self.hashed = 0
+        self.roll_budget = MAX_ROLL_BYTES
+        self.roll_misses = 0
+        self.ops = []
+        self.literal_start = 0
+
+    def _hash_to(self, pos):
+        # L'empreinte d'intégrité suit l'avancée du parcours : la source n'est lue qu'une fois
+        if self.hasher is not None and pos > self.hashed:
+            self.hasher.update(self.mm[self.hashed:pos])
+            self.hashed = pos
+
+    def _literal_to(self, pos):
+        if pos > self.literal_start:
+            self.ops.append(("lit", self.literal_start, pos))
+
+    def _emit_copy(self, pos, index):
+        self._literal_to(pos)
+        self.ops.append(("copy", index, pos))
+        self.literal_start = pos + self.block_size
+
+    def _lookup(self, pos):
+        # Un bloc identique déjà à la même place est préféré (blocs répétés, zéros, ...) :
+        # il n'y a alors rien à réécrire
+        strong = _strong(self.mm[pos:pos + self.block_size])
+        aligned, rem = divmod(pos, self.block_size)
+        if not rem and aligned < len(self.strongs) and self.strongs[aligned] == strong:
+            return aligned
+        return self.strong_map.get(strong)
+
+    def _roll(self, pos):
+        """
+        Cherche un bloc connu à partir des positions pos+1 .. pos+block_size avec la somme glissante.
+        Retourne (position, indice) ou None.
+        """
+        B = self.block_size
+        mm = self.mm
+        limit = min(B, self.size - pos - B, self.roll_budget)
+        if limit <= 0:
+            return None
+        self.roll_budget -= limit
+        checksum = zlib.adler32(mm[pos:pos + B])
+        a = checksum & 0xffff
+        b = checksum >> 16
+        weak_map = self.weak_map
+        for k in range(1, limit + 1):
+            out_byte = mm[pos + k - 1]
+            in_byte = mm[pos + k - 1 + B]
+            a = (a - out_byte + in_byte) % MOD_ADLER
+            b = (b - B * out_byte + a - 1) % MOD_ADLER
+            if (b << 16 | a) in weak_map:
+                index = self._lookup(pos + k)
+                if index is not None:
+                    return pos + k, index
+        return None
+
+    def run(self):
+        B = self.block_size
+        pos = 0
+        while pos + B <= self.size:
+            index = self._lookup(pos)
+            if index is None and self.roll_budget > 0 and self.roll_misses < MAX_ROLL_MISSES:
+                found = self._roll(pos)
+                if found is not None:
+                    pos, index = found
+                else:
+                    self.roll_misses += 1
+            if index is not None:
+                self.roll_misses = 0
+                self._emit_copy(pos, index)
+            pos += B
+            self._hash_to(pos)
+        self._literal_to(self.size)
+        self._hash_to(self.size)
+        return self.ops
+
+def _apply_in_place(mm, d, ops, size, block_size):
+    # Les zones littérales sont comparées morceau par morceau à la copie existante :
+    # seul ce qui diffère réellement est écrit
+    transferred = 0
+    with open(d, "r+b") as f:
+        for op in ops:
+            if op[0] != "lit":
+                continue
+            _, start, end = op
+            for pos in range(start, end, block_size):
+                data = mm[pos:min(pos + block_size, end)]
+                f.seek(pos)
+                if f.read(len(data)) != data:
+                    f.seek(pos)
+                    f.write(data)
+                    transferred += len(data)
+        f.truncate(size)
+    return transferred
+
+def _apply_to_temp(mm, d, ops, block_size):
+    transferred = 0
+    fd, tmp = tempfile.mkstemp(prefix=".delta-", dir=os.path.dirname(d))
+    try:
+        with os.fdopen(fd, "wb") as out, open(d, "rb") as old:
+            for op in ops:
+                if op[0] == "lit":
+                    _, start, end = op
+                    out.write(mm[start:end])
+                    transferred += end - start
+                else:
+                    old.seek(op[1] * block_size)
+                    out.write(old.read(block_size))
+        os.replace(tmp, d)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return transferred
+
+def delta_copy(s, d, hasher=None):
+    """
+    Met à jour la copie existante d à partir de s en ne réécrivant que les blocs modifiés.
+    Les blocs de d sont signés (somme glissante + empreinte forte) puis retrouvés dans s,
+    y compris s'ils ont été décalés. Si tous les blocs retrouvés sont restés à leur place,
+    seuls les blocs modifiés sont réécrits dans d ; sinon un fichier temporaire est reconstruit
+    puis substitué atomiquement à d. Retourne un DeltaResult.
+    """
+    size = os.path.getsize(s)
+    block_size = choose_block_size(size)
+    weak_map, strong_map, strongs = signatures(d, block_size)
+    with open(s, "rb") as fsrc:
+        mm = mmap.mmap(fsrc.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            ops = _Matcher(mm, size, block_size, weak_map, strong_map, strongs, hasher).run()
+            in_place = all(op[0] == "lit" or op[1] * block_size == op[2] for op in ops)
+            if in_place:
+                # La copie est marquée comme ancienne pendant la réécriture : une interruption
+                # laisse un fichier qui sera recopié à la prochaine sauvegarde
+                os.utime(d, (0, 0))
+                transferred = _apply_in_place(mm, d, ops, size, block_size)
+            else:
+                transferred = _apply_to_temp(mm, d, ops, block_size)
+        finally:
+            if size:
+                mm.close()
+    shutil.copystat(s, d, follow_symlinks=False)
+    return DeltaResult(size, transferred, in_place)
@@ -0,0 +1,378 @@
+import os
+import time
+import errno
+import queue
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from file_utils import (clear_readonly, copy_file, long_path, new_hasher, hash_algo_name, partial_path,
+                        remove_stale_versions, COPY_BLOCK_SIZE)
+from metrics import timer
+
+# Erreurs qui rendent une destination inutilisable pour le reste de la sauvegarde
+_FATAL_ERRNOS = {errno.ENOSPC, errno.EROFS, errno.EIO, getattr(errno, "EDQUOT", errno.ENOSPC)}
+# Au-delà de ce nombre d'échecs consécutifs, la destination est abandonnée
+MAX_CONSECUTIVE_FAILURES = 20
+# File d'une destination pleine depuis ce délai : le fichier en cours lui sera copié séparément
+STALL_SECONDS = 2.0
+
+class _DestinationWriter:
+    """
+    Écrivain d'une destination : un thread qui consomme une file bornée de messages
+    ("open", "data", "close", "abort") et écrit les fichiers lus une seule fois par le FanOutCopier.
+    Les fichiers qui ne peuvent pas suivre ce flux (file restée pleine, transfert delta) sont
+    mis de côté et copiés séparément par ce même thread, quand la file est vide.
+    Une destination en échec est abandonnée : ses messages sont alors ignorés sans bloquer les autres.
+    """
+    def __init__(self, position, name, queue_blocks=64, hash_algo=None, delta_threshold=0, sync=False,
+                 on_copied=None, on_failed=None, log_func=None, abort_func=None, throttle=None, metrics=None):
+        self.position = position
+        self.name = name
+        self.hash_algo = hash_algo
+        self.delta_threshold = delta_threshold
+        self.sync = sync
+        self.on_copied = on_copied
+        self.on_failed = on_failed
+        self.log_func = log_func
+        self.abort_func = abort_func
+        self.throttle = throttle
+        self.metrics = metrics
+        self.queue = queue.Queue(maxsize=max(2, queue_blocks))
+        self._deferred = deque()
+        self._open = {}
+        # Fichiers retirés du flux par le lecteur (destination en retard) dont l'ouverture a été
+        # envoyée : partagés avec les threads de lecture, retirés dès que leur copie provisoire est effacée
+        self._dropped = set()
+        self._dropped_lock = threading.Lock()
+        self._closing = False
+        self.broken = None
+        self.streamed = 0
+        self.separate = 0
+        self.failed = 0
+        self.stalls = 0
+        self.bytes = 0
+        self._consecutive_failures = 0
+        self._thread = threading.Thread(target=self._run, name=f"ecriture-{position}", daemon=True)
+        self._thread.start()
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    def backlog(self):
+        # Part de la file occupée (0 à 1)
+        return self.queue.qsize() / self.queue.maxsize
+
+    def put(self, message, timeout=None):
+        """Ajoute un message à la file ; lève queue.Full si elle est restée pleine timeout secondes."""
+        if self.broken is None:
+            self.queue.put(message, timeout=timeout)
+
+    def drop(self, key, item, dst, opened=True):
+        # Appelé par le lecteur : le fichier key ne sera plus alimenté, il est copié séparément.
+        # opened : son message "open" est déjà dans la file (sinon l'écrivain n'en a rien reçu)
+        if opened:
+            with self._dropped_lock:
+                self._dropped.add(key)
+        self.defer(item, dst, late=True)
+
+    def defer(self, item, dst, late=False):
+        if self.broken is None:
+            if late:
+                self.stalls += 1
+            self._deferred.append((item, dst))
+
+    def _separate_work(self):
+        return bool(self._deferred) and self.broken is None and not (self.abort_func and self.abort_func())
+
+    def _run(self):
+        while True:
+            work = self._separate_work()
+            try:
+                # Sans attente s'il y a des copies séparées à faire
+                message = self.queue.get_nowait() if work else self.queue.get(timeout=0.05)
+            except queue.Empty:
+                if work:
+                    self._copy_separately(*self._deferred.popleft())
+                elif self._closing:
+                    return
+                continue
+            self._discard_dropped()
+            if message is None:
+                self._closing = True
+            elif self.broken is None:
+                with timer(self.metrics, "copy"):
+                    self._handle(message)
+
+    def _discard_dropped(self):
+        with self._dropped_lock:
+            keys = self._dropped & self._open.keys()
+            self._dropped -= keys
+        for key in keys:
+            item, dst, tmp, f, started = self._open.pop(key)
+            try:
+                f.close()
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _handle(self, message):
+        kind, key, value = message
+        if kind == "open":
+            with self._dropped_lock:
+                if key in self._dropped:
+                    # Retiré avant même d'être ouvert : les messages suivants de key sont ignorés
+                    # (key absent de _open), il n'a plus à être suivi
+                    self._dropped.discard(key)
+                    return
+            item, dst = value
+            tmp = partial_path(dst)
+            try:
+                try:
+                    f = open(tmp, "wb")
+                except FileNotFoundError:
+                    os.makedirs(os.path.dirname(tmp), exist_ok=True)
+                    f = open(tmp, "wb")
+                # Durée d'un fichier : de l'ouverture au renommage, au rythme de la lecture commune
+                self._open[key] = (item, dst, tmp, f, time.perf_counter())
+            except Exception as e:
+                self._fail(item, e)
+            return
+        state = self._open.get(key)
+        if state is None:
+            # Ouverture ou écriture précédente en échec : le reste du fichier est ignoré
+            return
+        item, dst, tmp, f, started = state
+        try:
+            if kind == "data":
+                f.write(value)
+                return
+            del self._open[key]
+            if kind == "abort":
+                f.close()
+                os.remove(tmp)
+                return
+            if self.sync:
+                f.flush()
+                os.fsync(f.fileno())
+            f.close()
+            with timer(self.metrics, "metadata"):
+                shutil.copystat(item.src, tmp, follow_symlinks=False)
+            clear_readonly(dst)
+            os.replace(tmp, dst)
+            remove_stale_versions(item.src, dst, dst)
+        except Exception as e:
+            self._open.pop(key, None)
+            try:
+                f.close()
+                os.remove(tmp)
+            except OSError:
+                pass
+            self._fail(item, e)
+            return
+        self.streamed += 1
+        self._done(item, value, time.perf_counter() - started)
+
+    def _copy_separately(self, item, dst):
+        # Copie classique, avec sa propre lecture de la source (et transfert delta si possible) ;
+        # copy_file journalise lui-même ses erreurs
+        with timer(self.metrics, "copy") as step:
+            result = copy_file(item.src, dst, lambda msg: self._log(f"[{self.name}] {msg}"), self.hash_algo, None,
+                               self.delta_threshold, self.sync, self.throttle, self.metrics)
+        if result is None:
+            self._fail(item, None)
+            return
+        self.separate += 1
+        self._done(item, result.digest, step.elapsed, result.transferred)
+
+    def _done(self, item, digest, seconds=0.0, transferred=None):
+        self._consecutive_failures = 0
+        self.bytes += item.stat.st_size
+        if self.metrics is not None:
+            self.metrics.file_copied(item.rel, item.stat.st_size, seconds, transferred)
+        if self.on_copied:
+            self.on_copied(self.position, item, digest)
+
+    def _fail(self, item, error):
+        self.failed += 1
+        self._consecutive_failures += 1
+        if self.metrics is not None:
+            self.metrics.file_failed(item.stat.st_size if item.stat is not None else 0, error)
+        if error is not None:
+            self._log(f"[{self.name}] Erreur lors de la copie de {item.src} : {error}")
+        if self.on_failed:
+            self.on_failed(self.position, item)
+        fatal = isinstance(error, OSError) and error.errno in _FATAL_ERRNOS
+        if fatal:
+            self.abandon(error)
+        elif self._consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+            self.abandon(f"{MAX_CONSECUTIVE_FAILURES} échecs consécutifs")
+
+    def abandon(self, reason):
+        if self.broken is not None:
+            return
+        self.broken = str(reason)
+        self._log(f"[{self.name}] Destination abandonnée pour cette sauvegarde : {reason}")
+        for item, dst, tmp, f, started in self._open.values():
+            try:
+                f.close()
+                os.remove(tmp)
+            except OSError:
+                pass
+        self._open = {}
+
+    def close(self):
+        # Les messages déjà en file sont traités, puis les copies mises de côté
+        self.queue.put(None)
+        self._thread.join()
+        if self.abort_func and self.abort_func():
+            self._deferred.clear()
+        # Copies mises de côté et jamais faites (destination abandonnée)
+        while self._deferred:
+            item, _ = self._deferred.popleft()
+            self.failed += 1
+            if self.on_failed:
+                self.on_failed(self.position, item)
+
+class FanOutCopier:
+    """
+    Copie vers plusieurs destinations en ne lisant chaque fichier source qu'une fois :
+    `workers` threads lisent les fichiers par blocs et remettent chaque bloc aux écrivains
+    (_DestinationWriter) des destinations concernées, qui écrivent en parallèle.
+    Une destination en retard ne ralentit pas les autres : les fichiers qu'elle ne peut pas suivre
+    lui sont confiés pour une copie séparée. Une destination en échec est abandonnée.
+    on_copied(position, item, digest) et on_failed(position, item) sont appelés depuis les threads
+    d'écriture pour chaque fichier écrit, ou en échec, dans la destination de rang position.
+    Avec scheduler (scheduler.IOScheduler), chaque lecture réserve une place sur le périphérique
+    de la source et le débit de lecture (et des copies séparées) est limité selon la configuration.
+    metrics (metrics.RunMetrics) mesure les lectures communes, dest_metrics[position] les écritures
+    de chaque destination.
+    """
+    def __init__(self, names, workers=4, log_func=None, on_copied=None, on_failed=None, abort_func=None,
+                 hash_algo=None, delta_threshold=0, sync=False, block_size=COPY_BLOCK_SIZE, queue_blocks=64,
+                 scheduler=None, metrics=None, dest_metrics=None):
+        self.workers = max(1, int(workers or 1))
+        self.hash_algo = hash_algo
+        self.delta_threshold = delta_threshold
+        self.block_size = block_size
+        self.log_func = log_func
+        self.on_failed = on_failed
+        self.abort_func = abort_func
+        self.scheduler = scheduler
+        self.metrics = metrics
+        throttle = self._throttle if scheduler is not None else None
+        dest_metrics = dest_metrics or [None] * len(names)
+        self.writers = [_DestinationWriter(position, name, queue_blocks, hash_algo, delta_threshold, sync,
+                                           on_copied, on_failed, log_func, abort_func, throttle, dest_metrics[position])
+                        for position, name in enumerate(names)]
+        self.read_failed = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers * 4)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="lecture")
+
+    def submit(self, item):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._fan_out, item)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def _throttle(self, nbytes):
+        self.scheduler.throttle(nbytes, self.abort_func)
+
+    def _fan_out(self, item):
+        if self.abort_func and self.abort_func():
+            return
+        targets = [(self.writers[position], dst, exists) for position, dst, exists in item.targets
+                   if self.writers[position].broken is None]
+        # Une destination dont la file est presque pleine alors qu'une autre est presque vide est
+        # en retard : elle copiera ce fichier séparément plutôt que de ralentir la lecture commune
+        backlogs = [writer.backlog() for writer, _, _ in targets]
+        fastest = min(backlogs, default=0)
+        streams = []
+        for (writer, dst, exists), backlog in zip(targets, backlogs):
+            if exists and self.delta_threshold and item.stat.st_size >= self.delta_threshold:
+                writer.defer(item, dst)
+            elif backlog >= 0.75 and fastest <= 0.25:
+                writer.defer(item, dst, late=True)
+            else:
+                streams.append((writer, dst))
+        if not streams:
+            return
+        if self.scheduler is None:
+            with timer(self.metrics, "copy"):
+                self._read(item, streams)
+            return
+        with self.scheduler.slot(item.stat.st_dev) as slot:
+            with timer(self.metrics, "copy"):
+                slot.bytes = self._read(item, streams)
+
+    def _read(self, item, streams):
+        # Lit item.src une fois et diffuse ses blocs ; retourne le nombre d'octets lus
+        key = object()
+        read = 0
+        self._send(streams, key, item, "open", None)
+        hasher = new_hasher(self.hash_algo) if self.hash_algo else None
+        try:
+            with open(long_path(item.src), "rb") as f:
+                while True:
+                    if self.abort_func and self.abort_func():
+                        raise InterruptedError("copie annulée")
+                    block = f.read(self.block_size)
+                    if not block:
+                        break
+                    read += len(block)
+                    if self.scheduler is not None:
+                        self._throttle(len(block))
+                    if hasher is not None:
+                        hasher.update(block)
+                    # Le même bloc (immuable) est partagé par toutes les files
+                    self._send(streams, key, item, "data", block)
+                    if not streams:
+                        return read
+        except Exception as e:
+            self._send(streams, key, item, "abort", None)
+            if isinstance(e, InterruptedError):
+                return read
+            with self._lock:
+                self.read_failed += 1
+            if self.log_func:
+                self.log_func(f"Erreur lors de la lecture de {item.src} : {e}")
+            for writer, _ in streams:
+                if writer.metrics is not None:
+                    writer.metrics.file_failed(item.stat.st_size, e)
+                if self.on_failed:
+                    self.on_failed(writer.position, item)
+            return read
+        digest = f"{hash_algo_name(self.hash_algo)}:{hasher.hexdigest()}" if hasher is not None else None
+        self._send(streams, key, item, "close", digest)
+        return read
+
+    def _send(self, streams, key, item, kind, value):
+        # Une destination dont la file reste pleine est retirée du flux pour ce fichier
+        # (copie séparée) : les autres continuent au lieu de l'attendre
+        for stream in list(streams):
+            writer, dst = stream
+            message = (kind, key, (item, dst) if kind == "open" else value)
+            try:
+                writer.put(message, timeout=STALL_SECONDS)
+            except queue.Full:
+                writer.drop(key, item, dst, opened=kind != "open")
+                streams.remove(stream)
+
+    def close(self):
+        # Attend la fin des lectures, puis celle des écritures de chaque destination
+        self._executor.shutdown(wait=True)
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
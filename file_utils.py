@@ -2,6 +2,107 @@ import shutil
 import os
 import sys
 import stat
+import json
+import threading
+import hashlib
+import zlib
+import errno
+import time
+from collections import Counter, deque
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from compression import SUFFIXES, iter_plain_blocks
+from delta import delta_copy
+from metrics import timer
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+DEFAULT_OPTIONS = {
+    "compression": False,
+    "integrity_check": True,
+    "parallel_copies": 4,
+    "incremental_index": True,
+    "hash_algo": "blake2b",
+    "compression_algo": "gzip",
+    "compression_level": 6,
+    "delta_threshold_mb": 64,
+    "watch_debounce_seconds": 5,
+    "watch_poll_seconds": 60,
+    "watch_full_scan_minutes": 360,
+    "journal_file": "journal/sauvegarde.log",
+    "journal_max_mb": 5,
+    "journal_backups": 5,
+    "journal_max_lines": 5000,
+    "snapshots": False,
+    "chunk_store": False,
+    "snapshot_keep_last": 3,
+    "snapshot_keep_daily": 7,
+    "snapshot_keep_weekly": 4,
+    "pack_small_files": False,
+    "pack_threshold_kb": 64,
+    "pack_size_mb": 256,
+    "resume": True,
+    "resume_max_age_hours": 72,
+    "sync_files": False,
+    "bandwidth_limit_mb": 0,
+    "bandwidth_schedule": [],
+    "device_max_concurrency": 0,
+    "adaptive_concurrency": False,
+    "exclude": [],
+    "include": [],
+    "mirror_delete": False,
+    "mirror_trash": True,
+    "trash_retention_days": 30,
+    "metrics_dir": "",
+    "metrics_keep": 100,
+    "metrics_prometheus_file": "",
+}
+
+COPY_BLOCK_SIZE = 1024 * 1024
+# Avec une limite de débit, les copies par le noyau avancent par tranches de cette taille
+THROTTLE_CHUNK = 4 * COPY_BLOCK_SIZE
+# Options désignant un chemin : un chemin relatif part du dossier du fichier de configuration lu
+PATH_OPTIONS = ("metrics_dir", "metrics_prometheus_file")
+
+def load_config(path=CONFIG_PATH, strict=False):
+    """
+    Lit config.json et complète les options manquantes avec les valeurs par défaut.
+    Un fichier absent ou illisible donne la configuration par défaut ; avec strict, un fichier
+    présent mais illisible ou invalide lève OSError ou ValueError (message de json).
+    Les chemins relatifs des PATH_OPTIONS sont rendus absolus par rapport au dossier de path.
+    """
+    config = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise ValueError("la configuration doit être un objet JSON")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError):
+        if strict:
+            raise
+        config = {}
+    options = dict(DEFAULT_OPTIONS)
+    options.update(config.get("options") or {})
+    base = os.path.dirname(os.path.abspath(path))
+    for key in PATH_OPTIONS:
+        if options.get(key):
+            options[key] = os.path.join(base, options[key])
+    config["options"] = options
+    config.setdefault("sources", [])
+    config.setdefault("destinations", [])
+    return config
 
 def long_path(path):
     # Ajoute le préfixe \\?\ si nécessaire (Windows uniquement)
@@ -14,62 +115,1345 @@ def long_path(path):
                 path = '\\\\?\\' + path
     return path
 
-def copy_folder(src, dst, log_func=None):
+class _Crc32:
+    # Interface hashlib minimale autour de zlib.crc32
+    name = "crc32"
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self):
+        return f"{self._value:08x}"
+
+def new_hasher(algo):
     """
-    Copie récursivement tout le contenu de src dans un sous-dossier de dst.
-    Gère les chemins longs, liens symboliques, fichiers cachés, systèmes, fichiers sans extension, fichiers verrouillés, etc.
-    Journalise les erreurs si log_func est fourni.
+    Crée un objet de hachage pour l'algorithme demandé : "xxhash" (xxh3, module optionnel),
+    "blake2b" ou "crc32". Sans le module xxhash, "xxhash" se rabat sur blake2b.
     """
-    base_name = os.path.basename(os.path.normpath(src))
-    dst_subfolder = os.path.join(dst, base_name)
-    src_long = long_path(src)
-    dst_long = long_path(dst_subfolder)
+    if algo == "xxhash" and xxhash is not None:
+        return xxhash.xxh3_64()
+    if algo == "crc32":
+        return _Crc32()
+    return hashlib.blake2b(digest_size=16)
+
+def hash_algo_name(algo):
+    # Nom réellement utilisé par new_hasher, enregistré avec chaque empreinte
+    if algo == "xxhash" and xxhash is not None:
+        return "xxhash"
+    if algo == "crc32":
+        return "crc32"
+    return "blake2b"
+
+def hash_file(path, algo, block_size=COPY_BLOCK_SIZE):
+    hasher = new_hasher(algo)
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def hash_stored(path, algo):
+    """
+    Empreinte du contenu d'origine d'un fichier de la destination, en le décompressant
+    à la volée s'il a été stocké compressé (path + ".gz" / ".zst").
+    Un fichier présent sous son propre nom est relu tel quel, même si ce nom se termine
+    par « .gz » ou « .zst » : seul un suffixe ajouté par le compresseur est décompressé.
+    """
+    if os.path.exists(path):
+        return hash_file(path, algo)
+    for suffix in SUFFIXES.values():
+        if os.path.exists(path + suffix):
+            hasher = new_hasher(algo)
+            for block in iter_plain_blocks(path + suffix, COPY_BLOCK_SIZE, suffix):
+                hasher.update(block)
+            return hasher.hexdigest()
+    raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+# Méthodes de copie, de la plus rapide à la plus générale
+METHOD_REFLINK = "reflink"
+METHOD_COPY_FILE_RANGE = "copy_file_range"
+METHOD_SENDFILE = "sendfile"
+METHOD_READINTO = "readinto"
+METHOD_COMPRESSION = "compression"
+METHOD_DELTA = "delta"
+METHOD_PACK = "pack"
+
+# Suffixe des copies en cours d'écriture (voir partial_path)
+PARTIAL_SUFFIX = ".partiel"
+
+# transferred : octets réellement écrits depuis la source (inférieur à size pour un transfert delta)
+CopyResult = namedtuple("CopyResult", "digest method size transferred")
+
+FICLONE = 0x40049409  # ioctl Linux de clonage (btrfs, XFS, ...)
+
+# Erreurs qui signifient « méthode non disponible ici », pas « copie impossible »
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY,
+                       errno.EPERM, errno.EBADF}
+
+# Couples (périphérique source, périphérique destination) sur lesquels le clonage a échoué
+_no_reflink = set()
+
+class _Unsupported(Exception):
+    pass
+
+def _try_reflink(fsrc, fdst, src_stat):
+    if fcntl is None:
+        return False
+    key = (src_stat.st_dev, os.fstat(fdst.fileno()).st_dev)
+    if key in _no_reflink:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        _no_reflink.add(key)
+        return False
+
+def _data_segments(fd, st):
+    """
+    Plages (début, fin) contenant des données. Pour un fichier creux, les trous sont
+    détectés avec SEEK_DATA / SEEK_HOLE ; sinon (ou si non supporté) tout le fichier est une plage.
+    """
+    size = st.st_size
+    sparse = hasattr(os, "SEEK_DATA") and getattr(st, "st_blocks", size) * 512 < size
+    if not sparse:
+        return [(0, size)] if size else []
+    segments = []
+    pos = 0
     try:
-        if not os.path.exists(dst_long):
-            os.makedirs(dst_long, exist_ok=True)
+        while pos < size:
             try:
-                shutil.copystat(src_long, dst_long, follow_symlinks=False)
-            except Exception as e:
-                if log_func:
-                    log_func(f"Impossible de copier les attributs de {src} : {e}")
-        with os.scandir(src_long) as it:
-            for entry in it:
-                s = entry.path
-                d = os.path.join(dst_long, entry.name)
+                start = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:  # plus de données jusqu'à la fin
+                    break
+                raise
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            segments.append((start, end))
+            pos = end
+    except OSError:
+        return [(0, size)]
+    return segments
+
+def _copy_range_segment(fsrc, fdst, start, end, throttle=None):
+    pos = start
+    while pos < end:
+        count = end - pos if throttle is None else min(end - pos, THROTTLE_CHUNK)
+        try:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), count, pos, pos)
+        except OSError as e:
+            if e.errno in _UNSUPPORTED_ERRNOS:
+                raise _Unsupported(pos)
+            raise
+        if n == 0:
+            break
+        pos += n
+        if throttle is not None:
+            throttle(n)
+
+def _sendfile_segment(fsrc, fdst, start, end, throttle=None):
+    os.lseek(fdst.fileno(), start, os.SEEK_SET)
+    pos = start
+    while pos < end:
+        count = end - pos if throttle is None else min(end - pos, THROTTLE_CHUNK)
+        try:
+            n = os.sendfile(fdst.fileno(), fsrc.fileno(), pos, count)
+        except OSError as e:
+            if e.errno in _UNSUPPORTED_ERRNOS:
+                raise _Unsupported(pos)
+            raise
+        if n == 0:
+            break
+        pos += n
+        if throttle is not None:
+            throttle(n)
+
+def _readinto_segment(fsrc, fdst, start, end, view, hasher=None, throttle=None):
+    # Boucle readinto sur un tampon réutilisé : aucune allocation par bloc
+    fsrc.seek(start)
+    fdst.seek(start)
+    pos = start
+    while pos < end:
+        n = fsrc.readinto(view[:min(len(view), end - pos)])
+        if not n:
+            break
+        chunk = view[:n]
+        if hasher is not None:
+            hasher.update(chunk)
+        fdst.write(chunk)
+        pos += n
+        if throttle is not None:
+            throttle(n)
+    return pos
+
+def _hash_zeros(hasher, length, view):
+    # Les trous d'un fichier creux se lisent comme des zéros : l'empreinte doit les inclure
+    zeros = bytes(min(len(view), length))
+    while length > 0:
+        n = min(len(zeros), length)
+        hasher.update(zeros[:n])
+        length -= n
+
+def fast_copy(s, d, hasher=None, block_size=COPY_BLOCK_SIZE, sync=False, throttle=None):
+    """
+    Copie le contenu de s vers d par la voie la plus rapide disponible pour ce fichier :
+    clonage reflink, puis os.copy_file_range, puis os.sendfile, puis une boucle readinto
+    sur un tampon réutilisé. Les trous des fichiers creux sont préservés.
+    Avec un hasher, les données passent obligatoirement par la boucle readinto pour être hachées.
+    Avec sync, les données sont écrites sur disque (fsync) avant le retour.
+    throttle(n), s'il est fourni, est appelé après chaque tranche de n octets copiés (limite de débit).
+    Retourne le nom de la méthode utilisée (suffixé de "+sparse" si des trous ont été sautés).
+    """
+    with open(s, "rb", buffering=0) as fsrc, open(d, "wb", buffering=0) as fdst:
+        st = os.fstat(fsrc.fileno())
+        if hasher is None and _try_reflink(fsrc, fdst, st):
+            if sync:
+                os.fsync(fdst.fileno())
+            return METHOD_REFLINK
+        segments = _data_segments(fsrc.fileno(), st)
+        holes = sum(end - start for start, end in segments) < st.st_size
+        methods = [METHOD_READINTO] if hasher is not None else []
+        if not methods:
+            if hasattr(os, "copy_file_range"):
+                methods.append(METHOD_COPY_FILE_RANGE)
+            if hasattr(os, "sendfile") and os.name != "nt":
+                methods.append(METHOD_SENDFILE)
+            methods.append(METHOD_READINTO)
+        view = memoryview(bytearray(block_size))
+        pos = 0
+        for start, end in segments:
+            if hasher is not None and start > pos:
+                _hash_zeros(hasher, start - pos, view)
+            while True:
+                method = methods[0]
                 try:
-                    if entry.is_symlink():
-                        # Copie le lien symbolique tel quel
-                        if os.path.lexists(d):
-                            os.remove(d)
-                        linkto = os.readlink(s)
-                        os.symlink(linkto, d)
-                    elif entry.is_dir(follow_symlinks=False):
-                        copy_folder(s, dst_long, log_func)
-                    elif entry.is_file(follow_symlinks=False):
-                        # Tente de rendre le fichier accessible si verrouillé ou protégé
-                        try:
-                            os.chmod(s, stat.S_IWRITE)
-                        except Exception:
-                            pass
-                        try:
-                            shutil.copy2(s, d, follow_symlinks=False)
-                        except Exception as e:
-                            # Réessaie avec les chemins longs si erreur
-                            try:
-                                shutil.copy2(long_path(s), long_path(d), follow_symlinks=False)
-                            except Exception as e2:
-                                if log_func:
-                                    log_func(f"Erreur lors de la copie de {s} : {e2}")
+                    if method == METHOD_COPY_FILE_RANGE:
+                        _copy_range_segment(fsrc, fdst, start, end, throttle)
+                    elif method == METHOD_SENDFILE:
+                        _sendfile_segment(fsrc, fdst, start, end, throttle)
                     else:
-                        # Cas très rare : autre type (fifo, device, etc.)
-                        try:
-                            shutil.copy(s, d, follow_symlinks=False)
-                        except Exception as e:
-                            if log_func:
-                                log_func(f"Type de fichier non géré ou erreur : {s} : {e}")
+                        _readinto_segment(fsrc, fdst, start, end, view, hasher, throttle)
+                    break
+                except _Unsupported as e:
+                    # On reprend là où la méthode a échoué avec la suivante, pour tout le reste du fichier
+                    start = e.args[0]
+                    methods.pop(0)
+            pos = end
+        if hasher is not None and st.st_size > pos:
+            _hash_zeros(hasher, st.st_size - pos, view)
+        # Fixe la taille finale (trou éventuel en fin de fichier)
+        fdst.truncate(st.st_size)
+        if sync:
+            os.fsync(fdst.fileno())
+    return methods[0] + "+sparse" if holes else methods[0]
+
+def partial_path(d):
+    """Nom provisoire d'une copie en cours d'écriture, dans le même dossier que d."""
+    head, name = os.path.split(d)
+    return os.path.join(head, "." + name + PARTIAL_SUFFIX)
+
+def clear_readonly(d):
+    """
+    Windows : une copie précédente en lecture seule (attribut de la source recopié par copystat)
+    ne peut être ni remplacée ni mise à jour ; son attribut est retiré. À n'appeler que sur la
+    destination, jamais sur la source.
+    """
+    if os.name != "nt":
+        return
+    try:
+        mode = os.lstat(d).st_mode
+        if stat.S_ISREG(mode) and not mode & stat.S_IWRITE:
+            os.chmod(d, mode | stat.S_IWRITE)
+    except OSError:
+        pass
+
+def write_atomic(d, write):
+    """
+    Écrit d par write(chemin provisoire), puis renomme le fichier provisoire en d ; retourne le
+    résultat de write. Une interruption ne laisse jamais un fichier incomplet sous le nom définitif
+    (avec une date qui le ferait croire à jour).
+    """
+    tmp = partial_path(d)
+    try:
+        result = write(tmp)
+        clear_readonly(d)
+        os.replace(tmp, d)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return result
+
+def remove_stale_versions(s, d, kept=None):
+    """
+    Supprime les autres versions stockées de la copie de s (d, d + ".gz", d + ".zst") que kept :
+    sans cela, une copie compressée écrite avant la désactivation de la compression (ou l'inverse,
+    ou un changement d'algorithme) resterait à côté de la nouvelle. Une version qui est aussi la
+    copie d'un autre fichier de la source (s + ".gz" existe) est gardée.
+    """
+    for suffix in ("",) + tuple(SUFFIXES.values()):
+        stale = d + suffix
+        if stale == kept:
+            continue
+        try:
+            st = os.lstat(stale)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode) or (suffix and os.path.lexists(s + suffix)):
+            continue
+        clear_readonly(stale)
+        os.remove(stale)
+
+def _copy_data(s, d, hash_algo=None, compressor=None, delta_threshold=0, sync=False, throttle=None, metrics=None):
+    hasher = new_hasher(hash_algo) if hash_algo else None
+    size = os.path.getsize(s)
+    transferred = size
+    if compressor is not None and compressor.should_compress(s, size):
+        transferred = write_atomic(d + compressor.suffix,
+                                    lambda tmp: compressor.compress_file(s, tmp, hasher, sync, throttle))
+        method = METHOD_COMPRESSION
+        remove_stale_versions(s, d, d + compressor.suffix)
+    else:
+        if compressor is not None:
+            compressor.skip()
+        if delta_threshold and size >= delta_threshold and os.path.isfile(d):
+            # La mise à jour delta protège elle-même la copie existante contre les interruptions
+            clear_readonly(d)
+            transferred = delta_copy(s, d, hasher).transferred
+            method = METHOD_DELTA
+            if throttle is not None:
+                throttle(transferred)
+        else:
+            def write(tmp):
+                method = fast_copy(s, tmp, hasher, sync=sync, throttle=throttle)
+                with timer(metrics, "metadata"):
+                    shutil.copystat(s, tmp, follow_symlinks=False)
+                return method
+            method = write_atomic(d, write)
+        remove_stale_versions(s, d, d)
+    digest = f"{hash_algo_name(hash_algo)}:{hasher.hexdigest()}" if hasher is not None else None
+    return CopyResult(digest, method, size, transferred)
+
+def copy_file(s, d, log_func=None, hash_algo=None, compressor=None, delta_threshold=0, sync=False,
+              throttle=None, metrics=None):
+    """
+    Copie un fichier régulier avec ses attributs.
+    Réessaie avec les chemins longs en cas d'échec. Retourne None si la copie a échoué, sinon
+    un CopyResult : empreinte "algo:hex" calculée pendant la copie si hash_algo est fourni,
+    et méthode de copie utilisée.
+    Avec un compresseur (compression.ChunkCompressor), les fichiers compressibles sont
+    écrits sous d + suffixe (.gz, .zst) ; la version précédente sous un autre nom est supprimée. Une copie existante d'au moins delta_threshold octets
+    est mise à jour par transfert delta (seuls les blocs modifiés sont réécrits).
+    Les copies sont écrites sous un nom provisoire (partial_path) puis renommées ; avec sync,
+    elles sont écrites sur disque avant d'être renommées. throttle(n) limite le débit (voir fast_copy).
+    metrics (metrics.RunMetrics) compte l'erreur qui fait échouer la copie.
+    """
+    try:
+        return _copy_data(s, d, hash_algo, compressor, delta_threshold, sync, throttle, metrics)
+    except FileNotFoundError as e:
+        # Dossier de destination supprimé depuis la dernière sauvegarde (index obsolète) : on le recrée
+        parent = os.path.dirname(d)
+        if os.path.isdir(parent) or not os.path.exists(s):
+            if log_func:
+                log_func(f"Erreur lors de la copie de {s} : fichier introuvable")
+            if metrics is not None:
+                metrics.error(e)
+            return None
+        try:
+            os.makedirs(parent, exist_ok=True)
+            return _copy_data(s, d, hash_algo, compressor, delta_threshold, sync, throttle, metrics)
+        except Exception as e:
+            if log_func:
+                log_func(f"Erreur lors de la copie de {s} : {e}")
+            if metrics is not None:
+                metrics.error(e)
+            return None
+    except Exception:
+        # Réessaie avec les chemins longs si erreur
+        try:
+            return _copy_data(long_path(s), long_path(d), hash_algo, compressor, delta_threshold, sync, throttle,
+                              metrics)
+        except Exception as e2:
+            if log_func:
+                log_func(f"Erreur lors de la copie de {s} : {e2}")
+            if metrics is not None:
+                metrics.error(e2)
+    return None
+
+class ParallelCopier:
+    """
+    Pool de copie borné : les fichiers soumis sont copiés par `workers` threads.
+    Le nombre de copies en attente est limité pour que le parcours de l'arborescence
+    n'avance pas indéfiniment plus vite que les copies.
+    on_copied(item, digest) est appelé (depuis un thread de copie) après chaque copie réussie d'un ScanItem ;
+    digest est l'empreinte calculée pendant la copie si hash_algo est fourni, sinon None.
+    Si compressor est fourni, les fichiers compressibles sont stockés compressés.
+    Les fichiers d'au moins delta_threshold octets déjà présents sont mis à jour par transfert delta.
+    Si packer (packs.PackStore) est fourni, les fichiers plus petits que son seuil sont ajoutés
+    à un paquet au lieu d'être copiés un par un.
+    Avec sync, chaque copie est écrite sur disque avant d'être renommée sous son nom définitif.
+    Avec scheduler (scheduler.IOScheduler), chaque copie réserve une place sur les périphériques
+    de sa source et de sa destination et son débit est limité selon la configuration.
+    metrics (metrics.RunMetrics) mesure chaque copie ; copy_tree et copy_paths le transmettent au parcours.
+    """
+    def __init__(self, workers=4, log_func=None, on_copied=None, abort_func=None, hash_algo=None,
+                 compressor=None, delta_threshold=0, packer=None, sync=False, scheduler=None, metrics=None):
+        self.workers = max(1, int(workers or 1))
+        self.hash_algo = hash_algo
+        self.compressor = compressor
+        self.packer = packer
+        self.sync = sync
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self._dest_devices = {}
+        self.delta_threshold = delta_threshold
+        self.log_func = log_func
+        self.on_copied = on_copied
+        self.abort_func = abort_func
+        # Nombre de fichiers copiés par méthode (reflink, copy_file_range, ...)
+        self.methods = Counter()
+        self.failed = 0
+        self.delta_size = 0
+        self.delta_transferred = 0
+        self._methods_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers * 4)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="copie")
+
+    def submit(self, item):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._copy, item)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def _pack(self, item):
+        # Petit fichier : lu en une fois et ajouté au paquet courant
+        with open(long_path(item.src), "rb") as f:
+            data = f.read()
+        hasher = new_hasher(self.hash_algo) if self.hash_algo else None
+        digest = None
+        if hasher is not None:
+            hasher.update(data)
+            digest = f"{hash_algo_name(self.hash_algo)}:{hasher.hexdigest()}"
+        self.packer.add(item.rel, data, item.stat, digest)
+        if self.scheduler is not None:
+            self.scheduler.throttle(len(data), self.abort_func)
+        # Une ancienne copie séparée (fichier autrefois plus gros) ne doit pas masquer le paquet
+        remove_stale_versions(item.src, item.dst)
+        return CopyResult(digest, METHOD_PACK, len(data), len(data))
+
+    def _dest_device(self, dst):
+        # Périphérique du dossier de destination (un stat par dossier, mis en cache)
+        folder = os.path.dirname(dst)
+        dev = self._dest_devices.get(folder)
+        if dev is None:
+            try:
+                dev = os.stat(folder).st_dev
+            except OSError:
+                return None
+            if len(self._dest_devices) > 4096:
+                self._dest_devices.clear()
+            self._dest_devices[folder] = dev
+        return dev
+
+    def _transfer(self, item, throttle=None):
+        if self.packer is not None and item.stat is not None and item.stat.st_size < self.packer.threshold:
+            return self._pack(item)
+        if self.packer is not None:
+            self.packer.forget(item.rel)
+        return copy_file(item.src, item.dst, self.log_func, self.hash_algo, self.compressor,
+                         self.delta_threshold, self.sync, throttle, self.metrics)
+
+    def _copy(self, item):
+        if self.abort_func and self.abort_func():
+            return False
+        metrics = self.metrics
+        size = item.stat.st_size if item.stat is not None else 0
+        try:
+            if self.scheduler is None:
+                with timer(metrics, "copy") as step:
+                    result = self._transfer(item)
+            else:
+                src_dev = item.stat.st_dev if item.stat is not None else None
+                with self.scheduler.slot(src_dev, self._dest_device(item.dst)) as slot:
+                    with timer(metrics, "copy") as step:
+                        result = self._transfer(item, lambda n: self.scheduler.throttle(n, self.abort_func))
+                    slot.bytes = result.transferred if result is not None else 0
+            if result is None:
+                with self._methods_lock:
+                    self.failed += 1
+                if metrics is not None:
+                    metrics.file_failed(size)
+                return False
+            if metrics is not None:
+                metrics.file_copied(item.rel, result.size, step.elapsed, result.transferred)
+            with self._methods_lock:
+                self.methods[result.method] += 1
+                if result.method == METHOD_DELTA:
+                    self.delta_size += result.size
+                    self.delta_transferred += result.transferred
+            if result.method == METHOD_DELTA and self.log_func:
+                self.log_func(
+                    f"Transfert delta de {item.src} : {result.transferred / (1024 * 1024):.2f} Mo écrits "
+                    f"sur {result.size / (1024 * 1024):.2f} Mo."
+                )
+            if self.on_copied:
+                self.on_copied(item, result.digest)
+            return True
+        except Exception as e:
+            with self._methods_lock:
+                self.failed += 1
+            if metrics is not None:
+                metrics.file_failed(size, e)
+            if self.log_func:
+                self.log_func(f"Erreur lors du traitement de {item.src} : {e}")
+            return False
+
+    def methods_summary(self):
+        with self._methods_lock:
+            if not self.methods:
+                return ""
+            details = ", ".join(f"{method} : {count}" for method, count in self.methods.most_common())
+            if self.delta_size:
+                details += (
+                    f" (delta : {self.delta_transferred / (1024 * 1024):.2f} Mo écrits"
+                    f" sur {self.delta_size / (1024 * 1024):.2f} Mo)"
+                )
+        return f"Méthodes de copie utilisées : {details}."
+
+    def close(self):
+        # Attend la fin de toutes les copies soumises
+        self._executor.shutdown(wait=True)
+        if self.compressor is not None:
+            self.compressor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+# Types d'éléments émis par scan_tree
+ITEM_DIR = "dir"
+ITEM_FILE = "file"
+ITEM_LINK = "link"
+ITEM_OTHER = "other"
+ITEM_HARDLINK = "hardlink"
+
+# link : pour ITEM_HARDLINK, fichier inchangé de l'instantané précédent vers lequel créer un lien physique
+ScanItem = namedtuple("ScanItem", "kind src dst rel stat exists link", defaults=(None,))
+
+# Au-delà de ce nombre d'entrées, un dossier de destination n'est plus gardé en mémoire :
+# chaque nom est alors vérifié par un lstat
+DEST_LISTING_LIMIT = 50000
+# Dossiers dont la lecture (scandir) reste ouverte pendant le parcours de leurs sous-dossiers ;
+# plus profond, les sous-dossiers sont notés puis parcourus une fois la lecture terminée
+MAX_OPEN_DIRS = 32
+
+class _StatEntry:
+    """Équivalent minimal d'un DirEntry, obtenu par lstat."""
+    __slots__ = ("name", "path", "_stat")
+
+    def __init__(self, path, name, st):
+        self.name = name
+        self.path = path
+        self._stat = st
+
+    def is_dir(self, follow_symlinks=True):
+        return stat.S_ISDIR(self._stat.st_mode)
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self._stat.st_mode)
+
+    def stat(self, follow_symlinks=True):
+        return self._stat
+
+class _DestListing:
+    """
+    Contenu d'un dossier de destination, lu une seule fois et seulement si nécessaire.
+    Un dossier de plus de DEST_LISTING_LIMIT entrées n'est pas gardé en mémoire :
+    chaque nom demandé est alors examiné par un lstat.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._direct = False
+
+    def get(self, name):
+        if self._direct:
+            path = os.path.join(self.path, name)
+            try:
+                return _StatEntry(path, name, os.lstat(path))
+            except OSError:
+                return None
+        if self._entries is None:
+            # Une seule lecture du dossier : nom -> DirEntry (stat mis en cache)
+            entries = {}
+            try:
+                with os.scandir(self.path) as it:
+                    for entry in it:
+                        if len(entries) >= DEST_LISTING_LIMIT:
+                            self._direct = True
+                            return self.get(name)
+                        entries[entry.name] = entry
+            except FileNotFoundError:
+                pass
+            self._entries = entries
+        return self._entries.get(name)
+
+    def names(self):
+        """Noms triés des éléments du dossier."""
+        if self._entries is not None and not self._direct:
+            return sorted(self._entries)
+        try:
+            with os.scandir(self.path) as it:
+                return sorted(entry.name for entry in it)
+        except FileNotFoundError:
+            return []
+
+# Dossier à parcourir : chemin source, chemin relatif et données propres au parcours
+_Folder = namedtuple("_Folder", "src rel data")
+
+class _Frame:
+    __slots__ = ("folder", "handle", "finish", "it", "pending", "failed", "elapsed", "entries")
+
+    def __init__(self, folder, handle, finish, it):
+        self.folder = folder
+        self.handle = handle
+        self.finish = finish
+        self.it = it
+        self.pending = deque()
+        self.failed = False
+        # Temps passé à lire et examiner le dossier (mesures), et nombre d'entrées
+        self.elapsed = 0.0
+        self.entries = 0
+
+    def close(self):
+        if self.it is not None:
+            self.it.close()
+            self.it = None
+
+def _walk(root, visit, log_func=None, abort_func=None, checkpoint=None, metrics=None):
+    """
+    Parcours itératif (pile explicite) de l'arborescence à partir du dossier root (_Folder),
+    sans limite de profondeur. visit(folder) retourne (élément à émettre pour ce dossier,
+    handle, finish) ; handle(entry) traite une entrée du dossier et retourne un élément à émettre,
+    un _Folder à parcourir ou None ; finish(), s'il est fourni, est appelé quand la lecture du
+    dossier s'est terminée sans erreur. Chaque dossier est émis avant son contenu.
+    Au plus MAX_OPEN_DIRS lectures de dossier sont ouvertes à la fois ; au-delà, les sous-dossiers
+    sont mis de côté jusqu'à la fin de la lecture de leur parent. Les entrées sont traitées au fil
+    de la lecture, sans liste complète d'un dossier en mémoire.
+    Avec checkpoint, les erreurs lui sont signalées et chaque dossier entièrement émis est noté
+    terminé (dir_done), sous-dossiers compris.
+    Avec metrics (metrics.RunMetrics), le parcours est mesuré (phase « scan », hors du temps passé
+    par le consommateur) et la durée de chaque dossier lui est transmise.
+    """
+    def log(msg):
+        if log_func:
+            log_func(msg)
+
+    def failed(rel, e):
+        if metrics is not None:
+            metrics.error(e)
+        if checkpoint is not None:
+            checkpoint.failed(rel)
+
+    def advance(frame):
+        # Une entrée du dossier : élément à émettre, _Folder, ou None
+        try:
+            entry = next(frame.it, None)
+        except Exception as e:
+            log(f"Erreur critique lors de la copie de {frame.folder.src} : {e}")
+            frame.close()
+            frame.pending.clear()
+            frame.failed = True
+            failed(frame.folder.rel, e)
+            return None
+        if entry is None:
+            frame.close()
+            if frame.finish is not None:
+                try:
+                    frame.finish()
                 except Exception as e:
-                    if log_func:
-                        log_func(f"Erreur lors du traitement de {s} : {e}")
+                    log(f"Erreur lors du traitement de {frame.folder.src} : {e}")
+                    if metrics is not None:
+                        metrics.error(e)
+            return None
+        frame.entries += 1
+        try:
+            return frame.handle(entry)
+        except Exception as e:
+            log(f"Erreur lors du traitement de {entry.path} : {e}")
+            failed(frame.folder.rel + "/" + entry.name, e)
+            return None
+
+    stack = []
+    folder = root
+    try:
+        while True:
+            if folder is not None:
+                with timer(metrics, "scan") as step:
+                    item, handle, finish = visit(folder)
+                yield item
+                with timer(metrics, "scan") as opening:
+                    try:
+                        frame = _Frame(folder, handle, finish, os.scandir(folder.src))
+                        frame.elapsed = step.elapsed
+                        stack.append(frame)
+                    except Exception as e:
+                        log(f"Erreur critique lors de la copie de {folder.src} : {e}")
+                        failed(folder.rel, e)
+                        frame = None
+                if frame is not None:
+                    frame.elapsed += opening.elapsed
+                folder = None
+            if not stack:
+                return
+            if abort_func and abort_func():
+                return
+            frame = stack[-1]
+            if frame.it is not None:
+                with timer(metrics, "scan") as step:
+                    result = advance(frame)
+                frame.elapsed += step.elapsed
+                if isinstance(result, _Folder):
+                    if len(stack) < MAX_OPEN_DIRS:
+                        folder = result
+                    else:
+                        frame.pending.append(result)
+                elif result is not None:
+                    yield result
+                continue
+            if frame.pending:
+                folder = frame.pending.popleft()
+                continue
+            stack.pop()
+            if metrics is not None:
+                metrics.directory(frame.folder.src, frame.elapsed, frame.entries)
+            if checkpoint is not None and not frame.failed:
+                # Tous les éléments du dossier ont été émis et traités par le consommateur
+                checkpoint.dir_done(frame.folder.rel)
+    finally:
+        for frame in stack:
+            frame.close()
+
+def _dest_is_current(src_stat, dst_entry):
+    # Reprend le critère historique : le fichier source n'est pas plus récent que la copie
+    try:
+        if dst_entry.is_dir(follow_symlinks=False):
+            return False
+        return src_stat.st_mtime <= dst_entry.stat(follow_symlinks=False).st_mtime
+    except OSError:
+        return False
+
+def scan_tree(src, dst, log_func=None, incremental=False, abort_func=None, index=None, dest_suffix="",
+              link_dest=None, packs=None, checkpoint=None, filters=None, cleaner=None, metrics=None):
+    """
+    Parcourt src en un seul passage avec os.scandir et émet des ScanItem au fil de l'eau.
+    Chaque dossier est émis avant son contenu, pour que la destination puisse être créée dans l'ordre.
+    En mode incrémental, seuls les fichiers absents ou modifiés depuis leur dernière copie sont émis.
+    Si un index (manifest.Manifest) est fourni, la décision se fait sans lire la destination ;
+    sinon chaque dossier de destination n'est lu qu'une fois et les stat sont réutilisés.
+    dest_suffix est le suffixe des copies compressées, cherché si la copie simple est absente.
+    link_dest est un instantané précédent (même organisation que dst) : les fichiers qui y sont
+    à jour sont émis en ITEM_HARDLINK pour être liés plutôt que copiés.
+    packs (packs.PackStore) est consulté pour les fichiers absents de dst : ceux qui sont à jour
+    dans un paquet ne sont pas émis.
+    checkpoint (checkpoint.Checkpoint) reprend une sauvegarde interrompue : les dossiers déjà
+    terminés ne sont pas parcourus, et la fin du parcours de chaque dossier lui est signalée.
+    filters (filters.FilterSet) écarte des fichiers, et des dossiers entiers sans les lister.
+    cleaner (mirror.MirrorCleaner) reçoit, pour chaque dossier existant dans la destination et
+    entièrement lu, les noms de la source et de la destination pour y propager les suppressions.
+    metrics (metrics.RunMetrics) mesure le parcours et les comparaisons, et compte les fichiers inchangés.
+    """
+    base_name = os.path.basename(os.path.normpath(src))
+    dst_subfolder = os.path.join(dst, base_name)
+    src_long = long_path(src)
+    dst_long = long_path(dst_subfolder)
+    prev = long_path(os.path.join(link_dest, base_name)) if link_dest else None
+    if checkpoint is not None and checkpoint.skip(base_name):
+        return
+    try:
+        src_stat = os.stat(src_long)
+        exists = os.path.isdir(dst_long)
+        if index is not None:
+            index.check_root(base_name, dst_long)
     except Exception as e:
         if log_func:
             log_func(f"Erreur critique lors de la copie de {src} : {e}")
+        return
+    scanner = _TreeScanner(log_func, incremental, abort_func, index, dest_suffix, packs, checkpoint, filters,
+                           cleaner, metrics)
+    yield from scanner.scan_dir(src_long, dst_long, base_name, src_stat, exists,
+                                prev=prev if prev and os.path.isdir(prev) else None)
+
+def _source_rel(rel):
+    # Chemin relatif à la racine de la source (sans le nom de la source), comme l'attendent les filtres
+    return rel.partition("/")[2]
+
+class _TreeScanner:
+    def __init__(self, log_func, incremental, abort_func, index, dest_suffix="", packs=None, checkpoint=None,
+                 filters=None, cleaner=None, metrics=None):
+        self.log_func = log_func
+        self.metrics = metrics
+        self.filters = filters
+        self.cleaner = cleaner
+        self.dest_suffix = dest_suffix
+        self.packs = packs
+        self.checkpoint = checkpoint
+        self.incremental = incremental
+        self.abort_func = abort_func
+        self.index = index
+        # Un index qui n'est pas de confiance est seulement alimenté, pas consulté
+        self.use_index = index is not None and index.trusted
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    def _compare(self):
+        return timer(self.metrics, "compare")
+
+    def dir_exists(self, d, rel, dest, name):
+        """
+        True si le dossier rel existe déjà dans la destination (d, entrée name du listing dest) ;
+        d'après l'index de confiance s'il le connaît. Mesuré comme comparaison.
+        """
+        with self._compare():
+            return self._dir_exists(d, rel, dest, name)
+
+    def file_changed(self, rel, st, dest, name):
+        """
+        True si le fichier rel (attributs st de la source) est absent de la destination ou modifié
+        depuis sa dernière copie. Mesuré comme comparaison ; un fichier inchangé est compté.
+        """
+        with self._compare():
+            changed = self._file_changed(rel, st, dest, name)
+        if not changed and self.metrics is not None:
+            self.metrics.file_skipped(st.st_size)
+        return changed
+
+    def _dir_exists(self, d, rel, dest, name):
+        if not self.incremental:
+            return os.path.isdir(d)
+        if self.use_index and self.index.has_dir(rel):
+            return True
+        dst_entry = dest.get(name)
+        exists = dst_entry is not None and dst_entry.is_dir(follow_symlinks=False)
+        if exists and self.index is not None:
+            self.index.record_dir(rel)
+        return exists
+
+    def _file_changed(self, rel, st, dest, name):
+        row = self.index.get(rel) if self.index is not None else None
+        if self.use_index and row is not None:
+            return not self.index.matches(row, st)
+        dst_entry = dest.get(name)
+        if dst_entry is None and self.dest_suffix:
+            dst_entry = dest.get(name + self.dest_suffix)
+        if dst_entry is None and self.packs is not None:
+            packed = self.packs.get(rel)
+            if not self.packs.matches(packed, st):
+                return True
+            if self.index is not None:
+                self.index.record(rel, st, packed.digest)
+            return False
+        if dst_entry is None or not _dest_is_current(st, dst_entry):
+            return True
+        if self.index is not None:
+            # Fichier à jour mais absent de l'index ou index à revérifier : on le réindexe
+            # en conservant son empreinte si elle décrit toujours le même fichier
+            self.index.record(rel, st, row[4] if self.index.matches(row, st) else None)
+        return False
+
+    def _previous_copy(self, st, previous, name):
+        # Copie à jour du fichier dans l'instantané précédent, ou None
+        prev_entry = previous.get(name)
+        if prev_entry is None and self.dest_suffix:
+            prev_entry = previous.get(name + self.dest_suffix)
+        if prev_entry is None or not _dest_is_current(st, prev_entry):
+            return None
+        return prev_entry
+
+    def scan_dir(self, src, dst, rel, src_stat, exists, recursive=True, prev=None):
+        # Sans récursivité, seuls les sous-dossiers absents de la destination sont parcourus
+        yield from _walk(_Folder(src, rel, (dst, src_stat, exists, prev, recursive)), self._visit,
+                         self.log_func, self.abort_func, self.checkpoint, self.metrics)
+
+    def _visit(self, folder):
+        dst, src_stat, exists, prev, recursive = folder.data
+        rel = folder.rel
+        dest = _DestListing(dst)
+        previous = _DestListing(prev) if prev is not None else None
+        check = self.incremental and exists
+        # Mode miroir : noms de la source, comparés à la destination à la fin de la lecture
+        names = [] if self.cleaner is not None and exists else None
+
+        def handle(entry):
+            if names is not None:
+                names.append(entry.name)
+            s = entry.path
+            d = os.path.join(dst, entry.name)
+            child_rel = rel + "/" + entry.name
+            if entry.is_symlink():
+                if self.filters is not None and self.filters.skip_file(_source_rel(child_rel)):
+                    return None
+                return ScanItem(ITEM_LINK, s, d, child_rel, None, check and dest.get(entry.name) is not None)
+            if entry.is_dir(follow_symlinks=False):
+                # Dossier écarté : il n'est même pas listé
+                if self.filters is not None and self.filters.skip_dir(_source_rel(child_rel)):
+                    return None
+                if self.checkpoint is not None and self.checkpoint.skip(child_rel):
+                    return None
+                sub_exists = exists and self.dir_exists(d, child_rel, dest, entry.name)
+                if not recursive and sub_exists:
+                    return None
+                sub_prev = None
+                if previous is not None:
+                    prev_entry = previous.get(entry.name)
+                    if prev_entry is not None and prev_entry.is_dir(follow_symlinks=False):
+                        sub_prev = prev_entry.path
+                return _Folder(s, child_rel, (d, entry.stat(follow_symlinks=False), sub_exists, sub_prev, True))
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                if self.filters is not None and self.filters.skip_file(_source_rel(child_rel), st.st_size):
+                    return None
+                if check and not self.file_changed(child_rel, st, dest, entry.name):
+                    return None
+                prev_entry = None
+                if previous is not None:
+                    with self._compare():
+                        prev_entry = self._previous_copy(st, previous, entry.name)
+                if prev_entry is not None:
+                    # La copie liée garde le nom (et le suffixe de compression) de l'ancienne
+                    return ScanItem(ITEM_HARDLINK, s, os.path.join(dst, prev_entry.name), child_rel,
+                                    st, check, prev_entry.path)
+                return ScanItem(ITEM_FILE, s, d, child_rel, st, check)
+            return ScanItem(ITEM_OTHER, s, d, child_rel, None, check)
+
+        def finish():
+            # L'index de confiance remplace la lecture de la destination
+            with self._compare():
+                dst_names = self.index.children(rel) if self.use_index else dest.names()
+                names.sort()
+                self.cleaner.compare(rel, dst, names, dst_names)
+
+        return ScanItem(ITEM_DIR, folder.src, dst, rel, src_stat, exists), handle, finish if names is not None else None
+
+    def scan_path(self, s, d, rel, recursive=True):
+        """Examine un seul chemin (fichier, lien ou dossier) dont le dossier parent existe déjà."""
+        try:
+            st = os.lstat(s)
+        except FileNotFoundError:
+            # Supprimé depuis la notification : rien à copier
+            return
+        if stat.S_ISLNK(st.st_mode):
+            yield ScanItem(ITEM_LINK, s, d, rel, None, os.path.lexists(d))
+        elif stat.S_ISDIR(st.st_mode):
+            yield from self.scan_dir(s, d, rel, st, os.path.isdir(d), recursive)
+        elif stat.S_ISREG(st.st_mode):
+            if self.file_changed(rel, st, _DestListing(os.path.dirname(d)), os.path.basename(d)):
+                yield ScanItem(ITEM_FILE, s, d, rel, st, True)
+        else:
+            yield ScanItem(ITEM_OTHER, s, d, rel, None, os.path.lexists(d))
+
+def scan_paths(src, dst, paths, log_func=None, abort_func=None, index=None, dest_suffix="", packs=None,
+               filters=None, metrics=None):
+    """
+    Variante de scan_tree limitée à quelques chemins de src (notifications de modification).
+    paths est une liste de (chemin, récursif) ; un dossier récursif est parcouru entièrement,
+    sinon seul son contenu direct est examiné. Les dossiers parents sont émis en premier
+    pour être créés dans la destination s'il le faut. Un chemin écarté par filters, ou situé
+    dans un dossier écarté, est ignoré.
+    """
+    base_name = os.path.basename(os.path.normpath(src))
+    src_root = os.path.normpath(src)
+    dst_root = os.path.join(dst, base_name)
+    if index is not None:
+        index.check_root(base_name, long_path(dst_root))
+    scanner = _TreeScanner(log_func, True, abort_func, index, dest_suffix, packs, filters=filters, metrics=metrics)
+    known_dirs = set()
+    for path, recursive in paths:
+        if abort_func and abort_func():
+            return
+        rel_part = os.path.relpath(os.path.normpath(path), src_root)
+        if rel_part == os.curdir:
+            yield from scan_tree(src, dst, log_func, True, abort_func, index, dest_suffix, packs=packs,
+                                 filters=filters, metrics=metrics)
+            continue
+        if rel_part.startswith(os.pardir):
+            continue
+        parts = rel_part.split(os.sep)
+        if filters is not None and filters.skip_path("/".join(parts), os.path.isdir(path)):
+            continue
+        try:
+            # Dossiers parents, de la racine de la source jusqu'au dossier contenant le chemin
+            for depth in range(len(parts)):
+                rel = "/".join([base_name] + parts[:depth])
+                if rel in known_dirs:
+                    continue
+                s = long_path(os.path.join(src_root, *parts[:depth]))
+                d = long_path(os.path.join(dst_root, *parts[:depth]))
+                known_dirs.add(rel)
+                yield ScanItem(ITEM_DIR, s, d, rel, os.stat(s), os.path.isdir(d))
+            rel = "/".join([base_name] + parts)
+            s = long_path(os.path.join(src_root, *parts))
+            d = long_path(os.path.join(dst_root, *parts))
+            yield from scanner.scan_path(s, d, rel, recursive)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            if log_func:
+                log_func(f"Erreur lors du traitement de {path} : {e}")
+
+# targets : liste de (position de la destination, chemin dans cette destination, existe déjà)
+FanOutItem = namedtuple("FanOutItem", "kind src rel stat targets")
+
+def scan_tree_fanout(src, dsts, log_func=None, abort_func=None, indexes=None, filters=None, metrics=None,
+                     dest_metrics=None):
+    """
+    Parcourt src une seule fois pour plusieurs destinations (sauvegarde incrémentale) et émet
+    des FanOutItem. Un fichier n'est émis que pour les destinations où il est absent ou modifié ;
+    chaque destination est comparée avec son propre index (indexes[i], ou None) comme dans scan_tree,
+    et filters s'applique comme dans scan_tree.
+    metrics (metrics.RunMetrics) mesure le parcours commun ; dest_metrics[i] mesure les comparaisons
+    de la destination i et compte ses fichiers inchangés.
+    """
+    base_name = os.path.basename(os.path.normpath(src))
+    indexes = indexes or [None] * len(dsts)
+    src_long = long_path(src)
+    roots = [long_path(os.path.join(dst, base_name)) for dst in dsts]
+    try:
+        src_stat = os.stat(src_long)
+        exists = [os.path.isdir(root) for root in roots]
+        for index, root in zip(indexes, roots):
+            if index is not None:
+                index.check_root(base_name, root)
+    except Exception as e:
+        if log_func:
+            log_func(f"Erreur critique lors de la copie de {src} : {e}")
+        return
+    dest_metrics = dest_metrics or [None] * len(dsts)
+    scanners = [_TreeScanner(log_func, True, abort_func, index, metrics=m) for index, m in zip(indexes, dest_metrics)]
+
+    def visit(folder):
+        dsts, src_stat, exists = folder.data
+        rel = folder.rel
+        dests = [_DestListing(d) for d in dsts]
+
+        def handle(entry):
+            s = entry.path
+            name = entry.name
+            child_rel = rel + "/" + name
+            children = [os.path.join(d, name) for d in dsts]
+            if entry.is_symlink():
+                if filters is not None and filters.skip_file(_source_rel(child_rel)):
+                    return None
+                targets = [(i, d, exists[i] and dests[i].get(name) is not None) for i, d in enumerate(children)]
+                return FanOutItem(ITEM_LINK, s, child_rel, None, targets)
+            if entry.is_dir(follow_symlinks=False):
+                if filters is not None and filters.skip_dir(_source_rel(child_rel)):
+                    return None
+                sub_exists = [exists[i] and scanners[i].dir_exists(d, child_rel, dests[i], name)
+                              for i, d in enumerate(children)]
+                return _Folder(s, child_rel, (children, entry.stat(follow_symlinks=False), sub_exists))
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                if filters is not None and filters.skip_file(_source_rel(child_rel), st.st_size):
+                    return None
+                targets = [(i, d, exists[i]) for i, d in enumerate(children)
+                           if not exists[i] or scanners[i].file_changed(child_rel, st, dests[i], name)]
+                return FanOutItem(ITEM_FILE, s, child_rel, st, targets) if targets else None
+            return FanOutItem(ITEM_OTHER, s, child_rel, None, [(i, d, exists[i]) for i, d in enumerate(children)])
+
+        return (FanOutItem(ITEM_DIR, folder.src, rel, src_stat, list(zip(range(len(dsts)), dsts, exists))),
+                handle, None)
+
+    yield from _walk(_Folder(src_long, base_name, (roots, src_stat, exists)), visit, log_func, abort_func,
+                     metrics=metrics)
+
+def make_dir(item, log_func=None):
+    """Crée le dossier d'un ScanItem (s'il n'existe pas) avec les attributs de sa source."""
+    if item.exists:
+        return
+    os.makedirs(item.dst, exist_ok=True)
+    try:
+        shutil.copystat(item.src, item.dst, follow_symlinks=False)
+    except Exception as e:
+        if log_func:
+            log_func(f"Impossible de copier les attributs de {item.src} : {e}")
+
+def copy_link(item):
+    """Copie le lien symbolique d'un ScanItem tel quel, en remplaçant ce qui occupe sa destination."""
+    if os.path.lexists(item.dst):
+        os.remove(item.dst)
+    linkto = os.readlink(item.src)
+    os.symlink(linkto, item.dst)
+
+def copy_tree(src, dst, copier, log_func=None, incremental=False, abort_func=None, on_found=None, index=None,
+              link_dest=None, on_linked=None, checkpoint=None, filters=None, cleaner=None):
+    """
+    Copie src dans un sous-dossier de dst en consommant scan_tree au fil de l'eau :
+    les copies de fichiers partent dans le pool dès qu'ils sont découverts.
+    on_found(item) est appelé pour chaque fichier soumis au pool.
+    Les dossiers créés sont enregistrés dans l'index s'il est fourni ; l'enregistrement
+    des fichiers copiés revient au on_copied du pool.
+    Avec link_dest (instantané précédent), les fichiers inchangés y sont liés physiquement
+    au lieu d'être copiés, et on_linked(item) est appelé pour chacun.
+    Avec checkpoint (checkpoint.Checkpoint), les dossiers terminés lors d'une exécution
+    interrompue sont ignorés et l'avancement est noté pour une reprise éventuelle.
+    Les éléments écartés par filters (filters.FilterSet) ne sont ni parcourus ni copiés.
+    Avec cleaner (mirror.MirrorCleaner), ce qui n'existe plus dans src est retiré de la destination.
+    Les mesures du pool (copier.metrics) couvrent aussi le parcours et la création des dossiers.
+    """
+    dest_suffix = copier.compressor.suffix if copier.compressor is not None else ""
+    items = scan_tree(src, dst, log_func, incremental, abort_func, index, dest_suffix, link_dest, copier.packer,
+                      checkpoint, filters, cleaner, copier.metrics)
+    _process_items(items, copier, log_func, abort_func, on_found, index, on_linked, checkpoint)
+
+def copy_paths(src, dst, paths, copier, log_func=None, abort_func=None, on_found=None, index=None, filters=None):
+    """
+    Comme copy_tree, mais seulement pour les chemins de src indiqués (liste de (chemin, récursif)).
+    """
+    dest_suffix = copier.compressor.suffix if copier.compressor is not None else ""
+    items = scan_paths(src, dst, paths, log_func, abort_func, index, dest_suffix, copier.packer, filters,
+                       copier.metrics)
+    _process_items(items, copier, log_func, abort_func, on_found, index)
+
+def _hard_link(item, copier, on_found, on_linked):
+    try:
+        with timer(copier.metrics, "metadata"):
+            os.link(item.link, item.dst)
+    except OSError:
+        # Liens physiques impossibles (système de fichiers, nombre maximal de liens atteint) : copie
+        item = item._replace(kind=ITEM_FILE, dst=os.path.join(os.path.dirname(item.dst),
+                                                              os.path.basename(item.src)), link=None)
+        if on_found:
+            on_found(item)
+        copier.submit(item)
+        return
+    if copier.metrics is not None:
+        copier.metrics.file_skipped(item.stat.st_size, linked=True)
+    if on_linked:
+        on_linked(item)
+
+def _submit(item, copier, checkpoint):
+    if checkpoint is None:
+        copier.submit(item)
+        return
+    number = checkpoint.submitted()
+    future = copier.submit(item)
+    future.add_done_callback(lambda f: checkpoint.finished(number, not f.cancelled() and f.result(), item.rel))
+
+def _process_items(items, copier, log_func, abort_func, on_found, index, on_linked=None, checkpoint=None):
+    metrics = copier.metrics
+    for item in items:
+        if abort_func and abort_func():
+            return
+        try:
+            if item.kind == ITEM_DIR:
+                with timer(metrics, "metadata"):
+                    make_dir(item, log_func)
+                    if index is not None and not item.exists:
+                        if "/" not in item.rel:
+                            index.set_root(item.rel, item.dst)
+                        index.record_dir(item.rel)
+            elif item.kind == ITEM_FILE:
+                if on_found:
+                    on_found(item)
+                _submit(item, copier, checkpoint)
+            elif item.kind == ITEM_HARDLINK:
+                _hard_link(item, copier, on_found, on_linked)
+            elif item.kind == ITEM_LINK:
+                with timer(metrics, "metadata"):
+                    copy_link(item)
+            else:
+                # Cas très rare : autre type (fifo, device, etc.)
+                try:
+                    shutil.copy(item.src, item.dst, follow_symlinks=False)
+                except Exception as e:
+                    if metrics is not None:
+                        metrics.error(e)
+                    if log_func:
+                        log_func(f"Type de fichier non géré ou erreur : {item.src} : {e}")
+                    if checkpoint is not None:
+                        checkpoint.failed(item.rel)
+        except Exception as e:
+            if metrics is not None:
+                metrics.error(e)
+            if log_func:
+                log_func(f"Erreur lors du traitement de {item.src} : {e}")
+            if checkpoint is not None:
+                checkpoint.failed(item.rel)
+
+def copy_folder(src, dst, log_func=None, workers=DEFAULT_OPTIONS["parallel_copies"]):
+    """
+    Copie récursivement tout le contenu de src dans un sous-dossier de dst.
+    Gère les chemins longs, liens symboliques, fichiers cachés, systèmes, fichiers sans extension, fichiers verrouillés, etc.
+    Les dossiers sont créés dans l'ordre du parcours, les fichiers sont copiés par `workers` threads.
+    Journalise les erreurs si log_func est fourni.
+    """
+    with ParallelCopier(workers, log_func=log_func) as copier:
+        copy_tree(src, dst, copier, log_func)
+
+def verify_destination(index, workers=DEFAULT_OPTIONS["parallel_copies"], log_func=None,
+                       progress_func=None, abort_func=None, packs=None):
+    """
+    Relit en parallèle les fichiers de la destination enregistrés avec une empreinte dans
+    l'index (manifest.Manifest) et compare leur empreinte à celle calculée pendant la copie.
+    Les fichiers absents de la destination sont cherchés dans les paquets (packs) s'il y en a.
+    Les fichiers absents ou différents sont journalisés. Retourne (vérifiés, différents, absents).
+    """
+    total = index.count_hashed() or 1
+    checked = mismatched = missing = 0
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max(1, int(workers or 1)) * 4)
+
+    def check(rel, expected):
+        nonlocal checked, mismatched, missing
+        algo, _, digest = expected.partition(":")
+        path = long_path(os.path.join(index.destination, *rel.split("/")))
+        try:
+            try:
+                actual = hash_stored(path, algo)
+            except FileNotFoundError:
+                packed = packs.get(rel) if packs is not None else None
+                if packed is None:
+                    raise
+                hasher = new_hasher(algo)
+                hasher.update(packs.read(packed))
+                actual = hasher.hexdigest()
+            status = "ok" if actual == digest else "diff"
+        except FileNotFoundError:
+            status = "absent"
+        except Exception as e:
+            status = "absent"
+            if log_func:
+                log_func(f"Impossible de relire {rel} : {e}")
+        with lock:
+            checked += 1
+            if status == "diff":
+                mismatched += 1
+            elif status == "absent":
+                missing += 1
+            percent = int(checked / total * 100)
+        if status == "diff" and log_func:
+            log_func(f"Intégrité : empreinte différente pour {rel}")
+        elif status == "absent" and log_func:
+            log_func(f"Intégrité : fichier absent de la destination : {rel}")
+        if progress_func:
+            progress_func(percent)
+
+    def run(rel, expected):
+        try:
+            check(rel, expected)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max(1, int(workers or 1)), thread_name_prefix="verif") as executor:
+        for rel, expected in index.iter_hashed():
+            if abort_func and abort_func():
+                break
+            slots.acquire()
+            executor.submit(run, rel, expected)
+    return checked, mismatched, missing
+
+SizeResult = namedtuple("SizeResult", "files bytes dirs")
+
+class SizeCache:
+    """
+    Calcul de la taille des sources, mis en cache dossier par dossier.
+    Pour chaque dossier sont conservés sa date de modification, le nombre et la taille de ses
+    fichiers directs et la liste de ses sous-dossiers : un nouveau calcul ne relit (scandir)
+    que les dossiers dont la date a changé, les autres ne coûtent qu'un stat.
+    Les liens symboliques ne sont pas suivis, comme pendant la sauvegarde. Un fichier modifié
+    sur place sans changement de son dossier garde sa taille précédente jusqu'au prochain
+    ajout, suppression ou renommage dans ce dossier.
+    Un seul calcul à la fois par cache. Avec filters (filters.FilterSet), les éléments écartés
+    de la sauvegarde ne sont pas comptés et les dossiers écartés ne sont pas parcourus.
+    """
+    def __init__(self, progress_interval=0.25, filters=None):
+        self.progress_interval = progress_interval
+        self.filters = filters
+        self._dirs = {}
+        self.totals = {}
+
+    def scan(self, root, progress_func=None, abort_func=None):
+        """
+        Retourne un SizeResult pour root, ou None si le calcul a été annulé.
+        progress_func(fichiers, octets) reçoit les totaux partiels au fil du parcours.
+        """
+        root_long = long_path(root)
+        files = size = dirs = 0
+        seen = set()
+        prefix = root_long.rstrip(os.sep) + os.sep
+        stack = [root_long]
+        last_progress = time.monotonic()
+        while stack:
+            if abort_func and abort_func():
+                return None
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            cached = self._dirs.get(path)
+            if cached is not None and cached[0] == mtime:
+                _, count, total, subdirs = cached
+            else:
+                count = total = 0
+                subdirs = []
+                try:
+                    with os.scandir(path) as it:
+                        for entry in it:
+                            try:
+                                rel = entry.path[len(prefix):].replace(os.sep, "/") if self.filters else None
+                                if entry.is_dir(follow_symlinks=False):
+                                    if not (self.filters and self.filters.skip_dir(rel)):
+                                        subdirs.append(entry.path)
+                                elif entry.is_file(follow_symlinks=False):
+                                    st = entry.stat(follow_symlinks=False)
+                                    if self.filters and self.filters.skip_file(rel, st.st_size):
+                                        continue
+                                    count += 1
+                                    total += st.st_size
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
+                subdirs = tuple(subdirs)
+                self._dirs[path] = (mtime, count, total, subdirs)
+            seen.add(path)
+            files += count
+            size += total
+            dirs += 1
+            stack.extend(subdirs)
+            if progress_func and time.monotonic() - last_progress >= self.progress_interval:
+                last_progress = time.monotonic()
+                progress_func(files, size)
+        # Oublie les dossiers supprimés depuis le calcul précédent
+        for path in [p for p in self._dirs if p.startswith(prefix) and p not in seen]:
+            del self._dirs[path]
+        result = SizeResult(files, size, dirs)
+        self.totals[root] = result
+        if progress_func:
+            progress_func(files, size)
+        return result
+
+    def cached_total(self, roots):
+        """Somme des derniers résultats connus pour roots, ou None s'il en manque un."""
+        results = [self.totals.get(root) for root in roots]
+        if not results or any(result is None for result in results):
+            return None
+        return SizeResult(*(sum(values) for values in zip(*results)))
@@ -0,0 +1,161 @@
+import os
+import re
+
+# Libellé des fichiers écartés parce qu'ils ne correspondent à aucune règle « include »
+NOT_INCLUDED = "(non inclus)"
+
+def translate(pattern):
+    """
+    Traduit une règle de style gitignore en expression régulière sur le chemin relatif
+    à la racine de la source ("dossier/fichier"). Retourne (expression, dossiers seulement).
+    Une règle sans « / » s'applique au nom à toute profondeur ; avec un « / » (autre que final),
+    elle part de la racine de la source. « * » et « ? » ne franchissent pas « / », « ** » si.
+    """
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    parts = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2 if pattern.startswith("[!", i) or pattern.startswith("[]", i) else i + 1)
+            if end < 0:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                parts.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end + 1
+                continue
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    regex = "".join(parts)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return regex, dir_only
+
+class FilterSet:
+    """
+    Règles d'exclusion et d'inclusion (style gitignore), compilées une fois en deux expressions
+    régulières : l'une pour les dossiers, l'autre pour les fichiers. Chaque règle y est un groupe
+    nommé, ce qui donne en une seule recherche la règle responsable.
+    - exclude : un élément correspondant est écarté ; un dossier écarté n'est pas parcouru.
+      Comme pour gitignore, la dernière règle qui correspond l'emporte et « !règle » réinclut.
+    - include : s'il y en a, seuls les fichiers correspondant à l'une d'elles sont sauvegardés
+      (les dossiers sont toujours parcourus).
+    Les éléments écartés sont comptés par règle (fichiers et octets, dossiers non parcourus).
+    """
+    def __init__(self, exclude=(), include=()):
+        self.rules = []
+        dir_groups = []
+        file_groups = []
+        # Ordre inverse : à position égale, la première alternative qui correspond est la dernière règle
+        for number, rule in reversed(list(enumerate(exclude))):
+            rule = rule.strip()
+            if not rule or rule.startswith("#"):
+                continue
+            regex, dir_only = translate(rule[1:] if rule.startswith("!") else rule)
+            group = f"(?P<r{number}>{regex})"
+            dir_groups.append(group)
+            if not dir_only:
+                file_groups.append(group)
+        flags = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+        self.exclude = list(exclude)
+        self._dirs = re.compile("|".join(dir_groups), flags) if dir_groups else None
+        self._files = re.compile("|".join(file_groups), flags) if file_groups else None
+        include_regexes = [translate(rule.strip())[0] for rule in include if rule.strip()]
+        self._include = re.compile("|".join(include_regexes), flags) if include_regexes else None
+        self.files = {}
+        self.bytes = {}
+        self.dirs = {}
+
+    @classmethod
+    def from_options(cls, options):
+        """FilterSet décrit par les options « exclude » et « include », ou None s'il n'y a aucune règle."""
+        exclude = options.get("exclude") or []
+        include = options.get("include") or []
+        if not exclude and not include:
+            return None
+        return cls(exclude, include)
+
+    def __bool__(self):
+        return bool(self._dirs or self._files or self._include)
+
+    def _rule(self, regex, rel):
+        # Règle d'exclusion qui s'applique à rel, ou None (pas de règle, ou règle « ! »)
+        if regex is None:
+            return None
+        match = regex.fullmatch(rel)
+        if match is None:
+            return None
+        rule = self.exclude[int(match.lastgroup[1:])].strip()
+        return None if rule.startswith("!") else rule
+
+    def excluded(self, rel, is_dir):
+        """True si rel est écarté par une règle, sans le compter (éléments de la destination)."""
+        if is_dir:
+            return self._rule(self._dirs, rel) is not None
+        if self._rule(self._files, rel) is not None:
+            return True
+        return self._include is not None and self._include.fullmatch(rel) is None
+
+    def skip_dir(self, rel):
+        """True si le dossier rel (relatif à la racine de la source) est écarté ; il est alors compté."""
+        rule = self._rule(self._dirs, rel)
+        if rule is None:
+            return False
+        self.dirs[rule] = self.dirs.get(rule, 0) + 1
+        return True
+
+    def skip_file(self, rel, size=0):
+        """True si le fichier (ou lien) rel est écarté ; il est alors compté avec sa taille."""
+        rule = self._rule(self._files, rel)
+        if rule is None and self._include is not None and self._include.fullmatch(rel) is None:
+            rule = NOT_INCLUDED
+        if rule is None:
+            return False
+        self.files[rule] = self.files.get(rule, 0) + 1
+        self.bytes[rule] = self.bytes.get(rule, 0) + size
+        return True
+
+    def skip_path(self, rel, is_dir):
+        """Comme skip_dir/skip_file, en tenant compte des dossiers parents (chemin isolé)."""
+        parts = rel.split("/")
+        for depth in range(1, len(parts)):
+            if self._rule(self._dirs, "/".join(parts[:depth])) is not None:
+                return True
+        return self.skip_dir(rel) if is_dir else self.skip_file(rel)
+
+    def reset(self):
+        self.files = {}
+        self.bytes = {}
+        self.dirs = {}
+
+    def summary(self):
+        """Bilan des éléments écartés, règle par règle ("" si rien n'a été écarté)."""
+        parts = []
+        for rule in sorted(set(self.files) | set(self.dirs)):
+            counts = []
+            if self.dirs.get(rule):
+                counts.append(f"{self.dirs[rule]} dossiers non parcourus")
+            if self.files.get(rule):
+                counts.append(f"{self.files[rule]} fichiers ({self.bytes[rule] / (1024 * 1024):.2f} Mo)")
+            parts.append(f"« {rule} » : {', '.join(counts)}")
+        return "Éléments écartés par les filtres : " + " ; ".join(parts) + "." if parts else ""
@@ -1,134 +1,81 @@
 import sys
 import os
-import shutil
 import datetime
-import time
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
-    QListWidget, QLineEdit, QTextEdit, QComboBox, QFileDialog, QMessageBox,
+    QListWidget, QLineEdit, QTextEdit, QPlainTextEdit, QComboBox, QFileDialog, QMessageBox,
     QProgressBar, QTabWidget
 )
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
-from file_utils import copy_folder
+from backup_engine import MultiBackupEngine, WatchSession, verify
+from file_utils import CONFIG_PATH, SizeCache, load_config
+from filters import FilterSet
+from journal import JournalBuffer, JournalFile
 
 class BackupThread(QThread):
     progress = pyqtSignal(int)
     log = pyqtSignal(str)
-    journal = pyqtSignal(str)
 
-    def __init__(self, sources, destination):
+    def __init__(self, sources, destinations, options=None, paths=None, journal_func=None):
         super().__init__()
-        self.sources = sources
-        self.destination = destination
+        # Les lignes de journal ne passent pas par un signal : journal_func doit accepter
+        # d'être appelée depuis les threads de copie (JournalBuffer.add)
+        self.engine = MultiBackupEngine(sources, destinations, options, paths,
+                                        progress_func=self.progress.emit, log_func=self.log.emit,
+                                        journal_func=journal_func)
+        self.result = None
+
+    def abort(self):
+        self.engine.abort()
+
+    def run(self):
+        self.result = self.engine.run()
+
+class VerifyThread(QThread):
+    progress = pyqtSignal(int)
+
+    def __init__(self, destinations, options=None, journal_func=None):
+        super().__init__()
+        self.destinations = destinations
+        self.options = options
+        self.journal_func = journal_func
         self._abort = False
 
     def abort(self):
         self._abort = True
 
     def run(self):
-        start_time = time.time()
-
-        def count_files(src):
-            total = 0
-            for root, dirs, files in os.walk(src):
-                for f in files:
-                    s = os.path.join(root, f)
-                    rel_path = os.path.relpath(s, src)
-                    d = os.path.join(self.destination, os.path.basename(os.path.normpath(src)), rel_path)
-                    # Correction : vérifier l'existence avant d'appeler getmtime
-                    if not os.path.exists(d):
-                        total += 1
-                    else:
-                        try:
-                            if os.path.getmtime(s) > os.path.getmtime(d):
-                                total += 1
-                        except Exception:
-                            total += 1
-            return total
-
-        total_files = sum(count_files(src) for src in self.sources) or 1
-        copied_files = 0
-        self.journal.emit("Début de la sauvegarde.")
-
-        def copy_folder_progress(src, dst, log_func=None):
-            nonlocal copied_files
-            base_name = os.path.basename(os.path.normpath(src))
-            dst_subfolder = os.path.join(dst, base_name)
-            src_long = src
-            dst_long = dst_subfolder
-            if os.name == 'nt':
-                from file_utils import long_path
-                src_long = long_path(src)
-                dst_long = long_path(dst_subfolder)
-            try:
-                if not os.path.exists(dst_long):
-                    os.makedirs(dst_long, exist_ok=True)
-                    try:
-                        shutil.copystat(src_long, dst_long, follow_symlinks=False)
-                    except Exception as e:
-                        if log_func:
-                            log_func(f"Impossible de copier les attributs de {src} : {e}")
-                for item in os.listdir(src_long):
-                    if self._abort:
-                        if log_func:
-                            log_func("Copie annulée par l'utilisateur.")
-                        return
-                    s = os.path.join(src_long, item)
-                    d = os.path.join(dst_long, item)
-                    try:
-                        if os.path.islink(s):
-                            if os.path.lexists(d):
-                                os.remove(d)
-                            linkto = os.readlink(s)
-                            os.symlink(linkto, d)
-                        elif os.path.isdir(s):
-                            copy_folder_progress(s, dst_long, log_func)
-                        else:
-                            # Ne copie que si le fichier n'existe pas ou a été modifié
-                            if not os.path.exists(d) or os.path.getmtime(s) > os.path.getmtime(d):
-                                shutil.copy2(s, d, follow_symlinks=False)
-                                copied_files += 1
-                                percent = int((copied_files / total_files) * 100)
-                                self.progress.emit(percent)
-                    except OSError as e:
-                        try:
-                            if os.name == 'nt':
-                                from file_utils import long_path
-                                # Ne copie que si le fichier n'existe pas ou a été modifié
-                                if not os.path.exists(d) or os.path.getmtime(s) > os.path.getmtime(d):
-                                    shutil.copy2(long_path(s), long_path(d), follow_symlinks=False)
-                                    copied_files += 1
-                                    percent = int((copied_files / total_files) * 100)
-                                    self.progress.emit(percent)
-                            else:
-                                raise
-                        except Exception as e2:
-                            if log_func:
-                                log_func(f"Erreur lors de la copie de {s} : {e2}")
-            except Exception as e:
-                if log_func:
-                    log_func(f"Erreur critique lors de la copie de {src} : {e}")
+        for destination in self.destinations:
+            if self._abort:
+                return
+            verify(destination, self.options, progress_func=self.progress.emit,
+                   journal_func=self.journal_func, abort_func=lambda: self._abort)
+
+class SizeThread(QThread):
+    counted = pyqtSignal(object, object)
+
+    def __init__(self, sources, cache):
+        super().__init__()
+        self.sources = sources
+        self.cache = cache
+        self.result = None
+        self._abort = False
+
+    def abort(self):
+        self._abort = True
 
+    def run(self):
+        files = size = 0
         for src in self.sources:
-            if self._abort:
-                self.journal.emit("Copie annulée par l'utilisateur.")
-                break
-            try:
-                self.journal.emit(f"Préparation à copier : {src}")
-                self.log.emit(f"Copie de {src} vers {self.destination}...")
-                self.journal.emit(f"Copie de {src} vers {self.destination} démarrée.")
-                copy_folder_progress(src, self.destination, log_func=self.journal.emit)
-                if not self._abort:
-                    self.journal.emit(f"Copie de {src} terminée avec succès.")
-            except Exception as e:
-                self.journal.emit(f"Erreur lors de la copie de {src} : {str(e)}")
-        self.progress.emit(100)
-        elapsed = time.time() - start_time
-        if self._abort:
-            self.journal.emit("Fin de la sauvegarde (annulée par l'utilisateur).")
-        else:
-            self.journal.emit(f"Fin de la sauvegarde. Durée totale : {elapsed:.2f} secondes.")
-            self.log.emit("Sauvegarde terminée.")
+            # Les totaux partiels s'ajoutent à ceux des sources déjà calculées
+            done_files, done_size = files, size
+            result = self.cache.scan(src, abort_func=lambda: self._abort,
+                                     progress_func=lambda n, b: self.counted.emit(done_files + n, done_size + b))
+            if result is None:
+                return
+            files += result.files
+            size += result.bytes
+        self.result = (files, size)
 
 class BackupAssistant(QWidget):
     def __init__(self):
@@ -146,6 +93,29 @@ class BackupAssistant(QWidget):
         self.scheduled_timer = QTimer(self)
         self.scheduled_timer.timeout.connect(self.scheduled_backup_tick)
 
+        # Surveillance continue des sources
+        self.watch_session = None
+        self.watch_timer = QTimer(self)
+        self.watch_timer.timeout.connect(self.watch_tick)
+
+        # Journal : lignes accumulées par les threads, affichées par lots et copiées sur disque
+        options = load_config()["options"]
+        self.journal_buffer = JournalBuffer()
+        self.journal_file = None
+        if options.get("journal_file"):
+            path = os.path.join(os.path.dirname(CONFIG_PATH), options["journal_file"])
+            self.journal_file = JournalFile(path, int(options.get("journal_max_mb", 5) * 1024 * 1024),
+                                            options.get("journal_backups", 5),
+                                            log_func=self.journal_buffer.add)
+        self.journal_max_lines = options.get("journal_max_lines", 5000)
+        self.journal_timer = QTimer(self)
+        self.journal_timer.timeout.connect(self.flush_journal)
+        self.journal_timer.start(250)
+
+        # Tailles des sources, conservées d'un calcul à l'autre
+        self.size_cache = SizeCache(filters=FilterSet.from_options(options))
+        self.size_thread = None
+
         self.init_ui()
 
     def init_ui(self):
@@ -188,19 +158,33 @@ class BackupAssistant(QWidget):
         self.btn_total_size.setStyleSheet("background-color: #d4edda;")
         self.btn_total_size.clicked.connect(self.show_total_size)
         btns_layout.addWidget(self.btn_total_size)
+
+        self.btn_verify = QPushButton("Vérifier l'intégrité")
+        self.btn_verify.setStyleSheet("background-color: #cce5ff;")
+        self.btn_verify.clicked.connect(self.start_verify)
+        btns_layout.addWidget(self.btn_verify)
         btns_layout.addStretch()
         src_list_layout.addLayout(btns_layout)
         tab_main_layout.addLayout(src_list_layout)
 
+        self.size_label = QLabel("")
+        self.size_label.setStyleSheet("color: #555;")
+        tab_main_layout.addWidget(self.size_label)
+
         # Destination folder
         dst_layout = QHBoxLayout()
-        dst_label = QLabel("Dossier de destination :")
+        dst_label = QLabel("Dossier(s) de destination :")
         dst_layout.addWidget(dst_label)
+        # Plusieurs destinations séparées par « ; » : les sources ne sont lues qu'une fois pour toutes
         self.dst_edit = QLineEdit()
+        self.dst_edit.setPlaceholderText("D:\\Sauvegarde ; E:\\Sauvegarde")
         dst_layout.addWidget(self.dst_edit)
         self.btn_choose_dst = QPushButton("Choisir destination")
         self.btn_choose_dst.clicked.connect(self.choose_destination)
         dst_layout.addWidget(self.btn_choose_dst)
+        self.btn_add_dst = QPushButton("Ajouter destination")
+        self.btn_add_dst.clicked.connect(self.add_destination)
+        dst_layout.addWidget(self.btn_add_dst)
         tab_main_layout.addLayout(dst_layout)
 
         # Frequency
@@ -213,7 +197,8 @@ class BackupAssistant(QWidget):
             "Toutes les 10 minutes",
             "Toutes les 12 heures",
             "Tous les jours",
-            "Toutes les semaines"
+            "Toutes les semaines",
+            "En continu (surveillance des modifications)"
         ])
         self.freq_combo.currentIndexChanged.connect(self.on_freq_changed)
         freq_layout.addWidget(self.freq_combo)
@@ -291,8 +276,10 @@ class BackupAssistant(QWidget):
         )
         journal_info.setWordWrap(True)
         log_layout.addWidget(journal_info)
-        self.journal_text = QTextEdit()
+        # Seules les dernières lignes restent affichées ; le journal complet est dans le fichier
+        self.journal_text = QPlainTextEdit()
         self.journal_text.setReadOnly(True)
+        self.journal_text.setMaximumBlockCount(self.journal_max_lines)
         log_layout.addWidget(self.journal_text)
         self.tab_log.setLayout(log_layout)
 
@@ -302,10 +289,11 @@ class BackupAssistant(QWidget):
             "<b>Fonctionnement de l'application</b><br><br>"
             "<ul>"
             "<li><b>Sauvegarde simple :</b> Sélectionnez un ou plusieurs dossiers source et un dossier de destination, puis lancez la sauvegarde.</li>"
+            "<li><b>Plusieurs destinations :</b> Séparez-les par « ; » (ou utilisez « Ajouter destination ») : chaque fichier modifié n'est lu qu'une fois et écrit dans toutes les destinations en parallèle.</li>"
             "<li><b>Planification :</b> Choisissez une fréquence pour automatiser les sauvegardes (quotidienne, hebdomadaire, ou manuelle).</li>"
             "<li><b>Journalisation :</b> Consultez l’onglet Journal pour suivre l’historique détaillé des opérations, erreurs et succès.</li>"
             "<li><b>Progression :</b> Une barre de progression indique l’avancement de la sauvegarde en cours.</li>"
-            "<li><b>Intégrité :</b> L’application vérifie et consigne chaque étape pour garantir la fiabilité des copies.</li>"
+            "<li><b>Intégrité :</b> Une empreinte de chaque fichier est calculée pendant la copie ; le bouton « Vérifier l'intégrité » relit la destination et signale les fichiers différents ou absents.</li>"
             "</ul>"
             "<br>"
             "L’application est conçue pour être simple d’utilisation, robuste et adaptée à la gestion de gros volumes de données.<br>"
@@ -321,6 +309,7 @@ class BackupAssistant(QWidget):
 
     def on_freq_changed(self):
         # Réinitialise l'affichage sans lancer la planification
+        self.stop_watch()
         self.next_backup_time = None
         self.scheduled_backup_active = False
         self.btn_cancel_schedule.setVisible(False)
@@ -333,6 +322,9 @@ class BackupAssistant(QWidget):
         if freq == "Une seule fois":
             QMessageBox.information(self, "Info", "Veuillez choisir une fréquence (quotidienne ou hebdomadaire) pour activer la sauvegarde automatique.")
             return
+        if freq == "En continu (surveillance des modifications)":
+            self.start_watch()
+            return
         self.setup_scheduled_backup()
         self.write_journal("Sauvegarde automatique programmée par l'utilisateur.")
         self.log_text.append("Sauvegarde automatique programmée.")
@@ -389,7 +381,45 @@ class BackupAssistant(QWidget):
             self.scheduled_backup_active = False
             self.btn_cancel_schedule.setVisible(False)
 
+    def start_watch(self):
+        sources = [self.src_list.item(i).text() for i in range(self.src_list.count())]
+        if not sources or not self.destinations():
+            QMessageBox.warning(self, "Erreur", "Veuillez sélectionner au moins un dossier source et une destination.")
+            return
+        self.stop_watch()
+        self.watch_session = WatchSession(sources, journal_func=self.write_journal)
+        self.watch_session.start()
+        self.scheduled_backup_active = True
+        self.btn_cancel_schedule.setVisible(True)
+        self.watch_timer.start(1000)
+        self.write_journal("Sauvegarde continue activée : les sources sont surveillées.")
+        self.log_text.append("Sauvegarde continue activée.")
+        self.update_next_backup_label()
+
+    def stop_watch(self):
+        self.watch_timer.stop()
+        if self.watch_session is not None:
+            self.watch_session.stop()
+            self.watch_session = None
+
+    def watch_tick(self):
+        if self.watch_session is None:
+            self.watch_timer.stop()
+            return
+        # self.thread est la méthode QObject.thread() tant qu'aucune sauvegarde n'a été lancée
+        if isinstance(self.thread, BackupThread) and self.thread.isRunning():
+            return
+        batch = self.watch_session.next_batch()
+        if batch is None:
+            return
+        kind, paths = batch
+        if kind == WatchSession.FULL:
+            self.start_backup(scheduled=True)
+        else:
+            self.start_backup(scheduled=True, paths=paths)
+
     def cancel_scheduled_backup(self):
+        self.stop_watch()
         self.scheduled_backup_active = False
         self.scheduled_timer.stop()
         self.next_backup_time = None
@@ -399,7 +429,10 @@ class BackupAssistant(QWidget):
         self.write_journal("Planification de sauvegarde automatique annulée par l'utilisateur.")
 
     def update_next_backup_label(self):
-        if self.scheduled_backup_active and self.scheduled_seconds_left is not None:
+        if self.watch_session is not None:
+            pending = self.watch_session.pending()
+            self.next_backup_label.setText(f"Surveillance active : {pending} modification(s) en attente")
+        elif self.scheduled_backup_active and self.scheduled_seconds_left is not None:
             total = self.scheduled_seconds_left
             if total > 0:
                 h, rem = divmod(int(total), 3600)
@@ -410,31 +443,40 @@ class BackupAssistant(QWidget):
         else:
             self.next_backup_label.setText("Prochaine sauvegarde dans : --:--:--")
 
-    def start_backup(self, scheduled=False):
+    def start_backup(self, scheduled=False, paths=None):
         sources = [self.src_list.item(i).text() for i in range(self.src_list.count())]
-        destination = self.dst_edit.text()
-        if not sources or not destination:
+        destinations = self.destinations()
+        if not sources or not destinations:
             QMessageBox.warning(self, "Erreur", "Veuillez sélectionner au moins un dossier source et une destination.")
             return
         self.progress_bar.setValue(0)
-        if scheduled:
+        if paths is not None:
+            self.log_text.append("Sauvegarde des modifications détectées...")
+            self.write_journal("Sauvegarde des modifications détectées lancée automatiquement.")
+        elif scheduled:
             self.log_text.append("Sauvegarde planifiée lancée automatiquement...")
             self.write_journal("Sauvegarde planifiée lancée automatiquement.")
         else:
             self.log_text.append("Sauvegarde lancée...")
             self.write_journal("Sauvegarde lancée manuellement.")
+        # Le dernier calcul de « Taille totale » est réutilisé plutôt que de reparcourir les sources
+        known = self.size_cache.cached_total(sources)
+        if known is not None:
+            self.write_journal(f"Volume des sources (dernier calcul) : {known.files} fichiers, "
+                               f"{known.bytes / (1024 * 1024):.2f} Mo.")
         self.btn_abort_copy.setVisible(True)
-        self.thread = BackupThread(sources, destination)
+        self.thread = BackupThread(sources, destinations, paths=paths, journal_func=self.journal_buffer.add)
         self.thread.progress.connect(self.progress_bar.setValue)
         self.thread.log.connect(self.log_and_journal)
-        self.thread.journal.connect(self.write_journal)
         self.thread.finished.connect(self.on_backup_finished)
         self.thread.start()
 
     def on_backup_finished(self):
         self.btn_abort_copy.setVisible(False)
+        self.flush_journal()
         # Si la sauvegarde était planifiée, recommence le compte à rebours
-        if self.scheduled_backup_active:
+        # (en surveillance continue, c'est watch_tick qui relance les sauvegardes)
+        if self.scheduled_backup_active and self.watch_session is None:
             self.schedule_next_backup()
 
     def log_and_journal(self, msg):
@@ -442,8 +484,35 @@ class BackupAssistant(QWidget):
         self.write_journal(msg)
 
     def write_journal(self, msg):
-        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.journal_text.append(f"[{now}] {msg}")
+        self.journal_buffer.add(msg)
+
+    def flush_journal(self):
+        lines = self.journal_buffer.drain()
+        if not lines:
+            return
+        self.journal_text.appendPlainText("\n".join(lines))
+        if self.journal_file is not None:
+            self.journal_file.write(lines)
+
+    def closeEvent(self, event):
+        self.flush_journal()
+        if self.journal_file is not None:
+            self.journal_file.close()
+        super().closeEvent(event)
+
+    def start_verify(self):
+        destinations = self.destinations()
+        if not destinations:
+            QMessageBox.warning(self, "Erreur", "Veuillez choisir le dossier de destination à vérifier.")
+            return
+        if hasattr(self, 'verify_thread') and self.verify_thread.isRunning():
+            return
+        self.progress_bar.setValue(0)
+        self.log_text.append("Vérification de l'intégrité lancée...")
+        self.verify_thread = VerifyThread(destinations, journal_func=self.journal_buffer.add)
+        self.verify_thread.progress.connect(self.progress_bar.setValue)
+        self.verify_thread.finished.connect(lambda: self.log_text.append("Vérification terminée, voir le journal."))
+        self.verify_thread.start()
 
     def add_source(self):
         folder = QFileDialog.getExistingDirectory(self, "Choisir un dossier source")
@@ -455,20 +524,29 @@ class BackupAssistant(QWidget):
             self.src_list.takeItem(self.src_list.row(item))
 
     def show_total_size(self):
-        import os
-        def get_size(path):
-            total = 0
-            for dirpath, dirnames, filenames in os.walk(path):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    if os.path.isfile(fp):
-                        total += os.path.getsize(fp)
-            return total
-
-        total_size = 0
-        for i in range(self.src_list.count()):
-            total_size += get_size(self.src_list.item(i).text())
-        size_mb = total_size / (1024 * 1024)
+        # Un second clic pendant le calcul l'annule
+        if self.size_thread is not None and self.size_thread.isRunning():
+            self.size_thread.abort()
+            return
+        sources = [self.src_list.item(i).text() for i in range(self.src_list.count())]
+        self.size_label.setText("Taille totale : calcul en cours...")
+        self.btn_total_size.setText("Annuler le calcul")
+        self.size_thread = SizeThread(sources, self.size_cache)
+        self.size_thread.counted.connect(self.on_size_counted)
+        self.size_thread.finished.connect(self.on_size_finished)
+        self.size_thread.start()
+
+    def on_size_counted(self, files, size):
+        self.size_label.setText(f"Taille totale : calcul en cours... {files} fichiers, {size / (1024 * 1024):.2f} Mo")
+
+    def on_size_finished(self):
+        self.btn_total_size.setText("Taille totale")
+        if self.size_thread.result is None:
+            self.size_label.setText("Taille totale : calcul annulé.")
+            return
+        files, size = self.size_thread.result
+        size_mb = size / (1024 * 1024)
+        self.size_label.setText(f"Taille totale : {size_mb:.2f} Mo ({files} fichiers)")
         QMessageBox.information(self, "Taille totale", f"Taille totale : {size_mb:.2f} Mo")
 
     def choose_destination(self):
@@ -476,6 +554,14 @@ class BackupAssistant(QWidget):
         if folder:
             self.dst_edit.setText(folder)
 
+    def add_destination(self):
+        folder = QFileDialog.getExistingDirectory(self, "Ajouter un dossier de destination")
+        if folder and folder not in self.destinations():
+            self.dst_edit.setText(" ; ".join(self.destinations() + [folder]))
+
+    def destinations(self):
+        return [d.strip() for d in self.dst_edit.text().split(";") if d.strip()]
+
     def abort_copy(self):
         if hasattr(self, 'thread') and self.thread.isRunning():
             self.thread.abort()
@@ -0,0 +1,66 @@
+import os
+import time
+import threading
+import logging
+import logging.handlers
+
+_stamp_cache = (None, "")
+
+def timestamp(now=None):
+    """Horodatage du journal ; le texte n'est recalculé qu'une fois par seconde."""
+    global _stamp_cache
+    second = int(time.time() if now is None else now)
+    cached_second, text = _stamp_cache
+    if cached_second != second:
+        text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        _stamp_cache = (second, text)
+    return text
+
+class JournalBuffer:
+    """
+    Lignes de journal en attente d'affichage. add() peut être appelé depuis n'importe quel thread
+    (copie, vérification, surveillance) ; l'interface relève les lignes par lots avec drain(),
+    à cadence fixe, au lieu de recevoir un signal par ligne.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lines = []
+
+    def add(self, msg):
+        line = f"[{timestamp()}] {msg}"
+        with self._lock:
+            self._lines.append(line)
+
+    def drain(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+        return lines
+
+class JournalFile:
+    """
+    Copie complète du journal sur disque, avec rotation : au-delà de max_bytes, le fichier est
+    renommé en .1 (les précédents décalés jusqu'à .backups) et un nouveau fichier est commencé.
+    """
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, backups=5, log_func=None):
+        self.path = path
+        self._handler = None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            self._handler.setFormatter(logging.Formatter("%(message)s"))
+        except Exception as e:
+            if log_func:
+                log_func(f"Fichier journal {path} indisponible : {e}")
+
+    def write(self, lines):
+        if self._handler is None:
+            return
+        for line in lines:
+            self._handler.emit(logging.makeLogRecord({"msg": line, "levelno": logging.INFO}))
+        self._handler.flush()
+
+    def close(self):
+        if self._handler is not None:
+            self._handler.close()
+            self._handler = None
@@ -1,5 +1,222 @@
-from gui import launch_gui
+import argparse
+import json
+import os
+import signal
+import sys
+import time
 
-if __name__ == "__main__":
-    launch_gui()
+# Codes de retour de la ligne de commande
+EXIT_OK = 0
+EXIT_ERRORS = 1        # sauvegarde terminée, mais des fichiers n'ont pas pu être copiés ou vérifiés
+EXIT_CONFIG = 2        # configuration ou arguments invalides
+EXIT_ABORTED = 130     # interrompue (Ctrl+C, SIGTERM)
+
+def emit(event, **fields):
+    # Une ligne JSON par événement, pour être lue par un script ou un superviseur
+    fields["event"] = event
+    fields["time"] = round(time.time(), 3)
+    print(json.dumps(fields, ensure_ascii=False), flush=True)
+
+def _progress_printer():
+    last = [-1]
+
+    def progress(percent):
+        # N'écrit que les changements de pourcentage
+        if percent != last[0]:
+            last[0] = percent
+            emit("progress", percent=percent)
+    return progress
+
+def _journal(msg):
+    emit("journal", message=msg)
+
+def _load(args):
+    from file_utils import load_config
+    config = load_config(args.config)
+    sources = getattr(args, "source", None) or config["sources"]
+    destinations = args.destination or config["destinations"]
+    return config, sources, destinations
+
+def _on_signal(callback):
+    def handler(signum, frame):
+        emit("signal", signal=signum)
+        callback()
+    signal.signal(signal.SIGINT, handler)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, handler)
+
+def run_backup(args, paths=None, engines=None):
+    from backup_engine import MultiBackupEngine
+    config, sources, destinations = _load(args)
+    if not sources or not destinations:
+        emit("error", message="Aucune source ou aucune destination configurée.")
+        return EXIT_CONFIG
+    # Plusieurs destinations : les sources ne sont lues qu'une fois quand le mode le permet
+    engine = MultiBackupEngine(sources, destinations, config["options"], paths,
+                               progress_func=_progress_printer(), journal_func=_journal)
+    if engines is not None:
+        engines.append(engine)
+    code = EXIT_OK
+    for destination, result in zip(destinations, engine.run()):
+        emit("summary", destination=destination, **result._asdict())
+        if result.aborted:
+            return EXIT_ABORTED
+        if result.errors:
+            code = EXIT_ERRORS
+    return code
+
+def cmd_backup(args):
+    engines = []
+    _on_signal(lambda: [engine.abort() for engine in engines])
+    return run_backup(args, engines=engines)
+
+def cmd_verify(args):
+    from backup_engine import verify
+    config, _, destinations = _load(args)
+    if not destinations:
+        emit("error", message="Aucune destination configurée.")
+        return EXIT_CONFIG
+    aborted = []
+    _on_signal(lambda: aborted.append(True))
+    code = EXIT_OK
+    for destination in destinations:
+        result = verify(destination, config["options"], progress_func=_progress_printer(),
+                        journal_func=_journal, abort_func=lambda: bool(aborted))
+        if result is None:
+            code = EXIT_ERRORS
+            continue
+        emit("summary", destination=destination, **result._asdict())
+        if result.aborted:
+            return EXIT_ABORTED
+        if result.mismatched or result.missing:
+            code = EXIT_ERRORS
+    return code
+
+def cmd_watch(args):
+    from backup_engine import WatchSession
+    config, sources, destinations = _load(args)
+    if not sources or not destinations:
+        emit("error", message="Aucune source ou aucune destination configurée.")
+        return EXIT_CONFIG
+    stopping = []
+    engines = []
+
+    def stop():
+        stopping.append(True)
+        for engine in engines:
+            engine.abort()
+    _on_signal(stop)
+    session = WatchSession(sources, config["options"], journal_func=_journal)
+    session.start()
+    emit("watch", sources=sources, destinations=destinations)
+    try:
+        while not stopping:
+            batch = session.next_batch()
+            if batch is None:
+                time.sleep(1)
+                continue
+            kind, paths = batch
+            del engines[:]
+            run_backup(args, paths=paths, engines=engines)
+    finally:
+        session.stop()
+    return EXIT_ABORTED
+
+def cmd_restore(args):
+    from restore import RestoreEngine
+    config, sources, destinations = _load(args)
+    if not destinations:
+        emit("error", message="Indiquez la destination contenant la sauvegarde.")
+        return EXIT_CONFIG
+    if args.target is None and not sources:
+        emit("error", message="Sans --target, les sources de la configuration sont nécessaires pour retrouver l'emplacement d'origine.")
+        return EXIT_CONFIG
+    destination = destinations[0]
+    engine = RestoreEngine(destination, config["options"], progress_func=_progress_printer(), journal_func=_journal)
+    _on_signal(engine.abort)
+    result = engine.run(args.path or [""], args.backup, args.target, args.overwrite, sources)
+    if result is None:
+        emit("error", message=f"Sauvegarde introuvable dans {destination} : {args.backup or 'aucune sauvegarde'}")
+        return EXIT_CONFIG
+    emit("summary", destination=destination, backup=args.backup, **result._asdict())
+    if result.aborted:
+        return EXIT_ABORTED
+    return EXIT_ERRORS if result.failed or result.mismatched or result.conflicts else EXIT_OK
+
+def cmd_search(args):
+    from restore import RestoreCatalog
+    config, _, destinations = _load(args)
+    if not destinations:
+        emit("error", message="Aucune destination configurée.")
+        return EXIT_CONFIG
+    for destination in destinations:
+        with RestoreCatalog(destination, log_func=_journal,
+                            compression_hint=bool(config["options"].get("compression"))) as catalog:
+            catalog.refresh()
+            if args.runs:
+                for run in catalog.runs():
+                    emit("run", destination=destination, **run._asdict())
+                continue
+            count = 0
+            for entry in catalog.search(args.pattern or "", args.backup, args.limit):
+                emit("match", destination=destination, **entry._asdict())
+                count += 1
+            emit("summary", destination=destination, pattern=args.pattern, matches=count)
+    return EXIT_OK
+
+def cmd_gui(args):
+    # PyQt5 n'est chargé que pour l'interface graphique
+    from gui import launch_gui
     launch_gui()
+    return EXIT_OK
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Assistant de sauvegarde de dossiers.")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("gui", help="lance l'interface graphique (par défaut)")
+    for name, helptext in (("backup", "lance une sauvegarde sans interface"),
+                           ("verify", "vérifie l'intégrité des destinations"),
+                           ("watch", "sauvegarde continue sans interface (démon)")):
+        p = sub.add_parser(name, help=helptext)
+        p.add_argument("--config", default=None, help="chemin de config.json")
+        p.add_argument("--source", action="append", help="dossier source (remplace ceux de la configuration)")
+        p.add_argument("--destination", action="append", help="dossier de destination (remplace ceux de la configuration)")
+    p = sub.add_parser("restore", help="restaure des fichiers ou dossiers d'une sauvegarde (miroir, instantané ou dépôt)")
+    p.add_argument("--config", default=None, help="chemin de config.json")
+    p.add_argument("--destination", action="append", help="destination contenant la sauvegarde")
+    p.add_argument("--backup", default=None, help="sauvegarde à restaurer (la plus récente par défaut, voir search --runs)")
+    p.add_argument("--path", action="append", help="chemin ou motif à restaurer, relatif à la sauvegarde "
+                                                   "(répétable, tout par défaut)")
+    p.add_argument("--target", default=None, help="dossier où écrire les fichiers restaurés (emplacement d'origine par défaut)")
+    p.add_argument("--overwrite", action="store_true", help="remplace les fichiers existants qui diffèrent de la sauvegarde")
+    p = sub.add_parser("search", help="cherche des fichiers dans toutes les sauvegardes d'une destination")
+    p.add_argument("--config", default=None, help="chemin de config.json")
+    p.add_argument("--destination", action="append", help="destination où chercher")
+    p.add_argument("--pattern", default="", help="préfixe de chemin ou motif (* ? [...] **)")
+    p.add_argument("--backup", default=None, help="limite la recherche à une sauvegarde")
+    p.add_argument("--limit", type=int, default=None, help="nombre maximal de résultats")
+    p.add_argument("--runs", action="store_true", help="liste les sauvegardes cataloguées")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command in (None, "gui"):
+        return cmd_gui(args)
+    if args.config is None:
+        from file_utils import CONFIG_PATH
+        args.config = CONFIG_PATH
+    elif not os.path.isfile(args.config):
+        emit("error", message=f"Fichier de configuration introuvable : {args.config}")
+        return EXIT_CONFIG
+    from file_utils import load_config
+    try:
+        load_config(args.config, strict=True)
+    except (OSError, ValueError) as e:
+        emit("error", message=f"Fichier de configuration invalide : {args.config} : {e}")
+        return EXIT_CONFIG
+    commands = {"backup": cmd_backup, "verify": cmd_verify, "watch": cmd_watch, "restore": cmd_restore,
+                "search": cmd_search}
+    return commands[args.command](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
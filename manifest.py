@@ -0,0 +1,205 @@
+import os
+import sqlite3
+import threading
+import time
+
+INDEX_NAME = ".sauvegarde_index.sqlite"
+SCHEMA_VERSION = 1
+
+KIND_FILE = "f"
+KIND_DIR = "d"
+
+class Manifest:
+    """
+    Index des fichiers sauvegardés dans une destination (base SQLite à la racine de la destination).
+    Chaque entrée décrit le fichier source tel qu'il était lors de sa dernière copie
+    (taille, mtime, inode, empreinte optionnelle), ce qui permet de décider s'il faut recopier
+    un fichier sans interroger la destination.
+    Les écritures sont regroupées et validées par lots ; l'objet peut être utilisé depuis plusieurs threads.
+    Un index nouveau, reconstruit, ou dont la dernière vérification complète date de plus de
+    max_age_days n'est pas « de confiance » : la destination est alors comparée directement
+    et l'index est remis à jour au passage.
+    """
+    def __init__(self, destination, batch_size=1000, log_func=None, max_age_days=7):
+        self.destination = destination
+        self.path = os.path.join(destination, INDEX_NAME)
+        self.batch_size = batch_size
+        self.log_func = log_func
+        self._lock = threading.Lock()
+        self._pending = []
+        self.fresh = not os.path.exists(self.path)
+        try:
+            self._conn = self._open()
+        except sqlite3.DatabaseError as e:
+            # Index corrompu ou d'une version incompatible : on le met de côté et on repart de zéro
+            self._log(f"Index de sauvegarde illisible, reconstruction : {e}")
+            self._discard()
+            self.fresh = True
+            self._conn = self._open()
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'verified_at'").fetchone()
+        verified_at = float(row[0]) if row is not None else 0.0
+        self.trusted = not self.fresh and time.time() - verified_at < max_age_days * 86400
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if row is not None and int(row[0]) != SCHEMA_VERSION:
+                raise sqlite3.DatabaseError(f"version de schéma {row[0]} inattendue")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY, kind TEXT NOT NULL, size INTEGER, mtime_ns INTEGER,"
+                " inode INTEGER, hash TEXT, copied_at REAL) WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS roots (name TEXT PRIMARY KEY, dev INTEGER, inode INTEGER)")
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _discard(self):
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.replace(self.path + suffix, self.path + suffix + ".corrompu")
+            except OSError:
+                pass
+
+    def check_root(self, name, dst_path):
+        """
+        Vérifie que le dossier de destination d'une source est bien celui qui a été indexé.
+        S'il a disparu ou a été recréé (inode différent), les entrées de cette source sont oubliées.
+        Retourne True si l'index est utilisable pour cette source.
+        """
+        try:
+            st = os.stat(dst_path)
+        except OSError:
+            st = None
+        with self._lock:
+            row = self._conn.execute("SELECT dev, inode FROM roots WHERE name = ?", (name,)).fetchone()
+            valid = st is not None and row is not None and tuple(row) == (st.st_dev, st.st_ino)
+            if not valid:
+                self._flush_locked()
+                with self._conn:
+                    self._conn.execute("DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)",
+                                       (name, name + "/", name + "0"))
+                    if st is not None:
+                        self._conn.execute("INSERT OR REPLACE INTO roots VALUES (?, ?, ?)",
+                                           (name, st.st_dev, st.st_ino))
+                    else:
+                        self._conn.execute("DELETE FROM roots WHERE name = ?", (name,))
+                if row is not None:
+                    self._log(f"Index obsolète pour {name}, vérification complète de la destination.")
+        return valid
+
+    def set_root(self, name, dst_path):
+        # Enregistre l'identité du dossier de destination d'une source (après sa création)
+        st = os.stat(dst_path)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO roots VALUES (?, ?, ?)", (name, st.st_dev, st.st_ino))
+
+    def mark_verified(self):
+        # À appeler après une sauvegarde complète ayant comparé toute la destination
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('verified_at', ?)", (str(time.time()),))
+
+    def get(self, rel):
+        """Retourne (kind, size, mtime_ns, inode, hash) pour un chemin relatif, ou None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT kind, size, mtime_ns, inode, hash FROM files WHERE path = ?", (rel,)
+            ).fetchone()
+
+    def has_dir(self, rel):
+        row = self.get(rel)
+        return row is not None and row[0] == KIND_DIR
+
+    def children(self, rel):
+        """Noms triés des éléments indexés directement dans le dossier rel."""
+        self.flush()
+        start = len(rel) + 1
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM files WHERE path >= ? AND path < ? ORDER BY path",
+                                      (rel + "/", rel + "0")).fetchall()
+        return [path[start:] for path, in rows if "/" not in path[start:]]
+
+    def forget(self, rel):
+        """Retire de l'index l'élément rel et, pour un dossier, tout son contenu."""
+        with self._lock:
+            self._flush_locked()
+            with self._conn:
+                self._conn.execute("DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)",
+                                   (rel, rel + "/", rel + "0"))
+
+    def count_hashed(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM files WHERE kind = ? AND hash IS NOT NULL", (KIND_FILE,)
+            ).fetchone()[0]
+
+    def iter_hashed(self):
+        """Parcourt (chemin relatif, empreinte) des fichiers indexés avec une empreinte, par lots."""
+        self.flush()
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT path, hash FROM files WHERE path > ? AND kind = ? AND hash IS NOT NULL"
+                    " ORDER BY path LIMIT 1000", (last, KIND_FILE)
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    @staticmethod
+    def matches(row, st):
+        """True si le fichier source décrit par st correspond à l'entrée d'index row."""
+        return (row is not None and row[0] == KIND_FILE and row[1] == st.st_size
+                and row[2] == st.st_mtime_ns and row[3] == st.st_ino)
+
+    def record(self, rel, st, digest=None):
+        self._add((rel, KIND_FILE, st.st_size, st.st_mtime_ns, st.st_ino, digest, time.time()))
+
+    def record_dir(self, rel):
+        self._add((rel, KIND_DIR, None, None, None, None, time.time()))
+
+    def _add(self, row):
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            try:
+                self._flush_locked()
+            finally:
+                self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import time
+import errno
+import heapq
+import random
+import threading
+
+# Phases d'une sauvegarde, dans l'ordre du rapport
+PHASES = ("scan", "compare", "copy", "metadata", "finalize")
+# Fichiers et dossiers les plus lents conservés dans le rapport
+SLOWEST = 10
+# Échantillons conservés pour les centiles (tirage aléatoire uniforme au-delà)
+MAX_SAMPLES = 10000
+# Taille minimale d'un fichier pour entrer dans les centiles de débit (les petits fichiers
+# ne mesurent que le coût fixe d'une copie, déjà visible dans les centiles de durée)
+MIN_THROUGHPUT_SIZE = 1024 * 1024
+QUANTILES = (0.5, 0.9, 0.99)
+REPORT_SUFFIX = ".json"
+
+def error_key(error):
+    """Clé de comptage d'une erreur : nom de l'errno (ENOENT, EACCES...) ou type de l'exception."""
+    code = getattr(error, "errno", None)
+    if isinstance(code, int) and code in errno.errorcode:
+        return errno.errorcode[code]
+    return type(error).__name__
+
+# Phases en cours dans chaque thread, tous RunMetrics confondus : une phase imbriquée est
+# retranchée de la phase englobante même quand elles sont comptées dans des mesures différentes
+_running = threading.local()
+
+class _Phase:
+    """Mesure d'une phase ; le temps des phases imbriquées (même thread) en est retranché."""
+    __slots__ = ("metrics", "name", "start", "nested", "elapsed")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.nested = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        stack = getattr(_running, "stack", None)
+        if stack is None:
+            stack = _running.stack = []
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        stack = _running.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += self.elapsed
+        self.metrics.add_phase(self.name, self.elapsed - self.nested)
+        return False
+
+class _NullPhase:
+    elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = _NullPhase()
+
+def timer(metrics, name):
+    """Phase name de metrics (à utiliser avec « with »), ou une mesure inerte si metrics est None."""
+    return metrics.phase(name) if metrics is not None else NULL_PHASE
+
+class _Samples:
+    # Échantillonnage par réservoir : mémoire bornée quel que soit le nombre de fichiers
+    def __init__(self, size=MAX_SAMPLES):
+        self.size = size
+        self.values = []
+        self.seen = 0
+        self._random = random.Random(0)
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+            return
+        slot = self._random.randrange(self.seen)
+        if slot < self.size:
+            self.values[slot] = value
+
+    def quantiles(self):
+        if not self.values:
+            return {}
+        ordered = sorted(self.values)
+        last = len(ordered) - 1
+        return {f"p{int(q * 100)}": ordered[min(last, int(q * len(ordered)))] for q in QUANTILES}
+
+class RunMetrics:
+    """
+    Mesures d'une sauvegarde vers une destination, alimentées depuis tous les threads :
+    - temps par phase (PHASES), en secondes de travail cumulées sur les threads : le parcours
+      et les copies se déroulent en même temps, la somme des phases dépasse donc la durée totale ;
+    - fichiers et octets copiés, inchangés (ignorés ou liés) et en échec ;
+    - centiles de débit par fichier et de durée de copie, fichiers et dossiers les plus lents ;
+    - erreurs par errno.
+    report() en fait un dictionnaire prêt pour write_report et write_prometheus.
+    """
+    def __init__(self, destination, mode=""):
+        self.destination = destination
+        self.mode = mode
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._states = []
+        self.files = {"copied": 0, "skipped": 0, "linked": 0, "failed": 0}
+        self.bytes = {"copied": 0, "skipped": 0, "linked": 0, "failed": 0}
+        self.transferred = 0
+        self.errors = {}
+        self.directories = 0
+        self._throughput = _Samples()
+        self._durations = _Samples()
+        self._slow_files = []
+        self._slow_dirs = []
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def add_phase(self, name, seconds):
+        # Totaux propres à chaque thread : pas de verrou à chaque mesure
+        phases = getattr(self._local, "phases", None)
+        if phases is None:
+            phases = self._local.phases = {}
+            with self._lock:
+                self._states.append(phases)
+        phases[name] = phases.get(name, 0.0) + seconds
+
+    def phases(self):
+        totals = dict.fromkeys(PHASES, 0.0)
+        with self._lock:
+            states = list(self._states)
+        for phases in states:
+            for name, seconds in list(phases.items()):
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def file_copied(self, rel, size, seconds, transferred=None):
+        with self._lock:
+            self.files["copied"] += 1
+            self.bytes["copied"] += size
+            self.transferred += size if transferred is None else transferred
+            self._durations.add(seconds)
+            if size >= MIN_THROUGHPUT_SIZE and seconds > 0:
+                self._throughput.add(size / seconds)
+            entry = (seconds, rel, size)
+            if len(self._slow_files) < SLOWEST:
+                heapq.heappush(self._slow_files, entry)
+            elif entry > self._slow_files[0]:
+                heapq.heapreplace(self._slow_files, entry)
+
+    def file_skipped(self, size=0, linked=False):
+        status = "linked" if linked else "skipped"
+        with self._lock:
+            self.files[status] += 1
+            self.bytes[status] += size
+
+    def file_failed(self, size=0, error=None):
+        with self._lock:
+            self.files["failed"] += 1
+            self.bytes["failed"] += size
+        if error is not None:
+            self.error(error)
+
+    def error(self, error):
+        key = error_key(error)
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def directory(self, path, seconds, entries=0):
+        with self._lock:
+            self.directories += 1
+            entry = (seconds, path, entries)
+            if len(self._slow_dirs) < SLOWEST:
+                heapq.heappush(self._slow_dirs, entry)
+            elif entry > self._slow_dirs[0]:
+                heapq.heapreplace(self._slow_dirs, entry)
+
+    def merge_shared(self, other):
+        """
+        Ajoute les mesures d'un RunMetrics partagé par plusieurs destinations (parcours et lecture
+        uniques des sources) : temps des phases, dossiers les plus lents et erreurs.
+        """
+        for name, seconds in other.phases().items():
+            if seconds:
+                self.add_phase(name, seconds)
+        with other._lock:
+            slow_dirs = list(other._slow_dirs)
+            errors = dict(other.errors)
+            directories = other.directories
+        with self._lock:
+            self.directories += directories
+            self._slow_dirs = heapq.nlargest(SLOWEST, self._slow_dirs + slow_dirs)
+            heapq.heapify(self._slow_dirs)
+            for key, count in errors.items():
+                self.errors[key] = self.errors.get(key, 0) + count
+
+    def report(self, result=None, **extra):
+        """Rapport de la sauvegarde ; result (BackupResult) et extra y sont ajoutés tels quels."""
+        phases = self.phases()
+        with self._lock:
+            report = {
+                "destination": self.destination,
+                "mode": self.mode,
+                "started": round(self.started, 3),
+                "finished": round(time.time(), 3),
+                "phases": {name: round(seconds, 4) for name, seconds in phases.items()},
+                "files": dict(self.files),
+                "bytes": dict(self.bytes),
+                "bytes_transferred": self.transferred,
+                "directories": self.directories,
+                "throughput_bytes_per_second": {key: round(value) for key, value
+                                                in self._throughput.quantiles().items()},
+                "copy_seconds": {key: round(value, 6) for key, value in self._durations.quantiles().items()},
+                "slowest_files": [{"path": rel, "seconds": round(seconds, 4), "bytes": size}
+                                  for seconds, rel, size in sorted(self._slow_files, reverse=True)],
+                "slowest_directories": [{"path": path, "seconds": round(seconds, 4), "entries": entries}
+                                        for seconds, path, entries in sorted(self._slow_dirs, reverse=True)],
+                "errors_by_errno": dict(sorted(self.errors.items())),
+            }
+        if result is not None:
+            report["result"] = result._asdict()
+        report.update(extra)
+        return report
+
+    def summary(self):
+        """Ligne de journal : temps par phase."""
+        labels = {"scan": "parcours", "compare": "comparaison", "copy": "copie", "metadata": "métadonnées",
+                  "finalize": "finalisation"}
+        phases = self.phases()
+        parts = ", ".join(f"{labels.get(name, name)} {phases[name]:.2f} s" for name in PHASES)
+        return f"Temps par phase (cumulé sur les threads) : {parts}."
+
+def _slug(text):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", text).strip("_")[-60:] or "destination"
+
+def write_report(report, directory, keep=100):
+    """
+    Écrit le rapport JSON d'une sauvegarde dans directory (<date>_<destination>.json) et ne garde
+    que les keep rapports les plus récents (0 = tous). Retourne le chemin du rapport.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y-%m-%d_%H%M%S", time.localtime(report.get("started", time.time())))
+    name = f"{stamp}_{_slug(report.get('destination', ''))}"
+    path = os.path.join(directory, name + REPORT_SUFFIX)
+    counter = 2
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{name}-{counter}{REPORT_SUFFIX}")
+        counter += 1
+    _write_replace(path, json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    if keep:
+        reports = sorted(name for name in os.listdir(directory) if name.endswith(REPORT_SUFFIX))
+        for name in reports[:-keep]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return path
+
+def _write_replace(path, text):
+    # Écrit puis renomme : un lecteur (collecteur textfile) ne voit jamais de fichier à moitié écrit
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def prometheus_text(reports):
+    """Rapports au format texte de Prometheus (collecteur textfile de node_exporter)."""
+    metrics = {}
+
+    def add(name, helptext, labels, value):
+        _, samples = metrics.setdefault(name, (helptext, []))
+        text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+        samples.append(f"{name}{{{text}}} {value}")
+
+    for report in reports:
+        base = {"destination": report["destination"]}
+        result = report.get("result") or {}
+        add("sauvegarde_last_run_timestamp_seconds", "Fin de la dernière sauvegarde (epoch).", base,
+            report["finished"])
+        add("sauvegarde_duration_seconds", "Durée totale de la dernière sauvegarde.", base,
+            result.get("elapsed", report["finished"] - report["started"]))
+        add("sauvegarde_aborted", "1 si la dernière sauvegarde a été annulée.", base, int(bool(result.get("aborted"))))
+        add("sauvegarde_errors", "Erreurs de la dernière sauvegarde.", base, result.get("errors", 0))
+        for phase, seconds in report["phases"].items():
+            add("sauvegarde_phase_seconds", "Temps de travail par phase, cumulé sur les threads.",
+                dict(base, phase=phase), seconds)
+        for status, count in report["files"].items():
+            add("sauvegarde_files", "Fichiers par état (copied, skipped, linked, failed).",
+                dict(base, status=status), count)
+        for status, size in report["bytes"].items():
+            add("sauvegarde_bytes", "Octets par état (copied, skipped, linked, failed).",
+                dict(base, status=status), size)
+        add("sauvegarde_bytes_transferred", "Octets réellement écrits (compression, delta).", base,
+            report["bytes_transferred"])
+        for key, value in report["throughput_bytes_per_second"].items():
+            add("sauvegarde_file_throughput_bytes_per_second", "Centiles du débit de copie par fichier.",
+                dict(base, quantile=int(key[1:]) / 100), value)
+        for key, value in report["copy_seconds"].items():
+            add("sauvegarde_file_copy_seconds", "Centiles de la durée de copie par fichier.",
+                dict(base, quantile=int(key[1:]) / 100), value)
+        for code, count in report["errors_by_errno"].items():
+            add("sauvegarde_errors_by_errno", "Erreurs par errno.", dict(base, errno=code), count)
+    lines = []
+    for name, (helptext, samples) in metrics.items():
+        lines.append(f"# HELP {name} {helptext}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(reports, path):
+    """Écrit les rapports (un par destination) dans le fichier textfile path, remplacé d'un coup."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _write_replace(path, prometheus_text(reports))
@@ -0,0 +1,223 @@
+import os
+import sys
+import time
+import shutil
+import bisect
+import datetime
+import threading
+from compression import SUFFIXES
+from file_utils import PARTIAL_SUFFIX
+from snapshots import on_remove_error
+
+# Éléments supprimés de la destination, rangés par sauvegarde : .corbeille/<date>/<chemin relatif>
+TRASH_DIR = ".corbeille"
+STAMP_FORMAT = "%Y-%m-%d_%H%M%S"
+# Fichiers temporaires qui peuvent être en cours d'écriture : jamais supprimés
+_TEMP_PREFIXES = (".delta-",)
+# Systèmes de fichiers insensibles à la casse : « Photo.JPG » et « photo.jpg » sont le même fichier
+_CASELESS = os.name == "nt" or sys.platform == "darwin"
+
+def _merge_missing(src_names, dst_names):
+    """Noms de dst_names absents de src_names ; les deux listes sont triées (fusion en un passage)."""
+    missing = []
+    i = 0
+    n = len(src_names)
+    for name in dst_names:
+        while i < n and src_names[i] < name:
+            i += 1
+        if i >= n or src_names[i] != name:
+            missing.append(name)
+    return missing
+
+def _contains(sorted_names, name):
+    i = bisect.bisect_left(sorted_names, name)
+    return i < len(sorted_names) and sorted_names[i] == name
+
+class MirrorCleaner:
+    """
+    Propagation des suppressions en mode miroir : pour chaque dossier dont la lecture source est
+    complète, les listes triées des noms de la source et de la destination (ou de l'index) sont
+    fusionnées ; ce qui n'existe plus dans la source est supprimé de la destination, par lots.
+    Avec trash, les éléments supprimés sont déplacés dans destination/.corbeille/<date>/ et
+    conservés retention_days jours. Les entrées de l'index et des paquets sont retirées avec eux.
+    Ne sont jamais supprimés : les copies compressées d'un fichier présent, les fichiers temporaires
+    en cours d'écriture et les éléments que les filtres excluent de la sauvegarde.
+    Utilisable depuis plusieurs threads.
+    """
+    def __init__(self, destination, trash=True, retention_days=30, batch_size=500, index=None, packs=None,
+                 filters=None, log_func=None):
+        self.destination = destination
+        self.trash_root = os.path.join(destination, TRASH_DIR)
+        self.trash = trash
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.index = index
+        self.packs = packs
+        self.filters = filters
+        self.log_func = log_func
+        self._lock = threading.Lock()
+        self._batch = []
+        self._trash_dir = None
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    def _kept(self, name, src_names):
+        if name.startswith(_TEMP_PREFIXES):
+            return True
+        if name.startswith(".") and name.endswith(PARTIAL_SUFFIX):
+            # Copie provisoire d'un fichier de la source, compressée ou non : peut-être en cours d'écriture
+            name = name[1:-len(PARTIAL_SUFFIX)]
+            if _contains(src_names, name):
+                return True
+        for suffix in SUFFIXES.values():
+            if name.endswith(suffix) and _contains(src_names, name[:-len(suffix)]):
+                return True
+        return False
+
+    def compare(self, rel, dst, src_names, dst_names):
+        """
+        Dossier rel (destination dst) entièrement lu : src_names et dst_names sont les noms triés
+        de la source et de la destination. Les noms propres à la destination sont mis à supprimer.
+        """
+        if not src_names and dst_names and "/" not in rel:
+            # Source vide (disque non monté ?) : on ne vide pas la destination
+            self._log(f"Source {rel} vide : suppressions ignorées pour ne pas vider sa destination.")
+            return
+        source_rel = rel.partition("/")[2]
+        doomed = []
+        missing = _merge_missing(src_names, dst_names)
+        folded = {name.lower() for name in src_names} if missing and _CASELESS else None
+        for name in missing:
+            if self._kept(name, src_names) or (folded is not None and name.lower() in folded):
+                continue
+            path = os.path.join(dst, name)
+            is_dir = os.path.isdir(path) and not os.path.islink(path)
+            if self.filters is not None and self.filters.excluded(
+                    source_rel + "/" + name if source_rel else name, is_dir):
+                continue
+            doomed.append((path, rel + "/" + name))
+        if self.packs is not None:
+            # Petits fichiers mis en paquet : absents du dossier, présents dans l'index des paquets
+            for name in _merge_missing(src_names, self.packs.children(rel)):
+                self.packs.forget(rel + "/" + name)
+                with self._lock:
+                    self.files += 1
+        if not doomed:
+            return
+        with self._lock:
+            self._batch.extend(doomed)
+            if len(self._batch) < self.batch_size:
+                return
+            batch, self._batch = self._batch, []
+        self._delete(batch)
+
+    def _delete(self, batch):
+        if self.packs is not None:
+            # Ajouts en attente écrits dans l'index des paquets une seule fois par lot
+            self.packs.flush()
+        for path, rel in batch:
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                st = None
+            try:
+                if st is not None:
+                    is_dir = os.path.isdir(path) and not os.path.islink(path)
+                    size = self._tree_size(path) if is_dir else st.st_size
+                    if self.trash:
+                        target = os.path.join(self._trash_folder(), *rel.split("/"))
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        os.replace(path, target)
+                    elif is_dir:
+                        shutil.rmtree(path, onerror=on_remove_error)
+                    else:
+                        os.remove(path)
+                    with self._lock:
+                        self.bytes += size
+                        if is_dir:
+                            self.dirs += 1
+                        else:
+                            self.files += 1
+                if self.index is not None:
+                    self.index.forget(rel)
+                if self.packs is not None:
+                    for entry in list(self.packs.list(rel, flush=False)):
+                        self.packs.forget(entry.path)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                self._log(f"Impossible de supprimer {path} de la destination : {e}")
+
+    @staticmethod
+    def _tree_size(path):
+        total = 0
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+        return total
+
+    def _trash_folder(self):
+        with self._lock:
+            if self._trash_dir is None:
+                stamp = time.strftime(STAMP_FORMAT)
+                name = stamp
+                counter = 2
+                while os.path.exists(os.path.join(self.trash_root, name)):
+                    name = f"{stamp}-{counter}"
+                    counter += 1
+                self._trash_dir = os.path.join(self.trash_root, name)
+                os.makedirs(self._trash_dir)
+            return self._trash_dir
+
+    def flush(self):
+        with self._lock:
+            batch, self._batch = self._batch, []
+        if batch:
+            self._delete(batch)
+
+    def purge_trash(self):
+        """Efface les dossiers de la corbeille plus anciens que retention_days jours ; retourne leur nombre."""
+        limit = datetime.datetime.now() - datetime.timedelta(days=self.retention_days)
+        purged = 0
+        try:
+            with os.scandir(self.trash_root) as it:
+                old = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)
+                       and self._stamp(entry.name) is not None and self._stamp(entry.name) < limit]
+        except FileNotFoundError:
+            return 0
+        for path in old:
+            if path == self._trash_dir:
+                continue
+            try:
+                shutil.rmtree(path, onerror=on_remove_error)
+                purged += 1
+            except OSError as e:
+                self._log(f"Impossible de vider {path} de la corbeille : {e}")
+        return purged
+
+    @staticmethod
+    def _stamp(name):
+        try:
+            return datetime.datetime.strptime(name[:17], STAMP_FORMAT)
+        except ValueError:
+            return None
+
+    def summary(self):
+        with self._lock:
+            where = f" (déplacés dans {self._trash_dir})" if self.trash and self._trash_dir else ""
+            return (f"Miroir : {self.files} fichiers et {self.dirs} dossiers supprimés de la source "
+                    f"retirés de la destination{where}, {self.bytes / (1024 * 1024):.2f} Mo.")
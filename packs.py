@@ -0,0 +1,281 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+# Les paquets et leur index sont rangés dans ce dossier de la destination
+PACK_DIR = ".paquets"
+PACK_INDEX_NAME = "index.sqlite"
+PACK_PREFIX = "paquet-"
+PACK_SUFFIX = ".pack"
+SCHEMA_VERSION = 1
+
+PackedFile = namedtuple("PackedFile", "path pack offset length mode mtime_ns digest")
+
+def _pack_name(number):
+    return f"{PACK_PREFIX}{number:06d}{PACK_SUFFIX}"
+
+class PackStore:
+    """
+    Petits fichiers regroupés dans de gros fichiers « paquets » écrits séquentiellement.
+    Chaque fichier de moins de threshold octets est ajouté à la fin du paquet courant ; un index
+    SQLite donne pour chaque chemin relatif son paquet, sa position, sa longueur et ses attributs.
+    Un nouveau paquet est commencé quand le courant dépasse pack_size octets.
+    Les données d'un paquet sont écrites sur disque (fsync) avant que l'index ne les référence :
+    après une interruption, l'index ne pointe jamais vers des données absentes.
+    Un fichier réécrit est ajouté à nouveau ; son ancienne version reste dans son paquet (place perdue,
+    comptée par paquet). Utilisable depuis plusieurs threads.
+    """
+    def __init__(self, destination, threshold=64 * 1024, pack_size=256 * 1024 * 1024, batch_size=1000,
+                 log_func=None):
+        self.root = os.path.join(destination, PACK_DIR)
+        self.threshold = threshold
+        self.pack_size = pack_size
+        self.batch_size = batch_size
+        self.log_func = log_func
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = self._open(os.path.join(self.root, PACK_INDEX_NAME))
+        self._pending = {}
+        self._dead = {}
+        self._readers = {}
+        self._pack = None
+        self._pack_number = None
+        self.files = 0
+        self.bytes = 0
+
+    @staticmethod
+    def exists(destination):
+        return os.path.exists(os.path.join(destination, PACK_DIR, PACK_INDEX_NAME))
+
+    def _open(self, path):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if row is not None and int(row[0]) != SCHEMA_VERSION:
+                raise sqlite3.DatabaseError(f"version de schéma {row[0]} inattendue")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS packed ("
+                " path TEXT PRIMARY KEY, pack INTEGER NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL,"
+                " mode INTEGER, mtime_ns INTEGER, digest TEXT) WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS packs (id INTEGER PRIMARY KEY, dead INTEGER NOT NULL DEFAULT 0)")
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    # --- Lecture ---
+
+    def get(self, rel):
+        """Retourne le PackedFile d'un chemin relatif, ou None s'il n'est pas dans un paquet."""
+        with self._lock:
+            if rel in self._pending:
+                return self._pending[rel]
+            row = self._conn.execute(
+                "SELECT path, pack, offset, length, mode, mtime_ns, digest FROM packed WHERE path = ?", (rel,)
+            ).fetchone()
+        return PackedFile(*row) if row is not None else None
+
+    @staticmethod
+    def matches(entry, st):
+        """True si le fichier source décrit par st est celui qui a été mis en paquet."""
+        return entry is not None and entry.length == st.st_size and entry.mtime_ns == st.st_mtime_ns
+
+    def list(self, prefix="", flush=True):
+        """
+        Parcourt les PackedFile dont le chemin est prefix ou commence par prefix/, par ordre de chemin.
+        Avec flush=False, les ajouts en attente ne sont pas écrits dans l'index au préalable
+        (l'appelant l'a déjà fait) : seuls ceux déjà écrits sont parcourus.
+        """
+        if flush:
+            self.flush()
+        prefix = prefix.strip("/")
+        conditions = []
+        params = []
+        if prefix:
+            entry = self.get(prefix)
+            if entry is not None:
+                yield entry
+            # "0" suit "/" : l'intervalle couvre exactement le contenu du dossier prefix
+            conditions.append("path >= ? AND path < ?")
+            params += [prefix + "/", prefix + "0"]
+        last = None
+        while True:
+            where = conditions + (["path > ?"] if last is not None else [])
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT path, pack, offset, length, mode, mtime_ns, digest FROM packed"
+                    + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY path LIMIT 1000",
+                    params + ([last] if last is not None else [])
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield PackedFile(*row)
+            last = rows[-1][0]
+
+    def children(self, rel):
+        """
+        Noms triés des fichiers mis en paquet directement dans le dossier rel, y compris les ajouts
+        pas encore écrits dans l'index (sans vider le paquet ni valider l'index).
+        """
+        prefix = rel + "/"
+        start = len(prefix)
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM packed WHERE path >= ? AND path < ?",
+                                      (prefix, rel + "0")).fetchall()
+            names = {path[start:] for path, in rows}
+            names.update(path[start:] for path in self._pending if path.startswith(prefix))
+        return sorted(name for name in names if "/" not in name)
+
+    def _reader(self, number):
+        # Descripteurs de lecture conservés : une extraction ne relit que la zone du fichier (pread)
+        with self._lock:
+            fd = self._readers.get(number)
+            if fd is None:
+                fd = os.open(os.path.join(self.root, _pack_name(number)), os.O_RDONLY | getattr(os, "O_BINARY", 0))
+                self._readers[number] = fd
+        return fd
+
+    def read(self, entry):
+        """Contenu d'un fichier mis en paquet, lu directement à sa position."""
+        if self._pack_number == entry.pack and self._pack is not None:
+            with self._lock:
+                self._pack.flush()
+        fd = self._reader(entry.pack)
+        if hasattr(os, "pread"):
+            data = os.pread(fd, entry.length, entry.offset)
+        else:
+            with self._lock:
+                os.lseek(fd, entry.offset, os.SEEK_SET)
+                data = os.read(fd, entry.length)
+        if len(data) != entry.length:
+            raise OSError(f"paquet {_pack_name(entry.pack)} tronqué")
+        return data
+
+    def extract(self, entry, target):
+        """Écrit un fichier mis en paquet dans target et lui rend ses attributs."""
+        data = self.read(entry)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(data)
+        if entry.mode is not None:
+            os.chmod(target, entry.mode & 0o7777)
+        if entry.mtime_ns is not None:
+            os.utime(target, ns=(entry.mtime_ns, entry.mtime_ns))
+        return len(data)
+
+    # --- Écriture ---
+
+    def _current_pack(self):
+        if self._pack is not None and self._pack.tell() < self.pack_size:
+            return self._pack
+        if self._pack is not None:
+            self._close_pack()
+        if self._pack_number is None:
+            numbers = [int(name[len(PACK_PREFIX):-len(PACK_SUFFIX)]) for name in os.listdir(self.root)
+                       if name.startswith(PACK_PREFIX) and name.endswith(PACK_SUFFIX)]
+            number = max(numbers) if numbers else 1
+            # Le dernier paquet est complété s'il n'est pas plein
+            path = os.path.join(self.root, _pack_name(number))
+            if os.path.exists(path) and os.path.getsize(path) >= self.pack_size:
+                number += 1
+        else:
+            number = self._pack_number + 1
+        self._pack_number = number
+        self._pack = open(os.path.join(self.root, _pack_name(number)), "ab")
+        return self._pack
+
+    def _close_pack(self):
+        # Les données doivent être sur disque avant que l'index ne les référence
+        self._pack.flush()
+        os.fsync(self._pack.fileno())
+        self._flush_index_locked()
+        self._pack.close()
+        self._pack = None
+
+    def add(self, rel, data, st, digest=None):
+        """Ajoute le contenu data (fichier rel, attributs st) au paquet courant."""
+        with self._lock:
+            pack = self._current_pack()
+            offset = pack.tell()
+            pack.write(data)
+            previous = self._pending.get(rel)
+            if previous is None:
+                row = self._conn.execute("SELECT pack, length FROM packed WHERE path = ?", (rel,)).fetchone()
+                previous = (row[0], row[1]) if row is not None else None
+            else:
+                previous = (previous.pack, previous.length)
+            if previous is not None:
+                self._dead[previous[0]] = self._dead.get(previous[0], 0) + previous[1]
+            self._pending[rel] = PackedFile(rel, self._pack_number, offset, len(data), st.st_mode,
+                                            st.st_mtime_ns, digest)
+            self.files += 1
+            self.bytes += len(data)
+            if len(self._pending) >= self.batch_size:
+                pack.flush()
+                os.fsync(pack.fileno())
+                self._flush_index_locked()
+
+    def forget(self, rel):
+        """Retire un chemin de l'index (le fichier est désormais stocké à part)."""
+        with self._lock:
+            self._pending.pop(rel, None)
+            row = self._conn.execute("SELECT pack, length FROM packed WHERE path = ?", (rel,)).fetchone()
+            if row is None:
+                return
+            self._dead[row[0]] = self._dead.get(row[0], 0) + row[1]
+            with self._conn:
+                self._conn.execute("DELETE FROM packed WHERE path = ?", (rel,))
+
+    def _flush_index_locked(self):
+        if not self._pending and not self._dead:
+            return
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO packed VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   list(self._pending.values()))
+            for number, dead in self._dead.items():
+                self._conn.execute("INSERT OR IGNORE INTO packs (id, dead) VALUES (?, 0)", (number,))
+                self._conn.execute("UPDATE packs SET dead = dead + ? WHERE id = ?", (dead, number))
+        self._pending = {}
+        self._dead = {}
+
+    def flush(self):
+        with self._lock:
+            if self._pack is not None:
+                self._pack.flush()
+                os.fsync(self._pack.fileno())
+            self._flush_index_locked()
+
+    def summary(self):
+        with self._lock:
+            return f"Paquets : {self.files} petits fichiers regroupés ({self.bytes / (1024 * 1024):.2f} Mo)."
+
+    def close(self):
+        with self._lock:
+            try:
+                if self._pack is not None:
+                    self._close_pack()
+                self._flush_index_locked()
+            finally:
+                for fd in self._readers.values():
+                    os.close(fd)
+                self._readers = {}
+                self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
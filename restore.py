@@ -0,0 +1,591 @@
+import os
+import re
+import stat
+import time
+import sqlite3
+import datetime
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from file_utils import (load_config, long_path, new_hasher, hash_algo_name, PARTIAL_SUFFIX, COPY_BLOCK_SIZE,
+                        write_atomic)
+from compression import SUFFIXES, iter_plain_blocks
+from manifest import INDEX_NAME
+from packs import PackStore, PACK_DIR, PACK_INDEX_NAME
+from chunkstore import ChunkStore, REPO_DIR, STAMP_FORMAT, KIND_DIR, KIND_FILE, KIND_LINK
+from snapshots import SNAPSHOT_DIR, list_snapshots
+from filters import translate
+from backup_engine import throttled_progress, ignore
+
+# Catalogue de restauration, à la racine de la destination
+CATALOG_NAME = ".catalogue_restauration.sqlite"
+SCHEMA_VERSION = 1
+
+# Types de sauvegardes cataloguées
+RUN_MIRROR = "miroir"
+RUN_SNAPSHOT = "instantane"
+RUN_REPO = "depot"
+
+# Fichier mis en paquet (copie miroir avec petits fichiers regroupés)
+KIND_PACKED = "p"
+
+CatalogEntry = namedtuple("CatalogEntry", "path run kind size mtime_ns mode digest ref")
+RunInfo = namedtuple("RunInfo", "name kind created location entries")
+RestoreResult = namedtuple("RestoreResult", "restored skipped conflicts failed mismatched bytes aborted elapsed")
+
+_COLUMNS = "path, run, kind, size, mtime_ns, mode, digest, ref"
+_WILDCARDS = re.compile(r"[*?\[]")
+
+def _stamp_time(name):
+    try:
+        return datetime.datetime.strptime(name[:17], STAMP_FORMAT).timestamp()
+    except ValueError:
+        return 0.0
+
+def _open_readonly(path, table):
+    # Index d'une destination consulté sans jamais y écrire (sa date sert à détecter les changements)
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute(f"SELECT 1 FROM {table} LIMIT 1")
+        return conn
+    except sqlite3.Error:
+        return None
+
+def _walk_stored(root, skip_root):
+    """
+    Parcourt une copie (miroir ou instantané) et émet (chemin relatif, DirEntry) ;
+    les copies provisoires et, à la racine, les noms pour lesquels skip_root(nom) est vrai sont ignorés.
+    Un seul dossier est ouvert à la fois.
+    """
+    stack = [(long_path(root), "")]
+    while stack:
+        path, rel = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    name = entry.name
+                    if not rel and skip_root(name):
+                        continue
+                    if name.startswith(".") and (name.endswith(PARTIAL_SUFFIX) or name.startswith(".delta-")):
+                        continue
+                    child = rel + "/" + name if rel else name
+                    yield child, entry
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append((entry.path, child))
+        except OSError:
+            continue
+        stack.extend(reversed(subdirs))
+
+class RestoreCatalog:
+    """
+    Catalogue compact de tout ce qui peut être restauré depuis une destination : une ligne
+    (chemin, sauvegarde, type, taille, date, droits, empreinte) par élément et par sauvegarde —
+    copie miroir, chaque instantané, chaque sauvegarde du dépôt à blocs.
+    La clé (chemin, sauvegarde) rend la recherche par préfixe directe sur toutes les sauvegardes ;
+    un motif est filtré à partir de son préfixe fixe.
+    refresh() n'ajoute que les sauvegardes nouvelles (instantanés et dépôt ne changent plus une fois
+    écrits) et retire celles qui ont disparu ; la copie miroir est recataloguée quand son index a changé,
+    ou à chaque fois si elle n'en a pas.
+    """
+    def __init__(self, destination, log_func=None, compression_hint=False):
+        self.destination = destination
+        self.path = os.path.join(destination, CATALOG_NAME)
+        self.log_func = log_func
+        self.compression_hint = compression_hint
+        self._conn = self._open()
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except sqlite3.DatabaseError as e:
+            # Le catalogue ne contient que des données recalculables : on le reconstruit
+            self._log(f"Catalogue de restauration illisible, reconstruction : {e}")
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.path + suffix)
+                except OSError:
+                    pass
+            conn = self._connect()
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if row is not None and int(row[0]) != SCHEMA_VERSION:
+                raise sqlite3.DatabaseError(f"version de schéma {row[0]} inattendue")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs (name TEXT PRIMARY KEY, kind TEXT NOT NULL, created REAL,"
+                " location TEXT, stamp TEXT, entries INTEGER)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (path TEXT NOT NULL, run TEXT NOT NULL, kind TEXT NOT NULL,"
+                " size INTEGER, mtime_ns INTEGER, mode INTEGER, digest TEXT, ref TEXT,"
+                " PRIMARY KEY (path, run)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_run ON entries (run)")
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    # --- Mise à jour ---
+
+    def _runs_on_disk(self):
+        # (nom, type, date, emplacement, marque de version ou None pour toujours recataloguer)
+        runs = []
+        for when, path in list_snapshots(self.destination):
+            runs.append((os.path.basename(path), RUN_SNAPSHOT, when.timestamp(), path, ""))
+        if ChunkStore.exists(self.destination):
+            store = ChunkStore(self.destination)
+            for name in store.list_backups():
+                runs.append((name, RUN_REPO, _stamp_time(name), store.root, ""))
+        with os.scandir(self.destination) as it:
+            roots = [entry for entry in it if not self._internal(entry.name) and entry.is_dir(follow_symlinks=False)]
+        if roots:
+            stamps = []
+            for name in (INDEX_NAME, INDEX_NAME + "-wal", os.path.join(PACK_DIR, PACK_INDEX_NAME),
+                         os.path.join(PACK_DIR, PACK_INDEX_NAME + "-wal")):
+                try:
+                    st = os.stat(os.path.join(self.destination, name))
+                    # Un journal -wal vide est créé par la simple lecture de l'index
+                    stamps.append(st.st_mtime_ns if st.st_size else 0)
+                except OSError:
+                    stamps.append(0)
+            created = max(entry.stat(follow_symlinks=False).st_mtime for entry in roots)
+            stamp = ",".join(map(str, stamps)) if stamps[0] else None
+            runs.append((RUN_MIRROR, RUN_MIRROR, max(created, stamps[0] / 1e9), self.destination, stamp))
+        return runs
+
+    @staticmethod
+    def _internal(name):
+        # Éléments de la racine d'une destination qui ne sont pas des copies de sources
+        return name.startswith(".") or name in (SNAPSHOT_DIR, REPO_DIR)
+
+    def refresh(self, abort_func=None):
+        """Met le catalogue à jour ; retourne le nombre de sauvegardes (re)cataloguées."""
+        known = {name: stamp for name, stamp in self._conn.execute("SELECT name, stamp FROM runs")}
+        on_disk = self._runs_on_disk()
+        names = {run[0] for run in on_disk}
+        for name in known:
+            if name not in names:
+                with self._conn:
+                    self._conn.execute("DELETE FROM entries WHERE run = ?", (name,))
+                    self._conn.execute("DELETE FROM runs WHERE name = ?", (name,))
+        updated = 0
+        for name, kind, created, location, stamp in on_disk:
+            if abort_func and abort_func():
+                break
+            if name in known and stamp is not None and known[name] == stamp:
+                continue
+            self._log(f"Catalogage de la sauvegarde {name}...")
+            if kind == RUN_REPO:
+                rows = self._repo_rows(name)
+            elif kind == RUN_SNAPSHOT:
+                rows = self._copy_rows(name, location, lambda n: n.startswith("."))
+            else:
+                rows = self._copy_rows(name, location, self._internal)
+            count = 0
+            with self._conn:
+                self._conn.execute("DELETE FROM entries WHERE run = ?", (name,))
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) >= 5000:
+                        self._conn.executemany(f"INSERT OR REPLACE INTO entries ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                        count += len(batch)
+                        batch = []
+                self._conn.executemany(f"INSERT OR REPLACE INTO entries ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                count += len(batch)
+                self._conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+                                   (name, kind, created, location, stamp, count))
+            updated += 1
+        return updated
+
+    def _repo_rows(self, name):
+        store = ChunkStore(self.destination)
+        for entry in store.iter_entries(name):
+            kind = entry["k"]
+            yield (entry["p"], name, kind, entry.get("s", 0), entry.get("t"), entry.get("m"), entry.get("h"),
+                   entry.get("l") if kind == KIND_LINK else None)
+
+    def _stored_rows(self, run, root, skip_root):
+        # Copie miroir ou instantané : l'index de la copie donne les empreintes et lève l'ambiguïté
+        # des suffixes de compression (« a.gz » copie compressée de « a », ou fichier « a.gz » ?)
+        index = _open_readonly(os.path.join(root, INDEX_NAME), "files")
+        try:
+            for rel, entry in _walk_stored(root, skip_root):
+                st = entry.stat(follow_symlinks=False)
+                if entry.is_dir(follow_symlinks=False):
+                    yield (rel, run, KIND_DIR, 0, st.st_mtime_ns, st.st_mode, None, None)
+                    continue
+                if entry.is_symlink():
+                    yield (rel, run, KIND_LINK, 0, st.st_mtime_ns, st.st_mode, None, None)
+                    continue
+                path, ref, digest, size = rel, None, None, st.st_size
+                suffix = next((s for s in SUFFIXES.values() if rel.endswith(s)), "")
+                if index is not None:
+                    row = index.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?", (rel,)).fetchone()
+                    if row is None and suffix:
+                        row = index.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?",
+                                            (rel[:-len(suffix)],)).fetchone()
+                        if row is not None:
+                            # Copie compressée : taille d'origine donnée par l'index
+                            path, ref, size = rel[:-len(suffix)], rel, row[0]
+                    # Empreinte retenue seulement si l'index décrit bien la version présente
+                    if row is not None and (ref is not None or (row[0], row[1]) == (st.st_size, st.st_mtime_ns)):
+                        digest = row[2]
+                elif suffix and self.compression_hint:
+                    path, ref, size = rel[:-len(suffix)], rel, None
+                yield (path, run, KIND_FILE, size, st.st_mtime_ns, st.st_mode, digest, ref)
+        finally:
+            if index is not None:
+                index.close()
+
+    def _copy_rows(self, run, root, skip_root):
+        yield from self._stored_rows(run, root, skip_root)
+        packs = _open_readonly(os.path.join(root, PACK_DIR, PACK_INDEX_NAME), "packed")
+        if packs is None:
+            return
+        try:
+            for path, length, mtime_ns, mode, digest in packs.execute(
+                    "SELECT path, length, mtime_ns, mode, digest FROM packed ORDER BY path"):
+                yield (path, run, KIND_PACKED, length, mtime_ns, mode, digest, None)
+        finally:
+            packs.close()
+
+    # --- Consultation ---
+
+    def runs(self):
+        """Sauvegardes cataloguées, de la plus ancienne à la plus récente (RunInfo)."""
+        rows = self._conn.execute("SELECT name, kind, created, location, entries FROM runs ORDER BY created, name")
+        return [RunInfo(*row) for row in rows]
+
+    def latest_run(self):
+        runs = self.runs()
+        return runs[-1].name if runs else None
+
+    def run_info(self, name):
+        row = self._conn.execute("SELECT name, kind, created, location, entries FROM runs WHERE name = ?",
+                                 (name,)).fetchone()
+        return RunInfo(*row) if row is not None else None
+
+    def search(self, pattern="", run=None, limit=None):
+        """
+        Éléments dont le chemin est pattern ou commence par pattern/ (recherche par préfixe),
+        ou correspond au motif pattern s'il contient * ? ou [ (même syntaxe que les filtres).
+        Sur toutes les sauvegardes, ou seulement run. Par ordre de chemin, puis de sauvegarde.
+        """
+        pattern = pattern.strip("/")
+        wildcard = _WILDCARDS.search(pattern)
+        if wildcard:
+            # Le préfixe fixe du motif (jusqu'au dernier « / » avant le premier joker) borne la recherche
+            fixed = pattern[:wildcard.start()]
+            prefix = fixed[:fixed.rfind("/") + 1] if "/" in fixed else ""
+            # Sans « / », le motif s'applique au nom à toute profondeur
+            regex = re.compile(translate(pattern)[0])
+        else:
+            prefix = pattern + "/" if pattern else ""
+            regex = None
+        conditions = []
+        params = []
+        if prefix:
+            conditions.append("path >= ? AND path < ?")
+            params += [prefix, prefix[:-1] + "0"]
+        if run is not None:
+            conditions.append("run = ?")
+            params.append(run)
+        found = 0
+        if pattern and not wildcard:
+            # L'élément lui-même, avant son contenu
+            query = f"SELECT {_COLUMNS} FROM entries WHERE path = ?" + (" AND run = ?" if run is not None else "")
+            for row in self._conn.execute(query, [pattern] + ([run] if run is not None else [])):
+                yield CatalogEntry(*row)
+                found += 1
+        last = None
+        while limit is None or found < limit:
+            where = conditions + (["(path, run) > (?, ?)"] if last is not None else [])
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM entries" + (" WHERE " + " AND ".join(where) if where else "")
+                + " ORDER BY path, run LIMIT 1000", params + (list(last) if last is not None else [])
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                if regex is None or regex.fullmatch(row[0]):
+                    yield CatalogEntry(*row)
+                    found += 1
+                    if limit is not None and found >= limit:
+                        return
+            last = (rows[-1][0], rows[-1][1])
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class RestoreEngine:
+    """
+    Restauration sélective depuis une destination, à partir du RestoreCatalog : les fichiers et
+    dossiers choisis d'une sauvegarde sont réécrits en parallèle dans target, ou à leur emplacement
+    d'origine (dossier parent de la source du même nom) si target est None.
+    Chaque fichier est écrit sous un nom provisoire, contrôlé (taille, et empreinte si la sauvegarde
+    en a une) puis renommé : un fichier restauré est toujours complet et conforme.
+    Un fichier déjà présent et identique (taille et date) est laissé tel quel ; s'il diffère, il n'est
+    remplacé qu'avec overwrite.
+    """
+    def __init__(self, destination, options=None, progress_func=None, journal_func=None):
+        self.destination = destination
+        self.options = options if options is not None else load_config()["options"]
+        self.progress_func = throttled_progress(progress_func)
+        self.journal_func = journal_func or ignore
+        self._abort = False
+        self._lock = threading.Lock()
+        self.restored = self.skipped = self.conflicts = self.failed = self.mismatched = 0
+        self.bytes = 0
+        self._done_bytes = 0
+        self._total_bytes = 1
+
+    def abort(self):
+        self._abort = True
+
+    def open_catalog(self):
+        catalog = RestoreCatalog(self.destination, log_func=self.journal_func,
+                                 compression_hint=bool(self.options.get("compression")))
+        try:
+            catalog.refresh(abort_func=lambda: self._abort)
+        except Exception:
+            catalog.close()
+            raise
+        return catalog
+
+    def run(self, paths=("",), run=None, target=None, overwrite=False, sources=None):
+        """
+        Restaure les chemins (ou motifs) paths de la sauvegarde run (la plus récente par défaut).
+        sources sert à retrouver l'emplacement d'origine quand target est None.
+        """
+        start_time = time.time()
+        journal = self.journal_func
+        with self.open_catalog() as catalog:
+            run = run or catalog.latest_run()
+            info = catalog.run_info(run) if run is not None else None
+            if info is None:
+                journal(f"Sauvegarde introuvable dans {self.destination} : {run}")
+                return None
+            entries = {}
+            for path in paths:
+                for entry in catalog.search(path, run):
+                    entries[entry.path] = entry
+        where = target if target is not None else "leur emplacement d'origine"
+        journal(f"Restauration de {len(entries)} éléments de la sauvegarde {run} ({info.kind}) vers {where}.")
+        roots = {os.path.basename(os.path.normpath(src)): os.path.dirname(os.path.normpath(src))
+                 for src in sources or ()}
+        self._total_bytes = sum(entry.size or 0 for entry in entries.values()) or 1
+        reader = self._reader(info, entries)
+        dirs = []
+        workers = max(1, int(self.options.get("parallel_copies", 1) or 1))
+        slots = threading.BoundedSemaphore(workers * 4)
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="restauration") as executor:
+                for path in sorted(entries):
+                    if self._abort:
+                        break
+                    entry = entries[path]
+                    dest = self._target_path(entry.path, target, roots)
+                    if dest is None:
+                        self._count("failed")
+                        journal(f"Emplacement d'origine inconnu pour {entry.path} (source absente de la configuration).")
+                        continue
+                    if entry.kind == KIND_DIR:
+                        try:
+                            os.makedirs(dest, exist_ok=True)
+                            dirs.append((dest, entry))
+                        except OSError as e:
+                            self._count("failed")
+                            journal(f"Impossible de restaurer {entry.path} : {e}")
+                        continue
+                    slots.acquire()
+                    future = executor.submit(self._restore_one, entry, dest, reader, overwrite)
+                    future.add_done_callback(lambda f: slots.release())
+        finally:
+            reader.close()
+        # Dates des dossiers en dernier : la création de leur contenu les modifie
+        for dest, entry in reversed(dirs):
+            try:
+                if entry.mode is not None:
+                    os.chmod(dest, stat.S_IMODE(entry.mode))
+                if entry.mtime_ns is not None:
+                    os.utime(dest, ns=(entry.mtime_ns, entry.mtime_ns))
+            except OSError:
+                pass
+        self.progress_func(100)
+        elapsed = time.time() - start_time
+        journal(f"Fin de la restauration : {self.restored} fichiers restaurés ({self.bytes / (1024 * 1024):.2f} Mo), "
+                f"{self.skipped} déjà à jour, {self.conflicts} conflits, {self.failed} échecs, "
+                f"{self.mismatched} empreintes différentes. Durée totale : {elapsed:.2f} secondes.")
+        return RestoreResult(self.restored, self.skipped, self.conflicts, self.failed, self.mismatched,
+                             self.bytes, self._abort, elapsed)
+
+    @staticmethod
+    def _target_path(rel, target, roots):
+        parts = rel.split("/")
+        if target is not None:
+            return long_path(os.path.join(target, *parts))
+        parent = roots.get(parts[0])
+        return long_path(os.path.join(parent, *parts)) if parent is not None else None
+
+    def _count(self, name, nbytes=0):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+            self.bytes += nbytes
+
+    def _advance(self, nbytes):
+        with self._lock:
+            self._done_bytes += nbytes
+            percent = min(99, int(self._done_bytes / self._total_bytes * 100))
+        self.progress_func(percent)
+
+    def _reader(self, info, entries):
+        if info.kind == RUN_REPO:
+            return _RepoReader(self.destination, info.name, entries)
+        return _StoredReader(info.location)
+
+    def _restore_one(self, entry, dest, reader, overwrite):
+        journal = self.journal_func
+        if self._abort:
+            return
+        try:
+            existing = os.lstat(dest) if os.path.lexists(dest) else None
+            if existing is not None:
+                if entry.kind == KIND_LINK:
+                    same = stat.S_ISLNK(existing.st_mode) and os.readlink(dest) == reader.link(entry)
+                else:
+                    same = (stat.S_ISREG(existing.st_mode) and existing.st_size == entry.size
+                            and existing.st_mtime_ns == entry.mtime_ns)
+                if same:
+                    self._count("skipped")
+                    self._advance(entry.size or 0)
+                    return
+                if not overwrite:
+                    self._count("conflicts")
+                    journal(f"Conflit : {dest} existe et diffère de la sauvegarde (non remplacé).")
+                    self._advance(entry.size or 0)
+                    return
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if entry.kind == KIND_LINK:
+                if existing is not None:
+                    os.remove(dest)
+                os.symlink(reader.link(entry), dest)
+                self._count("restored")
+                return
+            size = write_atomic(dest, lambda tmp: self._write(entry, tmp, reader))
+            if entry.mode is not None:
+                os.chmod(dest, stat.S_IMODE(entry.mode))
+            if entry.mtime_ns is not None:
+                os.utime(dest, ns=(entry.mtime_ns, entry.mtime_ns))
+            self._count("restored", size)
+        except _Mismatch as e:
+            self._count("mismatched")
+            journal(f"Intégrité : {entry.path} non restauré, {e}.")
+        except Exception as e:
+            self._count("failed")
+            journal(f"Impossible de restaurer {entry.path} : {e}")
+
+    def _write(self, entry, tmp, reader):
+        algo, _, expected = (entry.digest or "").partition(":")
+        hasher = new_hasher(algo) if expected else None
+        size = 0
+        with open(tmp, "wb") as f:
+            for block in reader.blocks(entry):
+                if self._abort:
+                    raise InterruptedError("restauration annulée")
+                f.write(block)
+                size += len(block)
+                if hasher is not None:
+                    hasher.update(block)
+                self._advance(len(block))
+        if entry.size is not None and size != entry.size:
+            raise _Mismatch(f"taille {size} au lieu de {entry.size}")
+        if hasher is not None and hasher.hexdigest() != expected:
+            raise _Mismatch(f"empreinte {hash_algo_name(algo)} différente")
+        return size
+
+class _Mismatch(Exception):
+    pass
+
+class _StoredReader:
+    """Lecture d'une copie miroir (y compris les paquets) ou d'un instantané."""
+    def __init__(self, root):
+        self.root = root
+        self.packs = PackStore(root) if PackStore.exists(root) else None
+
+    def _path(self, entry):
+        return long_path(os.path.join(self.root, *(entry.ref or entry.path).split("/")))
+
+    def link(self, entry):
+        return os.readlink(self._path(entry))
+
+    def blocks(self, entry):
+        if entry.kind == KIND_PACKED:
+            packed = self.packs.get(entry.path) if self.packs is not None else None
+            if packed is None:
+                raise FileNotFoundError(f"{entry.path} absent des paquets")
+            yield self.packs.read(packed)
+            return
+        path = self._path(entry)
+        if entry.ref is not None:
+            # Copie compressée, décompressée à la volée
+            yield from iter_plain_blocks(path, COPY_BLOCK_SIZE)
+            return
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(COPY_BLOCK_SIZE)
+                if not block:
+                    return
+                yield block
+
+    def close(self):
+        if self.packs is not None:
+            self.packs.close()
+
+class _RepoReader:
+    """Lecture d'une sauvegarde du dépôt à blocs : les fichiers sont reconstitués bloc par bloc."""
+    def __init__(self, destination, name, entries):
+        self.store = ChunkStore(destination)
+        # Listes de blocs des seuls fichiers choisis, relues dans le catalogue de la sauvegarde
+        self.chunks = {}
+        self.links = {}
+        for item in self.store.iter_entries(name):
+            if item["p"] in entries:
+                if item["k"] == KIND_FILE:
+                    self.chunks[item["p"]] = item["c"]
+                elif item["k"] == KIND_LINK:
+                    self.links[item["p"]] = item["l"]
+
+    def link(self, entry):
+        return self.links[entry.path]
+
+    def blocks(self, entry):
+        for cid in self.chunks[entry.path]:
+            # read_chunk contrôle l'empreinte de chaque bloc
+            yield self.store.read_chunk(cid)
+
+    def close(self):
+        pass
@@ -0,0 +1,273 @@
+import os
+import time
+import threading
+import datetime
+
+# Fenêtre de mesure du débit de chaque périphérique pour l'ajustement du parallélisme
+ADAPT_WINDOW = 1.0
+# Latence d'une opération au-delà de laquelle (en multiple de la meilleure observée) le parallélisme baisse
+LATENCY_FACTOR = 3.0
+# Granularité de la limitation de débit à l'intérieur d'un fichier
+THROTTLE_BLOCK = 4 * 1024 * 1024
+
+def _parse_time(text):
+    hours, _, minutes = text.partition(":")
+    return int(hours) * 60 + int(minutes or 0)
+
+class BandwidthSchedule:
+    """
+    Limite de débit en octets par seconde selon l'heure : default_mb (Mo/s, 0 = illimité) hors des plages,
+    et pour chaque plage {"start": "08:00", "end": "18:00", "limit_mb": 20} la limite de la plage.
+    Une plage dont la fin précède le début passe minuit.
+    """
+    def __init__(self, default_mb=0, rules=None):
+        self.default = int(default_mb * 1024 * 1024) if default_mb else 0
+        self.rules = []
+        for rule in rules or ():
+            limit = rule.get("limit_mb", 0)
+            self.rules.append((_parse_time(rule["start"]), _parse_time(rule["end"]),
+                               int(limit * 1024 * 1024) if limit else 0))
+
+    def rate(self, now=None):
+        now = now or datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, limit in self.rules:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return limit
+        return self.default
+
+    def __bool__(self):
+        return bool(self.default or any(limit for _, _, limit in self.rules))
+
+class TokenBucket:
+    """
+    Seau à jetons partagé par tous les threads de copie : consume(n) attend que n octets
+    puissent passer sans dépasser le débit. Le débit est relu dans le BandwidthSchedule
+    au plus une fois par seconde.
+    """
+    def __init__(self, schedule, burst_seconds=0.5):
+        self.schedule = schedule
+        self.burst_seconds = burst_seconds
+        self._lock = threading.Lock()
+        self._rate = schedule.rate()
+        self._rate_checked = time.monotonic()
+        self._tokens = self._capacity()
+        self._last = time.monotonic()
+        self.waited = 0.0
+
+    def _capacity(self):
+        return max(self._rate * self.burst_seconds, THROTTLE_BLOCK)
+
+    def consume(self, n, abort_func=None):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._rate_checked >= 1.0:
+                self._rate = self.schedule.rate()
+                self._rate_checked = now
+            if not self._rate:
+                # Hors des plages limitées et sans limite par défaut : aucune attente
+                return 0.0
+            self._tokens = min(self._capacity(), self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            # Le solde peut devenir négatif : la dette est remboursée par l'attente de ce thread,
+            # et les suivants attendent leur tour derrière elle
+            self._tokens -= n
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            self.waited += wait
+        remaining = wait
+        while remaining > 0 and not (abort_func and abort_func()):
+            time.sleep(min(remaining, 0.2))
+            remaining -= 0.2
+        return wait
+
+def physical_device(dev):
+    """
+    Identifiant du disque physique portant le système de fichiers dev, et indicateur « disque
+    rotatif » (None si inconnu). Sous Linux, les partitions d'un même disque sont regroupées
+    grâce à /sys ; ailleurs, chaque système de fichiers est considéré comme un périphérique.
+    """
+    try:
+        path = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+    except (AttributeError, ValueError, OSError):
+        return dev, None
+    if not os.path.isdir(path):
+        return dev, None
+    if os.path.exists(os.path.join(path, "partition")):
+        path = os.path.dirname(path)
+    try:
+        with open(os.path.join(path, "queue", "rotational")) as f:
+            rotational = f.read().strip() == "1"
+    except OSError:
+        rotational = None
+    return os.path.basename(path), rotational
+
+class DeviceLimiter:
+    """
+    Nombre d'opérations simultanées sur un périphérique, borné par limit.
+    En mode adaptatif, limit varie entre 1 et max_limit par recherche du meilleur débit :
+    à chaque fenêtre de mesure, on continue dans la même direction (+1 ou -1) si le débit
+    s'est amélioré, on repart dans l'autre sinon ; une latence qui s'envole fait baisser limit.
+    Une fenêtre pendant laquelle la limite de débit a freiné les copies ne dit rien du
+    périphérique : limit n'y change pas.
+    """
+    def __init__(self, name, limit, max_limit, adaptive=True, log_func=None):
+        self.name = name
+        self.limit = max(1, min(limit, max_limit))
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.log_func = log_func
+        self._cond = threading.Condition()
+        self._active = 0
+        self._direction = 1
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._window_ops = 0
+        self._window_throttled = False
+        self._last_throughput = None
+        self._best_latency = None
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self, nbytes=0, seconds=0.0, throttled=False):
+        with self._cond:
+            self._active -= 1
+            if self.adaptive:
+                self._observe(nbytes, seconds, throttled)
+            self._cond.notify_all()
+
+    def _observe(self, nbytes, seconds, throttled):
+        self._window_bytes += nbytes
+        self._window_latency += seconds
+        self._window_ops += 1
+        self._window_throttled = self._window_throttled or throttled
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < ADAPT_WINDOW:
+            return
+        throughput = self._window_bytes / elapsed
+        # Latence par Mo (les petits fichiers ne comptent que pour leur coût fixe)
+        latency = self._window_latency / max(self._window_bytes / (1024 * 1024), self._window_ops)
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._window_ops = 0
+        if self._window_throttled:
+            self._window_throttled = False
+            self._last_throughput = None
+            return
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        previous = self.limit
+        if latency > self._best_latency * LATENCY_FACTOR and self.limit > 1:
+            self._direction = -1
+        elif self._last_throughput is not None and throughput < self._last_throughput:
+            self._direction = -self._direction
+        self._last_throughput = throughput
+        self.limit = max(1, min(self.max_limit, self.limit + self._direction))
+        if self.limit != previous and self.log_func:
+            self.log_func(f"Périphérique {self.name} : {self.limit} copies simultanées "
+                          f"({throughput / (1024 * 1024):.1f} Mo/s).")
+
+class IOScheduler:
+    """
+    Couche d'ordonnancement sous le moteur de copie : chaque copie réserve une place sur le
+    périphérique physique de sa source et sur celui de sa destination (DeviceLimiter), et son
+    débit passe par un seau à jetons commun (TokenBucket) si une limite est configurée.
+    Les places sont toujours réservées dans le même ordre, ce qui exclut tout interblocage.
+    """
+    def __init__(self, max_concurrency=4, adaptive=True, schedule=None, log_func=None):
+        self.max_concurrency = max(1, int(max_concurrency or 1))
+        self.adaptive = adaptive
+        self.bucket = TokenBucket(schedule) if schedule else None
+        self.log_func = log_func
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._limiters = {}
+        # Attente due à la limite de débit dans chaque thread, exclue des mesures de latence
+        self._local = threading.local()
+
+    @classmethod
+    def from_options(cls, options, log_func=None):
+        """Construit l'ordonnanceur décrit par les options, ou None s'il n'a rien à faire."""
+        schedule = BandwidthSchedule(options.get("bandwidth_limit_mb", 0), options.get("bandwidth_schedule"))
+        workers = max(1, int(options.get("parallel_copies", 1) or 1))
+        max_concurrency = min(workers, int(options.get("device_max_concurrency", 0) or workers))
+        adaptive = bool(options.get("adaptive_concurrency", False))
+        if not schedule and not adaptive and max_concurrency >= workers:
+            return None
+        return cls(max_concurrency, adaptive, schedule, log_func)
+
+    def _limiter(self, dev):
+        with self._lock:
+            key = self._devices.get(dev)
+            if key is None:
+                key = self._devices[dev] = physical_device(dev)
+            name, rotational = key
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                # Disque rotatif : les accès simultanés provoquent des déplacements de tête. Sans ajustement,
+                # la limite configurée s'applique telle quelle (elle ne remonterait jamais)
+                start = min(2, self.max_concurrency) if rotational and self.adaptive else self.max_concurrency
+                limiter = self._limiters[name] = DeviceLimiter(name, start, self.max_concurrency,
+                                                               self.adaptive, self.log_func)
+            return limiter
+
+    def slot(self, *devs):
+        """Réserve une place sur chacun des périphériques devs (st_dev) ; à utiliser avec « with »."""
+        limiters = {}
+        for dev in devs:
+            if dev is not None:
+                limiter = self._limiter(dev)
+                limiters[limiter.name] = limiter
+        return _Slot([limiters[name] for name in sorted(limiters, key=str)], self)
+
+    def throttle(self, nbytes, abort_func=None):
+        if self.bucket is not None:
+            self._local.waited = self.throttled() + self.bucket.consume(nbytes, abort_func)
+
+    def throttled(self):
+        """Temps total passé par le thread courant à attendre la limite de débit."""
+        return getattr(self._local, "waited", 0.0)
+
+    def summary(self):
+        with self._lock:
+            limits = ", ".join(f"{name} : {limiter.limit}" for name, limiter in self._limiters.items())
+        text = f"Copies simultanées par périphérique : {limits}." if limits else ""
+        if self.bucket is not None and self.bucket.waited:
+            text += f" Attente due à la limite de débit : {self.bucket.waited:.1f} s."
+        return text.strip()
+
+class _Slot:
+    def __init__(self, limiters, scheduler):
+        self.limiters = limiters
+        self.scheduler = scheduler
+        self.bytes = 0
+        self._start = None
+        self._throttled = 0.0
+
+    def __enter__(self):
+        taken = []
+        try:
+            for limiter in self.limiters:
+                limiter.acquire()
+                taken.append(limiter)
+        except BaseException:
+            for limiter in taken:
+                limiter.release()
+            raise
+        self._throttled = self.scheduler.throttled()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        waited = self.scheduler.throttled() - self._throttled
+        seconds = max(0.0, time.monotonic() - self._start - waited)
+        for limiter in reversed(self.limiters):
+            limiter.release(self.bytes, seconds, waited > 0)
+        return False
@@ -0,0 +1,155 @@
+import os
+import stat
+import shutil
+import datetime
+from collections import namedtuple
+
+# Les instantanés sont rangés dans ce sous-dossier de la destination, un dossier horodaté par sauvegarde
+SNAPSHOT_DIR = "instantanes"
+STAMP_FORMAT = "%Y-%m-%d_%H%M%S"
+# Instantané en cours d'écriture : jamais pris comme référence ni compté par la rétention
+PARTIAL_SUFFIX = ".partiel"
+# Instantané en cours de suppression (renommé d'abord, pour disparaître immédiatement de la liste)
+DELETING_SUFFIX = ".suppression"
+
+Snapshot = namedtuple("Snapshot", "partial final previous")
+
+def snapshot_root(destination):
+    return os.path.join(destination, SNAPSHOT_DIR)
+
+def _parse(name):
+    # "2024-06-01_120000" ou "2024-06-01_120000-2" (deux sauvegardes dans la même seconde)
+    try:
+        return datetime.datetime.strptime(name[:17], STAMP_FORMAT)
+    except ValueError:
+        return None
+
+def list_snapshots(destination):
+    """Instantanés complets de destination, du plus ancien au plus récent : liste de (date, chemin)."""
+    root = snapshot_root(destination)
+    snapshots = []
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                when = _parse(entry.name)
+                if when is not None and not entry.name.endswith((PARTIAL_SUFFIX, DELETING_SUFFIX)):
+                    snapshots.append((when, entry.name, entry.path))
+    except FileNotFoundError:
+        return []
+    snapshots.sort()
+    return [(when, path) for when, _, path in snapshots]
+
+def latest_snapshot(destination):
+    snapshots = list_snapshots(destination)
+    return snapshots[-1][1] if snapshots else None
+
+def on_remove_error(func, path, exc_info):
+    """
+    Gestionnaire d'erreurs de shutil.rmtree pour les dossiers protégés (attributs copiés de la source) :
+    le dossier parent est rendu modifiable, puis la suppression est retentée. Un dossier illisible est
+    lui-même rendu accessible. Les fichiers ne sont jamais modifiés : liens physiques partagés avec les
+    instantanés conservés, leur mode changerait aussi dans ceux-ci.
+    """
+    try:
+        os.chmod(os.path.dirname(path), stat.S_IRWXU)
+        if os.path.isdir(path) and not os.path.islink(path):
+            os.chmod(path, stat.S_IRWXU)
+        func(path)
+    except OSError:
+        pass
+
+def remove_snapshot(path):
+    """Supprime un instantané : renommé d'abord, puis effacé (une suppression interrompue est reprise plus tard)."""
+    if not path.endswith(DELETING_SUFFIX):
+        doomed = path + DELETING_SUFFIX
+        os.rename(path, doomed)
+        path = doomed
+    shutil.rmtree(path, onerror=on_remove_error)
+
+def _cleanup(root, log_func=None):
+    # Restes d'une sauvegarde interrompue ou d'une suppression inachevée
+    try:
+        with os.scandir(root) as it:
+            leftovers = [entry.path for entry in it
+                         if entry.is_dir(follow_symlinks=False) and entry.name.endswith((PARTIAL_SUFFIX, DELETING_SUFFIX))]
+    except FileNotFoundError:
+        return
+    for path in leftovers:
+        if log_func:
+            log_func(f"Suppression de l'instantané incomplet {os.path.basename(path)}.")
+        try:
+            remove_snapshot(path)
+        except OSError as e:
+            if log_func:
+                log_func(f"Impossible de supprimer {path} : {e}")
+
+def begin_snapshot(destination, log_func=None, now=None):
+    """
+    Prépare un nouvel instantané : crée son dossier provisoire (suffixe .partiel) et retourne
+    un Snapshot (dossier provisoire, nom final, instantané précédent complet ou None).
+    """
+    root = snapshot_root(destination)
+    os.makedirs(root, exist_ok=True)
+    _cleanup(root, log_func)
+    stamp = (now or datetime.datetime.now()).strftime(STAMP_FORMAT)
+    final = os.path.join(root, stamp)
+    counter = 2
+    while os.path.exists(final) or os.path.exists(final + PARTIAL_SUFFIX):
+        final = os.path.join(root, f"{stamp}-{counter}")
+        counter += 1
+    previous = latest_snapshot(destination)
+    partial = final + PARTIAL_SUFFIX
+    os.makedirs(partial)
+    return Snapshot(partial, final, previous)
+
+def publish_snapshot(snapshot):
+    """Rend l'instantané visible sous son nom définitif."""
+    os.rename(snapshot.partial, snapshot.final)
+    return snapshot.final
+
+def select_kept(dates, keep_daily=7, keep_weekly=4, keep_last=1):
+    """
+    Indices des instantanés conservés (dates triées du plus ancien au plus récent) :
+    les keep_last plus récents (au moins un), le plus récent de chacun des keep_daily derniers
+    jours qui en ont un, et le plus récent de chacune des keep_weekly dernières semaines.
+    Un seul passage sur les dates, en partant des plus récentes.
+    """
+    kept = set(range(max(0, len(dates) - max(1, keep_last)), len(dates)))
+    days = set()
+    weeks = set()
+    for i in range(len(dates) - 1, -1, -1):
+        day = dates[i].date()
+        week = dates[i].isocalendar()[:2]
+        if day not in days and len(days) < keep_daily:
+            days.add(day)
+            kept.add(i)
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.add(week)
+            kept.add(i)
+        if len(days) >= keep_daily and len(weeks) >= keep_weekly:
+            break
+    return kept
+
+def prune_snapshots(destination, keep_daily=7, keep_weekly=4, keep_last=1, log_func=None):
+    """
+    Applique la politique de rétention et retourne le nombre d'instantanés supprimés.
+    Seuls les noms des instantanés sont examinés pour décider ; leur contenu n'est parcouru
+    que pour la suppression elle-même.
+    """
+    snapshots = list_snapshots(destination)
+    kept = select_kept([when for when, _ in snapshots], keep_daily, keep_weekly, keep_last)
+    removed = 0
+    for i, (when, path) in enumerate(snapshots):
+        if i in kept:
+            continue
+        try:
+            remove_snapshot(path)
+            removed += 1
+        except OSError as e:
+            if log_func:
+                log_func(f"Impossible de supprimer l'instantané {os.path.basename(path)} : {e}")
+    if removed and log_func:
+        log_func(f"Rétention : {removed} instantané(s) supprimé(s), {len(snapshots) - removed} conservé(s).")
+    return removed
@@ -0,0 +1,61 @@
+import os
+from backup_engine import BackupEngine
+from checkpoint import CHECKPOINT_NAME, Checkpoint
+from file_utils import DEFAULT_OPTIONS
+
+def _tree(src, dirs=6, files=10):
+    for d in range(dirs):
+        os.makedirs(src / f"d{d}")
+        for f in range(files):
+            with open(src / f"d{d}" / f"f{f}.txt", "w") as out:
+                out.write(f"{d}-{f}")
+
+def test_done_directories_survive_interruption(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path), "cle", batch_size=1)
+    first = checkpoint.submitted()
+    checkpoint.dir_done("src/a")
+    second = checkpoint.submitted()
+    checkpoint.dir_done("src/b")
+    checkpoint.finished(first, True, "src/a/x")
+    checkpoint.finished(second, False, "src/b/y")
+    checkpoint.close(completed=False)
+    resumed = Checkpoint(str(tmp_path), "cle")
+    assert resumed.skip("src/a")
+    assert not resumed.skip("src/b") and not resumed.skip("src")
+    resumed.close(completed=True)
+    assert not os.path.exists(tmp_path / CHECKPOINT_NAME)
+
+def test_other_backup_starts_over(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path), "cle", batch_size=1)
+    checkpoint.dir_done("src/a")
+    checkpoint.close(completed=False)
+    assert not Checkpoint(str(tmp_path), "autre").skip("src/a")
+
+def test_interrupted_backup_resumes_and_skips_completed_directories(tmp_path):
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    _tree(src)
+    options = dict(DEFAULT_OPTIONS, parallel_copies=1, metrics_dir="")
+    engine = BackupEngine([str(src)], str(dst), options)
+    on_copied = engine._on_copied
+    copied = []
+
+    def interrupt(item, digest):
+        on_copied(item, digest)
+        copied.append(item.rel)
+        if len(copied) == 35:
+            engine.abort()
+    engine._on_copied = interrupt
+    assert engine.run().aborted
+    assert os.path.exists(dst / CHECKPOINT_NAME)
+
+    resumed = BackupEngine([str(src)], str(dst), options)
+    result = resumed.run()
+    assert not result.aborted and result.failed == 0
+    # Les dossiers notés terminés ne sont pas reparcourus : leurs fichiers ne sont pas examinés
+    assert sum(resumed.report["files"].values()) <= 60 - 30
+    assert not os.path.exists(dst / CHECKPOINT_NAME)
+    for d in range(6):
+        for f in range(10):
+            with open(dst / "src" / f"d{d}" / f"f{f}.txt") as copy:
+                assert copy.read() == f"{d}-{f}"
@@ -0,0 +1,69 @@
+import io
+import os
+import random
+import chunkstore
+from backup_engine import BackupEngine
+from chunkstore import CUT_MASK, GEAR, GEAR_WINDOW, ChunkStore, chunk_id, find_cut, iter_chunks
+from file_utils import DEFAULT_OPTIONS
+
+def _reference_cut(buf, min_size, max_size):
+    # Hachage gear calculé octet par octet, tel que défini en tête de chunkstore
+    end = min(len(buf), max_size)
+    if end <= min_size:
+        return end
+    h = 0
+    for i in range(min_size - GEAR_WINDOW + 1, end):
+        h = ((h << 1) + GEAR[buf[i]]) & 0xFFFFFFFF
+        if i >= min_size and not h & CUT_MASK:
+            return i + 1
+    return end
+
+def test_cut_matches_byte_by_byte_gear(monkeypatch):
+    # Petites tranches : les coupures à cheval sur deux tranches sont aussi contrôlées
+    monkeypatch.setattr(chunkstore, "SCAN_SIZE", 1000)
+    rng = random.Random(3)
+    for _ in range(100):
+        buf = rng.randbytes(rng.randrange(0, 200000))
+        min_size = rng.randrange(GEAR_WINDOW, 5000)
+        max_size = min_size + rng.randrange(1, 300000)
+        assert find_cut(buf, min_size, max_size) == _reference_cut(buf, min_size, max_size)
+
+def test_insertion_only_changes_neighbouring_chunks():
+    rng = random.Random(5)
+    data = rng.randbytes(6 * 1024 * 1024)
+    edited = data[:100000] + b"insertion" + data[100000:]
+    before = [chunk_id(c) for c in iter_chunks(io.BytesIO(data))]
+    after = [chunk_id(c) for c in iter_chunks(io.BytesIO(edited))]
+    assert b"".join(iter_chunks(io.BytesIO(edited))) == edited
+    assert len(set(before) - set(after)) <= 1
+    # Un alphabet restreint (sans 0x00 ni saut de ligne) est aussi découpé selon son contenu
+    text = "".join(rng.choices("ACGT", k=4 * 1024 * 1024)).encode()
+    assert len(list(iter_chunks(io.BytesIO(text)))) > 2
+
+def _chunk_files(dst):
+    store = ChunkStore(str(dst))
+    return {name for _, _, names in os.walk(store.chunks_dir) for name in names}
+
+def test_prune_removes_unreferenced_chunks(tmp_path):
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    src.mkdir()
+    rng = random.Random(7)
+    with open(src / "garde.bin", "wb") as f:
+        f.write(rng.randbytes(200000))
+    with open(src / "change.bin", "wb") as f:
+        f.write(rng.randbytes(200000))
+    options = dict(DEFAULT_OPTIONS, chunk_store=True, metrics_dir="",
+                   snapshot_keep_last=1, snapshot_keep_daily=0, snapshot_keep_weekly=0)
+    assert BackupEngine([str(src)], str(dst), options).run().failed == 0
+    first = _chunk_files(dst)
+    with open(src / "change.bin", "wb") as f:
+        f.write(rng.randbytes(200000))
+    assert BackupEngine([str(src)], str(dst), options).run().failed == 0
+    store = ChunkStore(str(dst))
+    assert len(store.list_backups()) == 1
+    referenced = {cid for entry in store.iter_entries(store.latest_backup()) for cid in entry.get("c", ())}
+    assert _chunk_files(dst) == referenced
+    # Les blocs du fichier inchangé sont gardés, ceux de l'ancienne version effacés
+    assert first & referenced and first - referenced
+    assert store.verify(store.latest_backup()) == (len(referenced), 0, 0)
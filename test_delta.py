@@ -0,0 +1,49 @@
+import os
+import random
+import hashlib
+from delta import MIN_BLOCK_SIZE, delta_copy
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def _data(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+def test_in_place_update(tmp_path):
+    old = _data(8 * MIN_BLOCK_SIZE)
+    new = bytearray(old)
+    new[3 * MIN_BLOCK_SIZE + 10:3 * MIN_BLOCK_SIZE + 20] = b"x" * 10
+    _write(tmp_path / "s", bytes(new))
+    _write(tmp_path / "d", old)
+    result = delta_copy(str(tmp_path / "s"), str(tmp_path / "d"))
+    assert _read(tmp_path / "d") == bytes(new)
+    assert result.in_place
+    assert result.transferred < len(new) // 4
+    assert os.stat(tmp_path / "d").st_mtime_ns == os.stat(tmp_path / "s").st_mtime_ns
+
+def test_insertion_shifts_blocks(tmp_path):
+    old = _data(8 * MIN_BLOCK_SIZE)
+    new = old[:1000] + b"insertion" + old[1000:]
+    _write(tmp_path / "s", new)
+    _write(tmp_path / "d", old)
+    result = delta_copy(str(tmp_path / "s"), str(tmp_path / "d"))
+    assert _read(tmp_path / "d") == new
+    assert not result.in_place
+    assert result.transferred < len(new) // 4
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".delta-")]
+
+def test_shrink_grow_and_hash(tmp_path):
+    for size in (3 * MIN_BLOCK_SIZE + 123, 12 * MIN_BLOCK_SIZE + 5, 0):
+        new = _data(size, seed=size)
+        _write(tmp_path / "s", new)
+        _write(tmp_path / "d", _data(6 * MIN_BLOCK_SIZE))
+        hasher = hashlib.blake2b(digest_size=16)
+        result = delta_copy(str(tmp_path / "s"), str(tmp_path / "d"), hasher)
+        assert _read(tmp_path / "d") == new
+        assert result.size == size
+        assert hasher.hexdigest() == hashlib.blake2b(new, digest_size=16).hexdigest()
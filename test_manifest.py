@@ -0,0 +1,72 @@
+import os
+from manifest import INDEX_NAME, KIND_DIR, KIND_FILE, Manifest
+
+def _file(path, data=b"contenu"):
+    with open(path, "wb") as f:
+        f.write(data)
+    return os.stat(path)
+
+def test_records_survive_reopening(tmp_path):
+    st = _file(tmp_path / "a.txt")
+    with Manifest(str(tmp_path)) as index:
+        assert index.fresh and not index.trusted
+        index.record_dir("src")
+        index.record("src/a.txt", st, "blake2b:00ff")
+        index.record_dir("src/sous")
+        index.record("src/sous/b.txt", st)
+    with Manifest(str(tmp_path)) as index:
+        assert not index.fresh
+        row = index.get("src/a.txt")
+        assert row[0] == KIND_FILE and row[4] == "blake2b:00ff"
+        assert Manifest.matches(row, st)
+        assert index.has_dir("src/sous") and index.get("src/sous")[0] == KIND_DIR
+        assert index.children("src") == ["a.txt", "sous"]
+        assert index.count_hashed() == 1
+        assert list(index.iter_hashed()) == [("src/a.txt", "blake2b:00ff")]
+
+def test_modified_file_no_longer_matches(tmp_path):
+    st = _file(tmp_path / "a.txt")
+    with Manifest(str(tmp_path)) as index:
+        index.record("src/a.txt", st)
+        row = index.get("src/a.txt")
+    os.utime(tmp_path / "a.txt", ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert not Manifest.matches(row, os.stat(tmp_path / "a.txt"))
+    assert not Manifest.matches(None, st)
+
+def test_forget_removes_directory_contents(tmp_path):
+    st = _file(tmp_path / "a.txt")
+    with Manifest(str(tmp_path)) as index:
+        index.record_dir("src/sous")
+        index.record("src/sous/b.txt", st)
+        index.record("src/sous-frere.txt", st)
+        index.forget("src/sous")
+        assert index.get("src/sous") is None and index.get("src/sous/b.txt") is None
+        assert index.get("src/sous-frere.txt") is not None
+
+def test_trusted_only_after_verification(tmp_path):
+    with Manifest(str(tmp_path)) as index:
+        index.mark_verified()
+    with Manifest(str(tmp_path)) as index:
+        assert index.trusted
+    with Manifest(str(tmp_path), max_age_days=0) as index:
+        assert not index.trusted
+
+def test_corrupt_index_is_rebuilt(tmp_path):
+    with open(tmp_path / INDEX_NAME, "wb") as f:
+        f.write(b"ceci n'est pas une base SQLite" * 100)
+    messages = []
+    with Manifest(str(tmp_path), log_func=messages.append) as index:
+        assert index.fresh and index.get("a") is None
+    assert messages and os.path.exists(tmp_path / (INDEX_NAME + ".corrompu"))
+
+def test_check_root_forgets_recreated_destination(tmp_path):
+    root = tmp_path / "src"
+    root.mkdir()
+    st = _file(tmp_path / "a.txt")
+    with Manifest(str(tmp_path)) as index:
+        assert not index.check_root("src", str(root))
+        index.record("src/a.txt", st)
+        assert index.check_root("src", str(root))
+        root.rmdir()
+        assert not index.check_root("src", str(root))
+        assert index.get("src/a.txt") is None
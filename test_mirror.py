@@ -0,0 +1,98 @@
+import os
+import shutil
+from backup_engine import BackupEngine
+from file_utils import DEFAULT_OPTIONS
+from mirror import TRASH_DIR, MirrorCleaner
+
+def _options(**overrides):
+    options = dict(DEFAULT_OPTIONS, mirror_delete=True, mirror_trash=False, metrics_dir="")
+    options.update(overrides)
+    return options
+
+def _write(path, data="contenu"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(data)
+
+def _backup(src, dst, options):
+    return BackupEngine([str(src)], str(dst), options).run()
+
+def test_empty_source_root_keeps_destination(tmp_path):
+    src = tmp_path / "docs"
+    dst = tmp_path / "dst"
+    _write(str(src / "a.txt"))
+    _write(str(src / "sous" / "b.txt"))
+    _backup(src, dst, _options())
+    # Disque non monté, par exemple : la source existe mais est vide
+    shutil.rmtree(src)
+    os.mkdir(src)
+    _backup(src, dst, _options())
+    assert (dst / "docs" / "a.txt").exists()
+    assert (dst / "docs" / "sous" / "b.txt").exists()
+
+def test_missing_source_root_keeps_destination(tmp_path):
+    src = tmp_path / "docs"
+    dst = tmp_path / "dst"
+    _write(str(src / "a.txt"))
+    _backup(src, dst, _options())
+    os.remove(src / "a.txt")
+    os.rmdir(src)
+    _backup(src, dst, _options())
+    assert (dst / "docs" / "a.txt").exists()
+
+def test_deleted_file_removed_but_temporary_and_compressed_copies_kept(tmp_path):
+    # Sans index de confiance, la destination est relue : les fichiers qui ne viennent pas de la
+    # sauvegarde (copies provisoires, copies compressées) y sont visibles
+    src = tmp_path / "docs"
+    dst = tmp_path / "dst"
+    options = _options(incremental_index=False)
+    _write(str(src / "a.txt"))
+    _write(str(src / "supprime.txt"))
+    _backup(src, dst, options)
+    os.remove(src / "supprime.txt")
+    kept = [".a.txt.partiel", ".a.txt.gz.partiel", ".delta-x1y2", "a.txt.gz", "a.txt.zst"]
+    for name in kept:
+        _write(str(dst / "docs" / name))
+    _write(str(dst / "docs" / ".orphelin.txt.partiel"))
+    _backup(src, dst, options)
+    names = set(os.listdir(dst / "docs"))
+    assert "supprime.txt" not in names
+    assert ".orphelin.txt.partiel" not in names
+    assert set(kept) <= names
+    assert "a.txt" in names
+
+def test_kept_names():
+    cleaner = MirrorCleaner("dst")
+    assert cleaner._kept(".a.txt.partiel", ["a.txt"])
+    assert cleaner._kept(".a.txt.gz.partiel", ["a.txt"])
+    assert cleaner._kept(".delta-abc", [])
+    assert cleaner._kept("a.txt.zst", ["a.txt"])
+    assert not cleaner._kept(".b.txt.partiel", ["a.txt"])
+    assert not cleaner._kept("b.txt.gz", ["a.txt"])
+
+def test_trash_keeps_deleted_files(tmp_path):
+    src = tmp_path / "docs"
+    dst = tmp_path / "dst"
+    _write(str(src / "a.txt"))
+    _write(str(src / "vieux" / "b.txt"), "ancien")
+    _backup(src, dst, _options(mirror_trash=True))
+    os.remove(src / "vieux" / "b.txt")
+    os.rmdir(src / "vieux")
+    _backup(src, dst, _options(mirror_trash=True))
+    assert not (dst / "docs" / "vieux").exists()
+    assert (dst / "docs" / "a.txt").exists()
+    trashed = os.listdir(dst / TRASH_DIR)
+    assert len(trashed) == 1
+    with open(dst / TRASH_DIR / trashed[0] / "docs" / "vieux" / "b.txt") as f:
+        assert f.read() == "ancien"
+
+def test_without_trash_deleted_files_are_removed(tmp_path):
+    src = tmp_path / "docs"
+    dst = tmp_path / "dst"
+    _write(str(src / "a.txt"))
+    _write(str(src / "b.txt"))
+    _backup(src, dst, _options())
+    os.remove(src / "b.txt")
+    _backup(src, dst, _options())
+    assert not (dst / "docs" / "b.txt").exists()
+    assert not (dst / TRASH_DIR).exists()
@@ -0,0 +1,58 @@
+import os
+import random
+from packs import PACK_DIR, PackStore
+
+def _stat(tmp_path, name, data):
+    path = tmp_path / name
+    with open(path, "wb") as f:
+        f.write(data)
+    return os.stat(path)
+
+def _contents():
+    rng = random.Random(7)
+    return {f"src/d{i % 3}/f{i}.txt": rng.randbytes(rng.randrange(0, 3000)) for i in range(50)}
+
+def test_round_trip_across_packs(tmp_path):
+    dst = tmp_path / "dst"
+    contents = _contents()
+    st = _stat(tmp_path, "modele", b"x")
+    with PackStore(str(dst), pack_size=20000, batch_size=7) as store:
+        for rel, data in contents.items():
+            store.add(rel, data, st)
+        # Lecture avant écriture de l'index : les ajouts en attente sont visibles
+        assert store.read(store.get("src/d0/f0.txt")) == contents["src/d0/f0.txt"]
+    assert len([name for name in os.listdir(dst / PACK_DIR) if name.endswith(".pack")]) > 1
+    with PackStore(str(dst)) as store:
+        for rel, data in contents.items():
+            assert store.read(store.get(rel)) == data
+        assert [entry.path for entry in store.list("src/d1")] == sorted(r for r in contents if r.startswith("src/d1/"))
+        assert store.children("src") == []
+        assert store.children("src/d2") == sorted(r.rpartition("/")[2] for r in contents if r.startswith("src/d2/"))
+
+def test_rewrite_and_forget(tmp_path):
+    dst = tmp_path / "dst"
+    st = _stat(tmp_path, "modele", b"x")
+    with PackStore(str(dst)) as store:
+        store.add("a", b"ancien", st)
+        store.add("b", b"b", st)
+        store.add("a", b"nouveau", st)
+        store.forget("b")
+        assert store.get("b") is None
+    with PackStore(str(dst)) as store:
+        assert store.read(store.get("a")) == b"nouveau"
+        assert store.get("b") is None
+
+def test_extract_restores_attributes(tmp_path):
+    _stat(tmp_path, "modele", b"donnees")
+    os.chmod(tmp_path / "modele", 0o640)
+    os.utime(tmp_path / "modele", ns=(10 ** 18, 10 ** 18))
+    st = os.stat(tmp_path / "modele")
+    with PackStore(str(tmp_path / "dst")) as store:
+        store.add("f", b"donnees", st)
+        target = tmp_path / "sortie" / "f"
+        assert PackStore.matches(store.get("f"), st)
+        assert store.extract(store.get("f"), str(target)) == 7
+    with open(target, "rb") as f:
+        assert f.read() == b"donnees"
+    assert os.stat(target).st_mode & 0o777 == 0o640
+    assert os.stat(target).st_mtime_ns == 10 ** 18
@@ -0,0 +1,102 @@
+import os
+import random
+import filecmp
+from backup_engine import BackupEngine
+from file_utils import DEFAULT_OPTIONS
+from restore import RestoreCatalog, RestoreEngine
+
+def _tree(src):
+    rng = random.Random(3)
+    os.makedirs(src / "sous")
+    for i in range(8):
+        with open(src / f"petit{i}.txt", "wb") as f:
+            f.write(rng.randbytes(100 + i))
+    with open(src / "sous" / "texte.txt", "w") as f:
+        f.write("ligne de texte\n" * 5000)
+    with open(src / "sous" / "binaire.bin", "wb") as f:
+        f.write(rng.randbytes(300000))
+    os.symlink("texte.txt", src / "sous" / "lien")
+
+def _same_tree(a, b):
+    compare = filecmp.dircmp(a, b)
+    if compare.left_only or compare.right_only or compare.funny_files:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(a, b, compare.common_files, shallow=False)
+    if mismatch or errors:
+        return False
+    return all(_same_tree(os.path.join(a, d), os.path.join(b, d)) for d in compare.common_dirs)
+
+def _options(**overrides):
+    options = dict(DEFAULT_OPTIONS, hash_algo="blake2b", metrics_dir="")
+    options.update(overrides)
+    return options
+
+def _round_trip(tmp_path, options):
+    src = tmp_path / "docs"
+    dst = tmp_path / "dst"
+    _tree(src)
+    assert BackupEngine([str(src)], str(dst), options).run().failed == 0
+    target = tmp_path / "restaure"
+    result = RestoreEngine(str(dst), options).run([""], target=str(target))
+    assert result.failed == 0 and result.mismatched == 0 and result.conflicts == 0
+    assert _same_tree(str(src), str(target / "docs"))
+    assert os.readlink(target / "docs" / "sous" / "lien") == "texte.txt"
+    again = RestoreEngine(str(dst), options).run([""], target=str(target))
+    assert again.restored == 0 and again.skipped == result.restored
+    return dst
+
+def test_mirror_with_compression_and_packs(tmp_path):
+    _round_trip(tmp_path, _options(compression=True, pack_small_files=True))
+
+def test_snapshots(tmp_path):
+    _round_trip(tmp_path, _options(snapshots=True))
+
+def test_chunk_store(tmp_path):
+    _round_trip(tmp_path, _options(chunk_store=True))
+
+def test_search_and_partial_restore(tmp_path):
+    dst = _round_trip(tmp_path, _options())
+    with RestoreCatalog(str(dst)) as catalog:
+        catalog.refresh()
+        assert sorted(entry.path for entry in catalog.search("*.bin")) == ["docs/sous/binaire.bin"]
+    target = tmp_path / "partiel"
+    result = RestoreEngine(str(dst), _options()).run(["docs/sous/binaire.bin"], target=str(target))
+    assert result.restored == 1
+    assert os.listdir(target / "docs") == ["sous"]
+
+def test_altered_copy_is_reported(tmp_path):
+    dst = _round_trip(tmp_path, _options())
+    stored = dst / "docs" / "sous" / "binaire.bin"
+    st = os.stat(stored)
+    with open(stored, "r+b") as f:
+        f.seek(1000)
+        f.write(b"\xff" * 16)
+    # Même taille et même date : seule l'empreinte de l'index révèle la modification
+    os.utime(stored, ns=(st.st_atime_ns, st.st_mtime_ns))
+    target = tmp_path / "controle"
+    messages = []
+    result = RestoreEngine(str(dst), _options(), journal_func=messages.append).run([""], target=str(target))
+    assert result.mismatched == 1
+    assert not os.path.exists(target / "docs" / "sous" / "binaire.bin")
+    assert any("binaire.bin" in message for message in messages)
+
+def test_toggling_compression_leaves_one_copy(tmp_path):
+    src = tmp_path / "docs"
+    dst = tmp_path / "dst"
+    _tree(src)
+    # Fichier de la source dont le nom est celui d'une copie compressée : jamais supprimé
+    with open(src / "sous" / "texte.txt.zst", "wb") as f:
+        f.write(b"pas une copie")
+    stored = dst / "docs" / "sous" / "texte.txt"
+    for compression in (True, False, True):
+        with open(src / "sous" / "texte.txt", "a") as f:
+            f.write(f"compression {compression}\n" * 1000)
+        options = _options(compression=compression)
+        assert BackupEngine([str(src)], str(dst), options).run().failed == 0
+        assert os.path.exists(str(stored) + ".gz") == compression
+        assert os.path.exists(stored) != compression
+        assert os.path.exists(str(stored) + ".zst")
+    target = tmp_path / "restaure"
+    result = RestoreEngine(str(dst), _options()).run([""], target=str(target))
+    assert result.failed == 0 and result.mismatched == 0
+    assert _same_tree(str(src), str(target / "docs"))
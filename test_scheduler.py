@@ -0,0 +1,54 @@
+import datetime
+import unittest
+from scheduler import BandwidthSchedule, IOScheduler, TokenBucket
+
+WORKDAY = [{"start": "08:00", "end": "18:00", "limit_mb": 20}]
+
+def _window_excluding_now():
+    # Plage d'une heure qui commence dans deux heures : l'heure courante est hors plage
+    now = datetime.datetime.now()
+    start = now + datetime.timedelta(hours=2)
+    end = now + datetime.timedelta(hours=3)
+    return [{"start": start.strftime("%H:%M"), "end": end.strftime("%H:%M"), "limit_mb": 20}]
+
+class BandwidthScheduleTest(unittest.TestCase):
+    def test_rate_inside_and_outside_window(self):
+        schedule = BandwidthSchedule(0, WORKDAY)
+        self.assertEqual(schedule.rate(datetime.datetime(2026, 1, 5, 7, 19)), 0)
+        self.assertEqual(schedule.rate(datetime.datetime(2026, 1, 5, 9, 0)), 20 * 1024 * 1024)
+        self.assertEqual(schedule.rate(datetime.datetime(2026, 1, 5, 18, 0)), 0)
+
+    def test_window_past_midnight(self):
+        schedule = BandwidthSchedule(5, [{"start": "22:00", "end": "06:00", "limit_mb": 0}])
+        self.assertEqual(schedule.rate(datetime.datetime(2026, 1, 5, 23, 30)), 0)
+        self.assertEqual(schedule.rate(datetime.datetime(2026, 1, 5, 12, 0)), 5 * 1024 * 1024)
+
+class OffWindowThrottleTest(unittest.TestCase):
+    def test_consume_outside_window_does_not_wait(self):
+        bucket = TokenBucket(BandwidthSchedule(0, _window_excluding_now()))
+        self.assertEqual(bucket.consume(64 * 1024 * 1024), 0.0)
+        self.assertEqual(bucket.waited, 0.0)
+
+    def test_throttle_outside_window(self):
+        scheduler = IOScheduler.from_options({"parallel_copies": 2, "bandwidth_schedule": _window_excluding_now()})
+        self.assertIsNotNone(scheduler.bucket)
+        scheduler.throttle(64 * 1024 * 1024)
+        scheduler.throttle(64 * 1024 * 1024)
+        self.assertEqual(scheduler.throttled(), 0.0)
+
+class FromOptionsTest(unittest.TestCase):
+    def test_parallel_copies_alone_needs_no_scheduler(self):
+        self.assertIsNone(IOScheduler.from_options({"parallel_copies": 8}))
+
+    def test_rotational_disk_keeps_configured_limit_without_adaptation(self):
+        scheduler = IOScheduler.from_options({"parallel_copies": 4, "bandwidth_limit_mb": 50})
+        scheduler._devices[1] = ("disque", True)
+        self.assertEqual(scheduler._limiter(1).limit, 4)
+
+    def test_adaptive_rotational_disk_starts_low(self):
+        scheduler = IOScheduler.from_options({"parallel_copies": 4, "adaptive_concurrency": True})
+        scheduler._devices[1] = ("disque", True)
+        self.assertEqual(scheduler._limiter(1).limit, 2)
+
+if __name__ == "__main__":
+    unittest.main()
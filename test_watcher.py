@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+import pytest
+from watcher import ChangeQueue, InotifyWatcher
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify (Linux uniquement)")
+
+def _fd_open(fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        return False
+    return True
+
+def test_stop_without_start_closes_descriptor(tmp_path):
+    watcher = InotifyWatcher([str(tmp_path)], ChangeQueue())
+    fd = watcher._fd
+    watcher.stop()
+    assert not _fd_open(fd)
+    watcher.stop()
+
+def test_changes_are_queued(tmp_path):
+    queue = ChangeQueue(debounce=0)
+    watcher = InotifyWatcher([str(tmp_path)], queue)
+    fd = watcher._fd
+    watcher.start()
+    (tmp_path / "nouveau.txt").write_text("x")
+    deadline = time.monotonic() + 5
+    while not queue.pending() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    watcher.stop()
+    watcher.join()
+    assert queue.pending()
+    assert not _fd_open(fd)
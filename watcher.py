@@ -0,0 +1,271 @@
+import os
+import sys
+import errno
+import select
+import struct
+import threading
+import time
+
+# Constantes inotify (linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct("iIII")
+
+class ChangeQueue:
+    """
+    File des chemins modifiés, regroupés et dédoublonnés.
+    Les chemins ne sont rendus qu'après debounce secondes sans nouvelle notification
+    (ou au plus tard après max_delay secondes), pour qu'une rafale de modifications
+    ne déclenche qu'une sauvegarde. Au-delà de max_paths chemins, la file déborde :
+    une vérification complète est alors demandée à la place.
+    """
+    def __init__(self, debounce=5.0, max_delay=60.0, max_paths=100000):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_paths = max_paths
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._overflow = False
+        self._first_event = None
+        self._last_event = None
+
+    def add(self, path, recursive=True):
+        with self._lock:
+            now = time.monotonic()
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+            if self._overflow:
+                return
+            self._paths[path] = self._paths.get(path, False) or recursive
+            if len(self._paths) > self.max_paths:
+                self._overflow = True
+                self._paths.clear()
+
+    def mark_overflow(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+            self._overflow = True
+            self._paths.clear()
+
+    def pending(self):
+        with self._lock:
+            return len(self._paths) or (1 if self._overflow else 0)
+
+    def drain(self, force=False):
+        """
+        Retourne (chemins, débordement) si la rafale en cours est terminée, sinon None.
+        Les chemins sont triés et ceux déjà couverts par un dossier parent récursif sont retirés.
+        """
+        with self._lock:
+            if self._first_event is None:
+                return None
+            now = time.monotonic()
+            quiet = now - self._last_event >= self.debounce
+            too_old = now - self._first_event >= self.max_delay
+            if not (force or quiet or too_old):
+                return None
+            paths, overflow = self._paths, self._overflow
+            self._paths = {}
+            self._overflow = False
+            self._first_event = self._last_event = None
+        return _coalesce(paths), overflow
+
+def _coalesce(paths):
+    result = []
+    covering = []  # dossiers récursifs retenus, préfixes avec séparateur final
+    # Tri par composants : le contenu d'un dossier suit immédiatement le dossier lui-même
+    for path in sorted(paths, key=lambda p: p.split(os.sep)):
+        if any(path.startswith(prefix) for prefix in covering[-1:]):
+            continue
+        result.append((path, paths[path]))
+        if paths[path]:
+            covering.append(path.rstrip(os.sep) + os.sep)
+    return result
+
+class InotifyWatcher(threading.Thread):
+    """
+    Surveillance Linux par inotify : un watch par dossier, ajouté au fil des créations.
+    Un débordement de la file du noyau, ou l'impossibilité d'ajouter un watch, est signalé
+    à la ChangeQueue pour déclencher une vérification complète.
+    """
+    def __init__(self, roots, queue, log_func=None):
+        super().__init__(daemon=True, name="surveillance")
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._ctypes = ctypes
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.queue = queue
+        self.log_func = log_func
+        self._stopping = threading.Event()
+        self._wds = {}
+        self._fd_lock = threading.Lock()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        try:
+            for root in self.roots:
+                self._watch_tree(root, strict=True)
+        except Exception:
+            self.close()
+            raise
+
+    def _log(self, msg):
+        if self.log_func:
+            self.log_func(msg)
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self._wds[wd] = path
+
+    def _watch_tree(self, root, strict=False):
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                self._add_watch(path)
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    # Limite fs.inotify.max_user_watches atteinte
+                    if strict:
+                        raise
+                    self._log("Limite de surveillance inotify atteinte : vérification complète programmée.")
+                    self.queue.mark_overflow()
+                    return
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    raise
+
+    def run(self):
+        try:
+            while not self._stopping.is_set():
+                ready, _, _ = select.select([self._fd], [], [], 1.0)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self._handle(data)
+        finally:
+            self.close()
+
+    def _handle(self, data):
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self._log("File d'événements de surveillance saturée : vérification complète programmée.")
+                self.queue.mark_overflow()
+                continue
+            if mask & IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+            parent = self._wds.get(wd)
+            if parent is None:
+                continue
+            path = os.path.join(parent, os.fsdecode(name)) if name else parent
+            created = bool(mask & (IN_CREATE | IN_MOVED_TO))
+            if mask & IN_ISDIR and created:
+                self._watch_tree(path)
+            # Un dossier qui apparaît est parcouru entièrement ; un simple changement d'attributs non
+            self.queue.add(path, recursive=created or not mask & IN_ISDIR)
+
+    def stop(self):
+        self._stopping.set()
+        if not self.is_alive():
+            # Jamais démarré (ou déjà terminé) : run ne fermera pas le descripteur
+            self.close()
+
+    def close(self):
+        """Ferme le descripteur inotify (et retire tous les watches) ; sans effet s'il l'est déjà."""
+        with self._fd_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+class PollingWatcher(threading.Thread):
+    """
+    Surveillance de repli par scrutation : seuls les dossiers sont relus, et un dossier dont
+    la date de modification a changé (ajout, suppression, renommage) est signalé pour un examen
+    de son contenu direct. Les fichiers modifiés sur place sans changement du dossier sont
+    rattrapés par la vérification complète périodique.
+    """
+    def __init__(self, roots, queue, interval=60.0, log_func=None):
+        super().__init__(daemon=True, name="surveillance")
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.queue = queue
+        self.interval = interval
+        self.log_func = log_func
+        self._stopping = threading.Event()
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        stack = list(self.roots)
+        while stack:
+            path = stack.pop()
+            try:
+                snapshot[path] = os.stat(path).st_mtime_ns
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+        return snapshot
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            snapshot = self._scan()
+            for path, mtime in snapshot.items():
+                previous = self._snapshot.get(path)
+                if previous is None:
+                    self.queue.add(path, recursive=True)
+                elif previous != mtime:
+                    self.queue.add(path, recursive=False)
+            self._snapshot = snapshot
+
+    def stop(self):
+        self._stopping.set()
+
+def create_watcher(roots, queue, poll_interval=60.0, log_func=None):
+    """
+    Crée le mécanisme de surveillance adapté : inotify sous Linux, scrutation sinon
+    (ou si inotify est indisponible, par exemple quand la limite de watches est atteinte).
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, queue, log_func)
+        except Exception as e:
+            if log_func:
+                log_func(f"Surveillance inotify indisponible ({e}) : scrutation toutes les {poll_interval:.0f} s.")
+    return PollingWatcher(roots, queue, poll_interval, log_func)